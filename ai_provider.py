@@ -3,92 +3,253 @@ AI Provider module for the Roblox Studio AI Plugin server.
 Handles interactions with different AI model providers.
 """
 import os
+import abc
 import json
+import time
 import requests
-from typing import Dict, List, Optional, Any, Tuple
+from requests.adapters import HTTPAdapter
+from typing import Dict, List, Optional, Any, Callable, Iterator, Tuple
 import config
-import openai
+from response_cache import response_cache, cache_key
+from single_flight import single_flight
+from resilience import resilience, failover_chain, check_deadline, ProviderError
+from hedging import hedger
 
-class AIProvider:
-    def __init__(self):
-        self.providers = config.providers
-        self.default_provider = config.config["DEFAULT_PROVIDER"]
-        self.default_model = config.config["DEFAULT_MODEL"]
-        
-        # Set up OpenAI API for OpenRouter
-        openai.api_key = config.config["OPENROUTER_API_KEY"]
-        openai.api_base = self.providers["openrouter"]["api_base"]
+def create_session() -> requests.Session:
+    """Create a keep-alive HTTP session with a tuned connection pool."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=config.config["HTTP_POOL_CONNECTIONS"],
+        pool_maxsize=config.config["HTTP_POOL_MAXSIZE"],
+        max_retries=0
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def session_stats(session: requests.Session) -> Dict[str, Any]:
+    """Get connection reuse counters of a session's pools, per host."""
+    hosts = {}
+    for prefix, adapter in session.adapters.items():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{key.key_scheme}://{key.key_host}:{key.key_port}"
+            hosts[host] = {
+                "requests": pool.num_requests,
+                "connections": pool.num_connections,
+                "reused": max(pool.num_requests - pool.num_connections, 0),
+                "idle": sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0,
+                "maxsize": pool.pool.maxsize if pool.pool else 0
+            }
     
-    def generate_response(self, provider: str, model: str, messages: List[Dict[str, str]], 
-                         system_prompt: Optional[str] = None) -> Tuple[bool, str, Dict[str, Any]]:
-        """Generate a response from the specified AI provider and model."""
-        if provider not in self.providers:
-            return False, f"Provider '{provider}' not supported", {}
+    return {
+        "requests": sum(host["requests"] for host in hosts.values()),
+        "connections": sum(host["connections"] for host in hosts.values()),
+        "reused": sum(host["reused"] for host in hosts.values()),
+        "hosts": hosts
+    }
+
+class ProviderClient(abc.ABC):
+    """Client for one provider, configured once: its own session, API key, base URL and timeouts.
+    
+    Clients share no mutable state, so any number of threads can generate
+    through them concurrently. Building requests and parsing responses is
+    kept apart from sending them, which async_provider.py does with aiohttp.
+    """
+    
+    # Sampling parameters sent with every request (part of the response cache key)
+    params = {"temperature": 0.7, "max_tokens": 1024}
+    # Name used in error messages
+    label = None
+    # How streamed responses are framed: "sse", "ndjson", or None without streaming
+    stream_format = None
+    
+    def __init__(self, name: str, provider_config: Dict[str, Any]):
+        self.name = name
+        self.label = self.label or name
+        self.api_base = provider_config["api_base"].rstrip("/")
+        self.api_key = config.config.get(f"{name.upper()}_API_KEY", "")
+        self.timeout = (
+            provider_config.get("connect_timeout", config.config["HTTP_CONNECT_TIMEOUT"]),
+            provider_config.get("read_timeout", config.config["HTTP_READ_TIMEOUT"])
+        )
+        self.session = create_session()
+    
+    def headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+    
+    @abc.abstractmethod
+    def request(self, model: str, messages: List[Dict[str, str]], stream: bool = False) -> Tuple[str, Dict[str, Any]]:
+        """Get the URL and JSON payload of a generation request, or raise ProviderError."""
+    
+    @abc.abstractmethod
+    def parse_response(self, result: Any) -> Tuple[str, Any]:
+        """Get (content, raw response) from a response body, or raise ProviderError."""
+    
+    def event_text(self, event: Dict[str, Any]) -> Optional[str]:
+        """Get the text of a streamed event, raising RuntimeError for error events."""
+        return None
+    
+    def is_last_event(self, event: Dict[str, Any]) -> bool:
+        """Check if a streamed event ends the response."""
+        return bool(event.get("done"))
+    
+    def incomplete_stream(self) -> ProviderError:
+        """Error for a stream that ended without its last event (e.g. a dropped connection)."""
+        return ProviderError(f"Incomplete response from {self.label} API: the stream ended early",
+                             self.name, retryable=True)
+    
+    def is_streamed(self, content_type: str) -> bool:
+        """Check if a response to a streamed request is actually streamed."""
+        # Some servers (e.g. Hugging Face models without text-generation-inference) answer in one piece
+        return self.stream_format != "sse" or content_type.startswith("text/event-stream")
+    
+    def generate(self, model: str, messages: List[Dict[str, str]],
+                 timeout: Optional[Tuple[float, float]] = None) -> Tuple[str, Dict[str, Any]]:
+        """Generate a response; returns (content, raw response) or raises ProviderError."""
+        url, payload = self.request(model, messages)
+        response = self._post(url, payload, timeout, stream=True)
+        return self.parse_response(self._read_json(response, timeout))
+    
+    def stream(self, model: str, messages: List[Dict[str, str]],
+               timeout: Optional[Tuple[float, float]] = None) -> Iterator[str]:
+        """Start a streamed response; returns an iterator of text chunks or raises ProviderError.
         
-        if model not in self.providers[provider]["models"].values():
-            # Check if it's a shorthand model name
-            if model in self.providers[provider]["models"]:
-                model = self.providers[provider]["models"][model]
-            else:
-                return False, f"Model '{model}' not supported by provider '{provider}'", {}
+        Providers without streaming yield the whole response as one chunk.
+        """
+        if self.stream_format is None:
+            content, _ = self.generate(model, messages, timeout)
+            return iter((content,))
         
-        # Add system prompt if provided
-        if system_prompt and messages and messages[0]["role"] != "system":
-            messages.insert(0, {"role": "system", "content": system_prompt})
+        url, payload = self.request(model, messages, stream=True)
+        response = self._post(url, payload, timeout, stream=True)
+        if not self.is_streamed(response.headers.get("Content-Type", "")):
+            return iter((self.parse_response(self._read_json(response, timeout))[0],))
         
-        # Generate response based on provider
-        try:
-            if self.providers[provider]["api_format"] == "openai":
-                return self._generate_openai_format(provider, model, messages)
-            elif self.providers[provider]["api_format"] == "huggingface":
-                return self._generate_huggingface_format(provider, model, messages)
-            elif self.providers[provider]["api_format"] == "ollama":
-                return self._generate_ollama_format(provider, model, messages)
-            else:
-                return False, f"API format '{self.providers[provider]['api_format']}' not supported", {}
-        except Exception as e:
-            return False, f"Error generating response: {str(e)}", {}
-    
-    def _generate_openai_format(self, provider: str, model: str, 
-                              messages: List[Dict[str, str]]) -> Tuple[bool, str, Dict[str, Any]]:
-        """Generate a response using OpenAI-compatible API format."""
-        # Save current API settings
-        current_api_key = openai.api_key
-        current_api_base = openai.api_base
+        def chunks() -> Iterator[str]:
+            for line in iter_stream_lines(response):
+                # Each line may arrive just within the read timeout; the whole stream must beat the deadline
+                check_deadline(timeout, self.name)
+                event = parse_stream_line(line, self.stream_format)
+                if event is None:
+                    continue
+                text = self.event_text(event)
+                if text:
+                    yield text
+                if self.is_last_event(event):
+                    return
+            raise self.incomplete_stream()
         
+        return chunks()
+    
+    def _post(self, url: str, payload: Dict[str, Any], timeout: Optional[Tuple[float, float]],
+              stream: bool = False) -> requests.Response:
+        """POST a request, raising ProviderError unless it succeeds."""
+        response = self.session.post(url, headers=self.headers(), json=payload,
+                                     timeout=timeout or self.timeout, stream=stream)
+        if response.status_code != 200:
+            raise ProviderError.from_response(self.name, self.label, response)
+        return response
+    
+    def _read_json(self, response: requests.Response, timeout: Optional[Tuple[float, float]]) -> Any:
+        """Read a response's JSON body within the call's deadline (closing the response)."""
+        body = []
         try:
-            # Set API settings for the provider
-            if provider == "openrouter":
-                openai.api_key = config.config["OPENROUTER_API_KEY"]
-            else:
-                # For other OpenAI-compatible providers
-                openai.api_key = config.config.get(f"{provider.upper()}_API_KEY", "")
-            
-            openai.api_base = self.providers[provider]["api_base"]
-            
-            # Generate response
-            response = openai.ChatCompletion.create(
-                model=model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1024
-            )
-            
-            content = response.choices[0].message.content
-            return True, content, response
+            for chunk in response.iter_content(chunk_size=16 * 1024):
+                check_deadline(timeout, self.name)
+                body.append(chunk)
+        finally:
+            response.close()
         
+        try:
+            return json.loads(b"".join(body))
+        except ValueError as e:
+            raise ProviderError(f"Invalid response from {self.label} API: {str(e)}", self.name)
+
+def iter_stream_lines(response: requests.Response) -> Iterator[str]:
+    """Yield the non-empty lines of a streamed response, closing it when done."""
+    # Streams are UTF-8 (requests would otherwise assume ISO-8859-1 for text/* or return bytes)
+    response.encoding = "utf-8"
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if line:
+                yield line
+    finally:
+        response.close()
+
+def parse_stream_line(line: str, stream_format: str) -> Optional[Dict[str, Any]]:
+    """Parse a line of a streamed response: a Server-Sent Events data field or a JSON line.
+    
+    Returns None for lines without an event, and {"done": True} for the end
+    of an SSE stream ([DONE]).
+    """
+    if stream_format == "sse":
+        # Skip comments (": keep-alive") and event/id fields
+        if not line.startswith("data:"):
+            return None
+        line = line[5:].strip()
+        if line == "[DONE]":
+            return {"done": True}
+    
+    try:
+        event = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    return event if isinstance(event, dict) else None
+
+def prefetch_first(chunks: Iterator[str]) -> Iterator[str]:
+    """Wait for a stream's first chunk (raising its errors now), then return an iterator over all chunks."""
+    first = next(chunks, None)
+    
+    def all_chunks() -> Iterator[str]:
+        try:
+            if first is not None:
+                yield first
+                yield from chunks
         finally:
-            # Restore original API settings
-            openai.api_key = current_api_key
-            openai.api_base = current_api_base
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
     
-    def _generate_huggingface_format(self, provider: str, model: str, 
-                                   messages: List[Dict[str, str]]) -> Tuple[bool, str, Dict[str, Any]]:
-        """Generate a response using Hugging Face Inference API format."""
-        api_key = config.config["HUGGINGFACE_API_KEY"]
-        if not api_key:
-            return False, "Hugging Face API key not configured", {}
+    return all_chunks()
+
+class OpenAIClient(ProviderClient):
+    """OpenAI-compatible chat completions API (e.g. OpenRouter)."""
+    
+    stream_format = "sse"
+    
+    def request(self, model: str, messages: List[Dict[str, str]], stream: bool = False) -> Tuple[str, Dict[str, Any]]:
+        payload = dict(self.params, model=model, messages=messages)
+        if stream:
+            payload["stream"] = True
+        return f"{self.api_base}/chat/completions", payload
+    
+    def parse_response(self, result: Any) -> Tuple[str, Any]:
+        choices = result.get("choices") if isinstance(result, dict) else None
+        if not choices:
+            raise ProviderError(f"Invalid response format from {self.label} API", self.name)
         
+        content = (choices[0].get("message") or {}).get("content") or ""
+        return content, result
+    
+    def event_text(self, event: Dict[str, Any]) -> Optional[str]:
+        if event.get("error"):
+            raise RuntimeError(f"Error from {self.label} API: {event['error']}")
+        return "".join((choice.get("delta") or {}).get("content") or "" for choice in event.get("choices") or [])
+
+class HuggingFaceClient(ProviderClient):
+    """Hugging Face Inference API."""
+    
+    label = "Hugging Face"
+    stream_format = "sse"
+    
+    def payload(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
         # Convert messages to a single prompt
         prompt = ""
         for message in messages:
@@ -104,41 +265,52 @@ class AIProvider:
         
         prompt += "<|assistant|>\n"
         
-        # Make API request
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
+        return {
             "inputs": prompt,
             "parameters": {
-                "max_new_tokens": 1024,
-                "temperature": 0.7,
+                "max_new_tokens": self.params["max_tokens"],
+                "temperature": self.params["temperature"],
                 "return_full_text": False
             }
         }
-        
-        api_url = f"{self.providers[provider]['api_base']}/{model}"
-        response = requests.post(api_url, headers=headers, json=payload)
-        
-        if response.status_code != 200:
-            return False, f"Error from Hugging Face API: {response.text}", {}
-        
-        result = response.json()
-        
-        # Extract the generated text
+    
+    def request(self, model: str, messages: List[Dict[str, str]], stream: bool = False) -> Tuple[str, Dict[str, Any]]:
+        if not self.api_key:
+            raise ProviderError("Hugging Face API key not configured", self.name)
+        payload = self.payload(messages)
+        if stream:
+            payload["stream"] = True
+        return f"{self.api_base}/{model}", payload
+    
+    def parse_response(self, result: Any) -> Tuple[str, Any]:
         if isinstance(result, list) and len(result) > 0:
-            content = result[0].get("generated_text", "")
-            return True, content, result
-        
-        return False, "Invalid response format from Hugging Face API", {}
+            return result[0].get("generated_text", ""), result
+        raise ProviderError("Invalid response format from Hugging Face API", self.name)
     
-    def _generate_ollama_format(self, provider: str, model: str, 
-                              messages: List[Dict[str, str]]) -> Tuple[bool, str, Dict[str, Any]]:
-        """Generate a response using Ollama API format."""
-        base_url = config.config["OLLAMA_BASE_URL"]
-        
+    def event_text(self, event: Dict[str, Any]) -> Optional[str]:
+        if event.get("error"):
+            raise RuntimeError(f"Error from Hugging Face API: {event['error']}")
+        token = event.get("token") or {}
+        return token.get("text") if not token.get("special") else None
+    
+    def is_last_event(self, event: Dict[str, Any]) -> bool:
+        # text-generation-inference sends no [DONE]; the last event carries the whole generated text
+        return event.get("generated_text") is not None or super().is_last_event(event)
+
+class OllamaClient(ProviderClient):
+    """Self-hosted Ollama API."""
+    
+    label = "Ollama"
+    # Ollama uses each model's own defaults
+    params = {}
+    # One JSON object per line, the last with "done": true
+    stream_format = "ndjson"
+    
+    def __init__(self, name: str, provider_config: Dict[str, Any]):
+        super().__init__(name, provider_config)
+        self.base_url = config.config["OLLAMA_BASE_URL"].rstrip("/")
+    
+    def payload(self, model: str, messages: List[Dict[str, str]], stream: bool = False) -> Dict[str, Any]:
         # Convert messages to Ollama format
         prompt = ""
         for message in messages:
@@ -154,22 +326,279 @@ class AIProvider:
         
         prompt += "Assistant: "
         
-        # Make API request
-        payload = {
+        return {
             "model": model,
             "prompt": prompt,
-            "stream": False
+            "stream": stream
         }
+    
+    def request(self, model: str, messages: List[Dict[str, str]], stream: bool = False) -> Tuple[str, Dict[str, Any]]:
+        return f"{self.base_url}/generate", self.payload(model, messages, stream)
+    
+    def parse_response(self, result: Any) -> Tuple[str, Any]:
+        return result.get("response", ""), result
+    
+    def event_text(self, event: Dict[str, Any]) -> Optional[str]:
+        if event.get("error"):
+            raise RuntimeError(f"Error from Ollama API: {event['error']}")
+        return event.get("response")
+
+# Client class for each provider "api_format"
+CLIENT_CLASSES = {
+    "openai": OpenAIClient,
+    "huggingface": HuggingFaceClient,
+    "ollama": OllamaClient
+}
+
+class AIProvider:
+    def __init__(self):
+        self.providers = config.providers
+        self.default_provider = config.config["DEFAULT_PROVIDER"]
+        self.default_model = config.config["DEFAULT_MODEL"]
+        
+        # One isolated client per provider, built once from the configuration
+        self.clients = {
+            name: CLIENT_CLASSES[provider_config["api_format"]](name, provider_config)
+            for name, provider_config in self.providers.items()
+            if provider_config["api_format"] in CLIENT_CLASSES
+        }
+    
+    def get_resilience_stats(self) -> Dict[str, Any]:
+        """Get retry counters, circuit breaker states and hedging statistics."""
+        return dict(resilience.get_stats(), hedging=hedger.get_stats())
+    
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Get connection pool reuse counters per provider."""
+        return {name: session_stats(client.session) for name, client in self.clients.items()}
+    
+    def resolve(self, provider: str, model: str) -> Tuple[Optional[ProviderClient], str]:
+        """Get a provider's client and full model name, or (None, error message)."""
+        if provider not in self.providers:
+            return None, f"Provider '{provider}' not supported"
         
-        response = requests.post(f"{base_url}/generate", json=payload)
+        if model not in self.providers[provider]["models"].values():
+            # Check if it's a shorthand model name
+            if model in self.providers[provider]["models"]:
+                model = self.providers[provider]["models"][model]
+            else:
+                return None, f"Model '{model}' not supported by provider '{provider}'"
         
-        if response.status_code != 200:
-            return False, f"Error from Ollama API: {response.text}", {}
+        client = self.clients.get(provider)
+        if client is None:
+            return None, f"API format '{self.providers[provider]['api_format']}' not supported"
+        return client, model
+    
+    def failover_targets(self, provider: str, model: str) -> List[Tuple[ProviderClient, str]]:
+        """Get the (client, full model name) pairs to try after a provider: the providers in
+        FAILOVER_CHAIN offering the same shorthand model name, skipping open circuits."""
+        models = self.providers[provider]["models"]
+        shorthand = next((name for name, full_name in models.items() if full_name == model), None)
+        if shorthand is None:
+            return []
         
-        result = response.json()
-        content = result.get("response", "")
+        return [
+            (self.clients[name], self.providers[name]["models"][shorthand])
+            for name in failover_chain()
+            if name != provider and name in self.clients
+            and shorthand in self.providers[name]["models"] and resilience.is_available(name)
+        ]
+    
+    def _with_failover(self, client: ProviderClient, model: str,
+                       call: Callable[[ProviderClient, str, Tuple[float, float]], Any],
+                       stream: bool = False) -> Tuple[Any, Optional[Dict[str, str]]]:
+        """Run call(client, model, timeout) resiliently, then on the failover targets until one succeeds.
+        
+        Returns the result and, if another provider answered, {"provider", "model"}.
+        Raises the last ProviderError if every provider failed. With `stream`,
+        call returns a stream, whose outcome counts once it ends.
+        """
+        error = None
+        for index, (target, target_model) in enumerate([(client, model)] + self.failover_targets(client.name, model)):
+            try:
+                result = resilience.call(
+                    target.name, lambda timeout: call(target, target_model, timeout), target.timeout, stream
+                )
+            except ProviderError as e:
+                # Only provider trouble is worth trying elsewhere
+                if not e.retryable:
+                    raise
+                error = e
+                continue
+            return result, ({"provider": target.name, "model": target_model} if index else None)
+        raise error
+    
+    @staticmethod
+    def _timed(kind: str, call: Callable[[ProviderClient, str, Tuple[float, float]], Any]
+               ) -> Callable[[ProviderClient, str, Tuple[float, float]], Any]:
+        """Wrap a provider call to record the latency of its successful calls."""
+        def timed(client: ProviderClient, model: str, timeout: Tuple[float, float]) -> Any:
+            started = time.monotonic()
+            result = call(client, model, timeout)
+            hedger.record(client.name, kind, time.monotonic() - started)
+            return result
+        return timed
+    
+    def _hedged(self, client: ProviderClient, model: str, role: Optional[str], kind: str,
+                call: Callable[[ProviderClient, str, Tuple[float, float]], Any],
+                discard: Optional[Callable[[Any], None]] = None, stream: bool = False) -> Tuple[Any, Optional[Dict[str, Any]]]:
+        """Run call(client, model, timeout) resiliently with failover (see _with_failover).
+        
+        With hedging enabled, once the provider is slower than usual for `kind`
+        ("response" or "first_token"), the first failover target is asked too
+        and the first answer wins; the failover info then includes "hedged".
+        """
+        call = self._timed(kind, call)
+        delay = hedger.delay(client.name, kind) if hedger.enabled and role else None
+        targets = self.failover_targets(client.name, model) if delay is not None else []
+        if not targets:
+            return self._with_failover(client, model, call, stream)
         
-        return True, content, result
+        hedge_client, hedge_model = targets[0]
+        
+        def hedge() -> Tuple[Any, Dict[str, Any]]:
+            result = resilience.call(
+                hedge_client.name, lambda timeout: call(hedge_client, hedge_model, timeout), hedge_client.timeout,
+                stream
+            )
+            return result, {"provider": hedge_client.name, "model": hedge_model, "hedged": True}
+        
+        (result, failover), _ = hedger.race(
+            role, delay, lambda: self._with_failover(client, model, call, stream), hedge,
+            discard=(lambda outcome: discard(outcome[0])) if discard is not None else None
+        )
+        return result, failover
+    
+    @staticmethod
+    def _with_system_prompt(messages: List[Dict[str, str]], system_prompt: Optional[str]) -> List[Dict[str, str]]:
+        """Add the system prompt if provided, without modifying the caller's list."""
+        if system_prompt and messages and messages[0]["role"] != "system":
+            return [{"role": "system", "content": system_prompt}] + messages
+        return messages
+    
+    @staticmethod
+    def _cache_lookup(provider: str, model: str, messages: List[Dict[str, str]], client: ProviderClient,
+                      use_cache: bool) -> Tuple[Dict[str, Any], Optional[str], Dict[str, Any]]:
+        """Look a request up in the response cache.
+        
+        Returns where to cache the response (key, and the scope and prompt
+        for near-duplicate matching), the cached content or None, and the
+        response data describing the hit.
+        """
+        prompt = messages[-1]["content"] if messages and messages[-1]["role"] == "user" else None
+        target = {
+            "key": cache_key(provider, model, messages, client.params),
+            # Near duplicates must match everything but the prompt (e.g. the system prompt)
+            "scope": cache_key(provider, model, messages[:-1], client.params) if prompt else None,
+            "prompt": prompt
+        }
+        if not use_cache:
+            response_cache.record_bypass()
+            return target, None, {}
+        
+        content = response_cache.get(target["key"])
+        if content is not None:
+            return target, content, {"cached": True}
+        
+        if prompt:
+            match = response_cache.get_near(target["scope"], prompt)
+            if match is not None:
+                return target, match[0], {"cached": True, "similarity": round(match[1], 4)}
+        return target, None, {}
+    
+    def generate_response(self, provider: str, model: str, messages: List[Dict[str, str]], 
+                         system_prompt: Optional[str] = None, use_cache: bool = True,
+                         role: Optional[str] = None) -> Tuple[bool, str, Dict[str, Any]]:
+        """Generate a response from the specified AI provider and model.
+        
+        Identical and near-duplicate requests are answered from the response
+        cache (the response data is then {"cached": True}, with the prompt
+        "similarity" for near duplicates) unless use_cache is False.
+        Concurrent identical requests share one upstream call. Failed calls
+        are retried and failed over (see resilience.py); the response data
+        then names the "failover" provider and model, or on failure gives
+        "retry_after" when the provider may recover. Given the user's role,
+        slow requests may be hedged (see hedging.py).
+        """
+        client, model = self.resolve(provider, model)
+        if client is None:
+            return False, model, {}
+        
+        messages = self._with_system_prompt(messages, system_prompt)
+        target, content, cache_data = self._cache_lookup(provider, model, messages, client, use_cache)
+        if content is not None:
+            return True, content, cache_data
+        
+        def call() -> Tuple[bool, str, Dict[str, Any]]:
+            try:
+                (content, response_data), failover = self._hedged(
+                    client, model, role, "response", lambda target_client, target_model, timeout:
+                    target_client.generate(target_model, messages, timeout)
+                )
+            except ProviderError as e:
+                return False, e.message, {"retry_after": e.retry_after} if e.retryable else {}
+            except Exception as e:
+                return False, f"Error generating response: {str(e)}", {}
+            
+            if failover is not None:
+                # Answers from another model are not cached for this one
+                return True, content, dict(response_data, failover=failover)
+            response_cache.set(target["key"], provider, model, content, target["scope"], target["prompt"])
+            return True, content, response_data
+        
+        result, _ = single_flight.do(target["key"], call)
+        return result
+    
+    def stream_response(self, provider: str, model: str, messages: List[Dict[str, str]],
+                        system_prompt: Optional[str] = None, use_cache: bool = True,
+                        role: Optional[str] = None) -> Tuple[bool, str, Iterator[str], Dict[str, Any]]:
+        """Start streaming a response; returns (success, error message, iterator of text chunks,
+        response data).
+        
+        Returns once the first chunk has arrived. Errors after that are raised
+        by the iterator (only getting the first chunk is retried, failed over
+        or hedged). A cached response is streamed as one chunk; completed
+        streams are cached. On failure the response data gives "retry_after"
+        when the provider may recover, as for generate_response.
+        """
+        client, model = self.resolve(provider, model)
+        if client is None:
+            return False, model, iter(()), {}
+        
+        messages = self._with_system_prompt(messages, system_prompt)
+        target, content, _ = self._cache_lookup(provider, model, messages, client, use_cache)
+        if content is not None:
+            return True, "", iter((content,)), {}
+        
+        try:
+            chunks, failover = self._hedged(
+                client, model, role, "first_token", lambda target_client, target_model, timeout:
+                prefetch_first(target_client.stream(target_model, messages, timeout)),
+                # Closing the losing stream drops its upstream connection
+                discard=lambda chunks: chunks.close(),
+                stream=True
+            )
+        except ProviderError as e:
+            return False, e.message, iter(()), {"retry_after": e.retry_after} if e.retryable else {}
+        except Exception as e:
+            return False, f"Error generating response: {str(e)}", iter(()), {}
+        
+        if failover is not None:
+            return True, "", chunks, {}
+        return True, "", self._cache_stream(chunks, target, provider, model), {}
+    
+    @staticmethod
+    def _cache_stream(chunks: Iterator[str], target: Dict[str, Any], provider: str, model: str) -> Iterator[str]:
+        """Pass chunks through, caching the response once the stream completes."""
+        parts = []
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+        response_cache.set(target["key"], provider, model, "".join(parts), target["scope"], target["prompt"])
     
     def get_available_models(self, provider: Optional[str] = None) -> Dict[str, List[str]]:
         """Get available models for the specified provider or all providers."""
@@ -3,16 +3,23 @@ Main application file for the Roblox Studio AI Plugin server.
 Provides API endpoints for the Roblox Studio plugin.
 """
 import os
+import io
+import csv
 import json
 import uuid
-from typing import Dict, List, Optional, Any
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Optional, Any, Iterator, Tuple
 from datetime import datetime
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from werkzeug.utils import secure_filename
 import config
 from auth import auth_manager
 from logger import log_manager
 from ai_provider import ai_provider
+from context_builder import context_builder, ContextOverflow
+from response_cache import response_cache
+from single_flight import single_flight
 from file_handler import file_handler
 
 # Create Flask app
@@ -21,9 +28,122 @@ app = Flask(__name__)
 # Ensure data directories exist
 os.makedirs(os.path.dirname(config.config["USERS_FILE"]), exist_ok=True)
 os.makedirs(os.path.dirname(config.config["LOGS_FILE"]), exist_ok=True)
-os.makedirs(os.path.dirname(config.config["HISTORY_FILE"]), exist_ok=True)
+os.makedirs(config.config["HISTORY_DIR"], exist_ok=True)
 os.makedirs(config.config["UPLOADS_DIR"], exist_ok=True)
 
+# Columns of CSV exports; NDJSON exports contain the full records
+EXPORT_COLUMNS = {
+    "logs": ["timestamp", "username", "model", "prompt", "response", "context_used", "files_used"],
+    "history": ["conversation_id", "timestamp", "role", "content"]
+}
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+# Records serialized per response chunk
+EXPORT_BATCH_SIZE = 100
+
+def stream_export(records, export_format: str, columns: List[str]):
+    """Serialize records as NDJSON or CSV, yielding one chunk per batch of records."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == "csv":
+        writer.writerow(columns)
+    
+    count = 0
+    for record in records:
+        if export_format == "csv":
+            writer.writerow([
+                json.dumps(record.get(column)) if isinstance(record.get(column), (list, dict))
+                else record.get(column, "")
+                for column in columns
+            ])
+        else:
+            buffer.write(json.dumps(record) + "\n")
+        
+        count += 1
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    if buffer.tell():
+        yield buffer.getvalue()
+
+# Streamed /generate responses: Server-Sent Events or one JSON object per line
+STREAM_FORMATS = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson"
+}
+# Keep proxies from caching or buffering streamed responses
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+# /generate_batch options that apply to every item unless the item sets its own
+BATCH_SHARED_OPTIONS = ("workspace", "system_prompt", "model", "provider")
+
+def format_stream_event(event: str, data: Dict[str, Any], stream_format: str) -> str:
+    """Serialize a stream event ("start", "delta", "done" or "error")."""
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps(dict(data, type=event)) + "\n"
+
+def record_generation(username: str, conversation_id: str, model: str, prompt: str,
+                      content: str, context_used: bool) -> None:
+    """Log a completed generation and add it to the conversation history."""
+    log_manager.log_request(
+        username=username,
+        model=model,
+        prompt=prompt,
+        response=content,
+        context_used=context_used,
+        files_used=[]
+    )
+    
+    log_manager.add_to_history(username, conversation_id, "user", prompt)
+    log_manager.add_to_history(username, conversation_id, "assistant", content)
+
+def stream_generation(chunks, stream_format: str, username: str, conversation_id: str, model: str,
+                      prompt: str, context_used: bool, tokens: Optional[Dict[str, Any]] = None):
+    """Relay a provider's text chunks as stream events, recording the generation once it completes."""
+    parts = []
+    try:
+        yield format_stream_event("start", {"conversation_id": conversation_id, "tokens": tokens}, stream_format)
+        
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                yield format_stream_event("delta", {"content": chunk}, stream_format)
+        except Exception as e:
+            yield format_stream_event("error", {
+                "error": "generation_error",
+                "message": f"Error generating response: {str(e)}"
+            }, stream_format)
+            return
+        
+        record_generation(username, conversation_id, model, prompt, "".join(parts), context_used)
+        yield format_stream_event("done", {"conversation_id": conversation_id}, stream_format)
+    finally:
+        # Release the upstream connection if the client went away mid-stream
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+def parse_bulk_operations(stream, content_type: str):
+    """Yield user operations from a streamed NDJSON or CSV (op,username,role) body."""
+    lines = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if content_type == "text/csv":
+        for row in csv.DictReader(lines):
+            yield {key.strip().lower(): value for key, value in row.items() if key}
+        return
+    
+    for line in lines:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Reported as an invalid operation
+                yield {}
+
 # Helper function to get conversation ID or create a new one
 def get_conversation_id(username: str, conversation_id: Optional[str] = None) -> str:
     """Get a conversation ID or create a new one."""
@@ -73,94 +193,344 @@ def auth_check():
         "message": f"Welcome, {username}! You are authorized as {role}."
     })
 
-@app.route("/generate", methods=["POST"])
-def generate():
-    """Generate a response from the AI model."""
-    data = request.json
+def request_options(data: Dict[str, Any]) -> Tuple[Optional[Tuple[Dict[str, Any], int, Dict[str, str]]], Optional[str], bool]:
+    """Check the user and read the options shared by /generate and /generate_batch.
+    
+    Returns (error response or None, stream format or None, whether to use the cache).
+    """
     username = data.get("username", "").strip()
-    prompt = data.get("prompt", "").strip()
-    workspace_context = data.get("workspace", "").strip()
-    model = data.get("model", config.config["DEFAULT_MODEL"])
-    provider = data.get("provider", config.config["DEFAULT_PROVIDER"])
-    system_prompt_key = data.get("system_prompt", "default")
-    conversation_id = data.get("conversation_id")
+    # true/"sse" streams Server-Sent Events, "ndjson" streams JSON lines
+    stream = data.get("stream", False)
+    stream_format = "sse" if stream is True else (stream or None)
+    # "cache": false skips the response cache (honored for users who can manage users)
+    use_cache = data.get("cache", True) is not False
     
     # Check authorization
     if not auth_manager.is_authorized(username):
-        return jsonify({
+        return ({
             "error": "unauthorized",
             "message": "Access denied. You are not on the authorized list."
-        }), 403
+        }, 403, {}), None, use_cache
+    
+    # Anything but a boolean or a format name (e.g. a list) is not a stream format
+    if stream_format is not None and (not isinstance(stream_format, str) or stream_format not in STREAM_FORMATS):
+        return ({
+            "error": "invalid_stream",
+            "message": f"Stream format must be one of: {', '.join(STREAM_FORMATS)}"
+        }, 400, {}), None, use_cache
+    
+    if not use_cache and not auth_manager.check_permission(username, "can_manage_users"):
+        use_cache = True
+    return None, stream_format, use_cache
+
+def charge_requests(username: str, count: int = 1) -> Optional[Tuple[Dict[str, Any], int, Dict[str, str]]]:
+    """Record requests against the user's rate limits; returns the error response if denied."""
+    success, message, retry_after = auth_manager.record_request(username, count)
+    if success:
+        return None
+    return {
+        "error": "rate_limit",
+        "message": message,
+        "retry_after": retry_after
+    }, 429, {"Retry-After": str(retry_after)} if retry_after else {}
+
+def prepare_generation(data: Dict[str, Any]) -> Tuple[Optional[Tuple[Dict[str, Any], int, Dict[str, str]]], Dict[str, Any]]:
+    """Check a /generate request, build the messages to send and charge the user's rate limit.
+    
+    Returns (the error response as (body, status, headers), None), or
+    (None, the generation's parameters).
+    """
+    error, stream_format, use_cache = request_options(data)
+    if error is not None:
+        return error, None
     
     # Check if prompt is provided
-    if not prompt:
-        return jsonify({
+    if not data.get("prompt", "").strip():
+        return ({
             "error": "no_prompt",
             "message": "No prompt provided."
-        }), 400
+        }, 400, {}), None
+    
+    username = data.get("username", "").strip()
+    try:
+        generation = build_generation(data, username, stream_format, use_cache)
+    except ContextOverflow as e:
+        # Rejected before charging, so it costs nothing
+        return context_overflow(e), None
     
     # Record request and check rate limits
-    success, message = auth_manager.record_request(username)
-    if not success:
-        return jsonify({
-            "error": "rate_limit",
-            "message": message
-        }), 429
+    error = charge_requests(username)
+    if error is not None:
+        return error, None
+    return None, generation
+
+def context_overflow(error: ContextOverflow, index: Optional[int] = None) -> Tuple[Dict[str, Any], int, Dict[str, str]]:
+    """Get the error response for a prompt that the model's token budget has no room for."""
+    body = {
+        "error": "context_overflow",
+        "message": str(error)
+    }
+    if index is not None:
+        body["index"] = index
+    return body, 400, {}
+
+def build_generation(data: Dict[str, Any], username: str, stream_format: Optional[str],
+                     use_cache: bool) -> Dict[str, Any]:
+    """Get a generation's parameters, with the messages to send, from a /generate request or batch item."""
+    prompt = data.get("prompt", "").strip()
+    workspace_context = data.get("workspace", "").strip()
+    model = data.get("model", config.config["DEFAULT_MODEL"])
+    provider = data.get("provider", config.config["DEFAULT_PROVIDER"])
+    system_prompt_key = data.get("system_prompt", "default")
+    user = auth_manager.get_user(username)
     
     # Get or create conversation ID
-    conversation_id = get_conversation_id(username, conversation_id)
+    conversation_id = get_conversation_id(username, data.get("conversation_id"))
     
     # Get conversation history
     conversation = log_manager.get_conversation(username, conversation_id)
     
-    # Prepare messages for the AI
-    messages = []
-    
-    # Add system prompt
+    # Prepare messages for the AI within the model's token budget
     system_prompt = config.system_prompts.get(system_prompt_key, config.system_prompts["default"])
-    if workspace_context:
-        system_prompt += f"\n\nWorkspace Context:\n{workspace_context}"
-    
-    messages.append({"role": "system", "content": system_prompt})
-    
-    # Add conversation history (up to last 10 messages)
-    for message in conversation[-10:]:
-        messages.append({
-            "role": message["role"],
-            "content": message["content"]
-        })
-    
-    # Add current prompt
-    messages.append({"role": "user", "content": prompt})
-    
-    # Generate response
-    success, content, response_data = ai_provider.generate_response(
-        provider, model, messages
+    client, full_model = ai_provider.resolve(provider, model)
+    messages, tokens = context_builder.build(
+        full_model if client is not None else model, system_prompt, prompt, conversation, workspace_context
     )
     
+    return {
+        "username": username,
+        # The user may have been removed since the authorization check
+        "role": (user or {}).get("role", "User"),
+        "prompt": prompt,
+        "provider": provider,
+        "model": model,
+        "messages": messages,
+        # Estimated token counts of the messages (see context_builder.py)
+        "tokens": tokens,
+        "conversation_id": conversation_id,
+        "context_used": bool(workspace_context),
+        "stream_format": stream_format,
+        "use_cache": use_cache
+    }
+
+def finish_generation(generation: Dict[str, Any], success: bool, content: str,
+                      response_data: Dict[str, Any]) -> Tuple[Dict[str, Any], int, Dict[str, str]]:
+    """Record a non-streamed generation; returns the response as (body, status, headers)."""
     if not success:
-        return jsonify({
+        if "retry_after" in response_data:
+            # Every provider tried is throttling, failing or behind an open circuit
+            retry_after = response_data["retry_after"] or 1
+            return {
+                "error": "provider_unavailable",
+                "message": content,
+                "retry_after": retry_after
+            }, 503, {"Retry-After": str(retry_after)}
+        
+        return {
             "error": "generation_error",
             "message": content
-        }), 500
+        }, 500, {}
     
-    # Log the request
-    log_manager.log_request(
-        username=username,
-        model=model,
-        prompt=prompt,
-        response=content,
-        context_used=bool(workspace_context),
-        files_used=[]
-    )
+    # Log the request and add it to the conversation history
+    record_generation(generation["username"], generation["conversation_id"], generation["model"],
+                      generation["prompt"], content, generation["context_used"])
     
-    # Add to conversation history
-    log_manager.add_to_history(username, conversation_id, "user", prompt)
-    log_manager.add_to_history(username, conversation_id, "assistant", content)
+    return {
+        "code": content,
+        "conversation_id": generation["conversation_id"],
+        "cached": bool(response_data.get("cached")),
+        # Set for near-duplicate cache hits
+        "similarity": response_data.get("similarity"),
+        # Set when another provider answered ({"provider", "model"}, and "hedged" for hedges)
+        "failover": response_data.get("failover"),
+        "tokens": generation["tokens"]
+    }, 200, {}
+
+def prepare_batch(data: Dict[str, Any]) -> Tuple[Optional[Tuple[Dict[str, Any], int, Dict[str, str]]], Dict[str, Any]]:
+    """Check a /generate_batch request, build each item's messages and charge the rate
+    limit for all its items at once.
+    
+    Returns (the error response as (body, status, headers), None), or
+    (None, {"items": each item's generation parameters, "stream_format", "parallelism"}).
+    """
+    error, stream_format, use_cache = request_options(data)
+    if error is not None:
+        return error, None
+    
+    prompts = data.get("prompts")
+    if not isinstance(prompts, list) or not prompts:
+        return ({
+            "error": "no_prompts",
+            "message": "No prompts provided."
+        }, 400, {}), None
+    
+    if len(prompts) > config.config["BATCH_MAX_ITEMS"]:
+        return ({
+            "error": "batch_too_large",
+            "message": f"A batch may have at most {config.config['BATCH_MAX_ITEMS']} prompts."
+        }, 400, {}), None
+    
+    parallelism = data.get("parallelism", config.config["BATCH_PARALLELISM"])
+    if not isinstance(parallelism, int) or parallelism < 1:
+        return ({
+            "error": "invalid_parallelism",
+            "message": "Parallelism must be a positive integer."
+        }, 400, {}), None
+    
+    # Items are prompts, or objects with a "prompt" and their own options (e.g. "conversation_id")
+    shared = {key: data[key] for key in BATCH_SHARED_OPTIONS if key in data}
+    items = []
+    for index, item in enumerate(prompts):
+        item = dict(shared, **item) if isinstance(item, dict) else dict(shared, prompt=item)
+        if not isinstance(item.get("prompt"), str) or not item["prompt"].strip():
+            return ({
+                "error": "no_prompt",
+                "message": f"No prompt provided for item {index}.",
+                "index": index
+            }, 400, {}), None
+        items.append(item)
+    
+    # One request per item, all or none
+    username = data.get("username", "").strip()
+    capacity = auth_manager.request_capacity(username)
+    if capacity is not None and len(items) > capacity:
+        # Retrying would never succeed
+        return ({
+            "error": "batch_exceeds_rate_limit",
+            "message": f"A batch of {len(items)} prompts exceeds your rate limit of {capacity} requests; "
+                       f"send at most {capacity} prompts per batch.",
+            "max_items": capacity
+        }, 413, {}), None
+    
+    # Every item is built before charging, so a rejected batch costs nothing
+    generations = []
+    for index, item in enumerate(items):
+        try:
+            generations.append(build_generation(item, username, None, use_cache))
+        except ContextOverflow as e:
+            return context_overflow(e, index), None
+    
+    error = charge_requests(username, len(items))
+    if error is not None:
+        return error, None
+    
+    return None, {
+        "items": generations,
+        "stream_format": stream_format,
+        "parallelism": min(parallelism, config.config["BATCH_MAX_PARALLELISM"], len(items))
+    }
+
+def item_error(index: int, error: Exception) -> Dict[str, Any]:
+    """Get the result of a batch item that failed unexpectedly."""
+    return {
+        "error": "generation_error",
+        "message": f"Error generating response: {str(error)}",
+        "index": index,
+        "status": 500
+    }
+
+def generate_item(index: int, generation: Dict[str, Any]) -> Dict[str, Any]:
+    """Generate and record one batch item; returns its result (a /generate response with its index and status)."""
+    try:
+        success, content, response_data = ai_provider.generate_response(
+            generation["provider"], generation["model"], generation["messages"],
+            use_cache=generation["use_cache"], role=generation["role"]
+        )
+        body, status, _ = finish_generation(generation, success, content, response_data)
+    except Exception as e:
+        # The item was charged; it fails alone rather than failing the batch
+        return item_error(index, e)
+    return dict(body, index=index, status=status)
+
+# Shared by all batches; each keeps at most its parallelism of items in it
+batch_executor = ThreadPoolExecutor(max_workers=config.config["BATCH_MAX_WORKERS"], thread_name_prefix="batch")
+
+def run_batch(batch: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Generate a batch's items concurrently, yielding each result as it finishes."""
+    items = enumerate(batch["items"])
+    running = set()
+    try:
+        while True:
+            for index, generation in itertools.islice(items, batch["parallelism"] - len(running)):
+                running.add(batch_executor.submit(generate_item, index, generation))
+            if not running:
+                return
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        # Items not started yet are skipped if the client went away
+        for future in running:
+            future.cancel()
+
+def stream_batch(results: Iterator[Dict[str, Any]], stream_format: str):
+    """Stream batch results as "result" events in the order they finish, then a "done" event."""
+    count = failed = 0
+    try:
+        for result in results:
+            count += 1
+            failed += result["status"] != 200
+            yield format_stream_event("result", result, stream_format)
+        yield format_stream_event("done", {"count": count, "failed": failed}, stream_format)
+    finally:
+        close = getattr(results, "close", None)
+        if close is not None:
+            close()
+
+@app.route("/generate", methods=["POST"])
+def generate():
+    """Generate a response from the AI model (async_server.py serves this route on an event loop)."""
+    error, generation = prepare_generation(request.json)
+    if error is not None:
+        body, status, headers = error
+        return jsonify(body), status, headers
+    
+    if generation["stream_format"] is not None:
+        success, message, chunks, response_data = ai_provider.stream_response(
+            generation["provider"], generation["model"], generation["messages"],
+            use_cache=generation["use_cache"], role=generation["role"]
+        )
+        if not success:
+            body, status, headers = finish_generation(generation, False, message, response_data)
+            return jsonify(body), status, headers
+        
+        return Response(
+            stream_with_context(stream_generation(
+                chunks, generation["stream_format"], generation["username"], generation["conversation_id"],
+                generation["model"], generation["prompt"], generation["context_used"], generation["tokens"]
+            )),
+            mimetype=STREAM_FORMATS[generation["stream_format"]],
+            headers=STREAM_HEADERS
+        )
     
+    # Generate response
+    success, content, response_data = ai_provider.generate_response(
+        generation["provider"], generation["model"], generation["messages"],
+        use_cache=generation["use_cache"], role=generation["role"]
+    )
+    
+    body, status, headers = finish_generation(generation, success, content, response_data)
+    return jsonify(body), status, headers
+
+@app.route("/generate_batch", methods=["POST"])
+def generate_batch():
+    """Generate responses to several prompts concurrently (see prepare_batch)."""
+    error, batch = prepare_batch(request.json)
+    if error is not None:
+        body, status, headers = error
+        return jsonify(body), status, headers
+    
+    if batch["stream_format"] is not None:
+        return Response(
+            stream_with_context(stream_batch(run_batch(batch), batch["stream_format"])),
+            mimetype=STREAM_FORMATS[batch["stream_format"]],
+            headers=STREAM_HEADERS
+        )
+    
+    results = sorted(run_batch(batch), key=lambda result: result["index"])
     return jsonify({
-        "code": content,
-        "conversation_id": conversation_id
+        "results": results,
+        "failed": sum(1 for result in results if result["status"] != 200)
     })
 
 @app.route("/add_user", methods=["POST"])
@@ -307,6 +677,70 @@ def list_users():
         "users": users
     })
 
+@app.route("/bulk_users", methods=["POST"])
+def bulk_users():
+    """Apply a batch of add/update/remove user operations atomically.
+    
+    Accepts JSON ({"admin_username", "operations": [...]}) or, for large
+    imports, a streamed NDJSON or CSV body with admin_username in the query.
+    """
+    content_type = (request.mimetype or "").lower()
+    if content_type in ("application/x-ndjson", "text/csv"):
+        admin_username = request.args.get("admin_username", "").strip()
+        operations = None
+    else:
+        data = request.get_json(silent=True) or {}
+        admin_username = (data.get("admin_username") or request.args.get("admin_username", "")).strip()
+        operations = data.get("operations")
+        if not isinstance(operations, list):
+            return jsonify({
+                "error": "invalid_operations",
+                "message": "An operations list is required."
+            }), 400
+    
+    # Check if admin username is provided and authorized
+    if not admin_username:
+        return jsonify({
+            "error": "missing_admin",
+            "message": "Admin username is required."
+        }), 400
+    
+    if not auth_manager.is_authorized(admin_username):
+        return jsonify({
+            "error": "unauthorized",
+            "message": "Admin access denied."
+        }), 403
+    
+    # Check if admin has permission to manage users
+    if not auth_manager.check_permission(admin_username, "can_manage_users"):
+        return jsonify({
+            "error": "permission_denied",
+            "message": "You don't have permission to manage users."
+        }), 403
+    
+    if operations is None:
+        operations = parse_bulk_operations(request.stream, content_type)
+    
+    try:
+        success, results = auth_manager.apply_batch(operations)
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify({
+            "error": "invalid_operations",
+            "message": f"Could not parse request body: {e}"
+        }), 400
+    
+    if not success:
+        return jsonify({
+            "error": "bulk_users_failed",
+            "message": "No changes were applied; see the failed operations.",
+            "results": results
+        }), 400
+    
+    return jsonify({
+        "message": f"Applied {len(results)} operations",
+        "results": results
+    })
+
 @app.route("/get_logs", methods=["GET"])
 def get_logs():
     """Get usage logs."""
@@ -314,6 +748,10 @@ def get_logs():
     username_filter = request.args.get("username", "").strip()
     limit = int(request.args.get("limit", 100))
     offset = int(request.args.get("offset", 0))
+    before = request.args.get("before", "").strip()
+    after = request.args.get("after", "").strip()
+    start = request.args.get("start", "").strip()
+    end = request.args.get("end", "").strip()
     
     # Check if admin username is provided and authorized
     if not admin_username:
@@ -336,19 +774,96 @@ def get_logs():
         }), 403
     
     # Get logs
-    logs = log_manager.get_logs(
+    result = log_manager.query_logs(
         username=username_filter if username_filter else None,
         limit=limit,
-        offset=offset
+        offset=offset,
+        before=before if before else None,
+        after=after if after else None,
+        start=start if start else None,
+        end=end if end else None
     )
     
     return jsonify({
-        "logs": logs,
-        "total": len(logs),
+        "logs": result["logs"],
+        "total": result["total"],
         "limit": limit,
-        "offset": offset
+        "offset": offset,
+        "next_cursor": result["next_cursor"],
+        "prev_cursor": result["prev_cursor"]
     })
 
+@app.route("/export", methods=["GET"])
+def export():
+    """Stream logs, or one user's history, as NDJSON or CSV."""
+    admin_username = request.args.get("admin_username", "").strip()
+    export_type = request.args.get("type", "logs").strip()
+    export_format = request.args.get("format", "ndjson").strip()
+    username_filter = request.args.get("username", "").strip()
+    after = request.args.get("after", "").strip()
+    start = request.args.get("start", "").strip()
+    end = request.args.get("end", "").strip()
+    
+    # Check if admin username is provided and authorized
+    if not admin_username:
+        return jsonify({
+            "error": "missing_admin",
+            "message": "Admin username is required."
+        }), 400
+    
+    if not auth_manager.is_authorized(admin_username):
+        return jsonify({
+            "error": "unauthorized",
+            "message": "Admin access denied."
+        }), 403
+    
+    # Check if admin has permission to view logs
+    if not auth_manager.check_permission(admin_username, "can_view_logs"):
+        return jsonify({
+            "error": "permission_denied",
+            "message": "You don't have permission to view logs."
+        }), 403
+    
+    if export_type not in EXPORT_COLUMNS:
+        return jsonify({
+            "error": "invalid_type",
+            "message": "Type must be 'logs' or 'history'."
+        }), 400
+    
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({
+            "error": "invalid_format",
+            "message": "Format must be 'ndjson' or 'csv'."
+        }), 400
+    
+    # Records are produced lazily, oldest first; `after` resumes an interrupted export
+    if export_type == "logs":
+        records = log_manager.export_logs(
+            username=username_filter if username_filter else None,
+            after=after if after else None,
+            start=start if start else None,
+            end=end if end else None
+        )
+    else:
+        if not username_filter:
+            return jsonify({
+                "error": "missing_username",
+                "message": "Username is required to export history."
+            }), 400
+        records = log_manager.export_history(
+            username_filter,
+            after=after if after else None,
+            start=start if start else None,
+            end=end if end else None
+        )
+    
+    filename = f"{export_type}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{export_format}"
+    return Response(
+        stream_with_context(stream_export(records, export_format, EXPORT_COLUMNS[export_type])),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
 @app.route("/get_usage_stats", methods=["GET"])
 def get_usage_stats():
     """Get usage statistics."""
@@ -379,6 +894,128 @@ def get_usage_stats():
     
     return jsonify(stats)
 
+@app.route("/get_pool_stats", methods=["GET"])
+def get_pool_stats():
+    """Get provider HTTP connection pool statistics."""
+    admin_username = request.args.get("admin_username", "").strip()
+    
+    # Check if admin username is provided and authorized
+    if not admin_username:
+        return jsonify({
+            "error": "missing_admin",
+            "message": "Admin username is required."
+        }), 400
+    
+    if not auth_manager.is_authorized(admin_username):
+        return jsonify({
+            "error": "unauthorized",
+            "message": "Admin access denied."
+        }), 403
+    
+    # Check if admin has permission to view logs
+    if not auth_manager.check_permission(admin_username, "can_view_logs"):
+        return jsonify({
+            "error": "permission_denied",
+            "message": "You don't have permission to view logs."
+        }), 403
+    
+    return jsonify(ai_provider.get_pool_stats())
+
+@app.route("/get_provider_stats", methods=["GET"])
+def get_provider_stats():
+    """Get provider retry counters, circuit breaker states and hedging statistics."""
+    admin_username = request.args.get("admin_username", "").strip()
+    
+    # Check if admin username is provided and authorized
+    if not admin_username:
+        return jsonify({
+            "error": "missing_admin",
+            "message": "Admin username is required."
+        }), 400
+    
+    if not auth_manager.is_authorized(admin_username):
+        return jsonify({
+            "error": "unauthorized",
+            "message": "Admin access denied."
+        }), 403
+    
+    # Check if admin has permission to view logs
+    if not auth_manager.check_permission(admin_username, "can_view_logs"):
+        return jsonify({
+            "error": "permission_denied",
+            "message": "You don't have permission to view logs."
+        }), 403
+    
+    return jsonify(ai_provider.get_resilience_stats())
+
+@app.route("/get_cache_stats", methods=["GET"])
+def get_cache_stats():
+    """Get response cache and request coalescing statistics."""
+    admin_username = request.args.get("admin_username", "").strip()
+    
+    # Check if admin username is provided and authorized
+    if not admin_username:
+        return jsonify({
+            "error": "missing_admin",
+            "message": "Admin username is required."
+        }), 400
+    
+    if not auth_manager.is_authorized(admin_username):
+        return jsonify({
+            "error": "unauthorized",
+            "message": "Admin access denied."
+        }), 403
+    
+    # Check if admin has permission to view logs
+    if not auth_manager.check_permission(admin_username, "can_view_logs"):
+        return jsonify({
+            "error": "permission_denied",
+            "message": "You don't have permission to view logs."
+        }), 403
+    
+    return jsonify(dict(response_cache.get_stats(), single_flight=single_flight.get_stats()))
+
+@app.route("/purge_cache", methods=["POST"])
+def purge_cache():
+    """Remove cached responses, optionally only for one provider and/or model."""
+    data = request.json or {}
+    admin_username = data.get("admin_username", "").strip()
+    provider = data.get("provider") or None
+    model = data.get("model") or None
+    
+    # Check if admin username is provided and authorized
+    if not admin_username:
+        return jsonify({
+            "error": "missing_admin",
+            "message": "Admin username is required."
+        }), 400
+    
+    if not auth_manager.is_authorized(admin_username):
+        return jsonify({
+            "error": "unauthorized",
+            "message": "Admin access denied."
+        }), 403
+    
+    # Check if admin has permission to manage users
+    if not auth_manager.check_permission(admin_username, "can_manage_users"):
+        return jsonify({
+            "error": "permission_denied",
+            "message": "You don't have permission to purge the cache."
+        }), 403
+    
+    if provider and model:
+        # Cached entries use full model names
+        client, resolved_model = ai_provider.resolve(provider, model)
+        if client is not None:
+            model = resolved_model
+    
+    removed = response_cache.purge(provider, model)
+    
+    return jsonify({
+        "message": f"Removed {removed} cached responses",
+        "removed": removed
+    })
+
 @app.route("/get_conversation", methods=["GET"])
 def get_conversation():
     """Get a conversation history."""
@@ -404,6 +1041,8 @@ def get_conversation():
 def get_user_conversations():
     """Get all conversations for a user."""
     username = request.args.get("username", "").strip()
+    limit = request.args.get("limit", "").strip()
+    before = request.args.get("before", "").strip()
     
     # Check authorization
     if not auth_manager.is_authorized(username):
@@ -412,39 +1051,73 @@ def get_user_conversations():
             "message": "Access denied."
         }), 403
     
-    # Get conversations
-    conversations = log_manager.get_user_conversations(username)
+    # Get conversation summaries from the per-user index
+    result = log_manager.get_conversation_summaries(
+        username,
+        limit=int(limit) if limit else None,
+        before=before if before else None
+    )
     
-    # Format the response
-    result = []
-    for conversation_id, messages in conversations.items():
-        if not messages:
-            continue
-        
-        # Get the first and last message timestamps
-        first_timestamp = datetime.fromisoformat(messages[0]["timestamp"])
-        last_timestamp = datetime.fromisoformat(messages[-1]["timestamp"])
-        
-        # Get a preview of the conversation (first user message)
-        preview = ""
-        for message in messages:
-            if message["role"] == "user":
-                preview = message["content"]
-                break
-        
-        result.append({
-            "conversation_id": conversation_id,
-            "message_count": len(messages),
-            "first_timestamp": messages[0]["timestamp"],
-            "last_timestamp": messages[-1]["timestamp"],
-            "preview": preview[:100] + "..." if len(preview) > 100 else preview
-        })
+    return jsonify({
+        "conversations": result["conversations"],
+        "next_cursor": result["next_cursor"]
+    })
+
+@app.route("/search", methods=["GET"])
+def search():
+    """Search conversation history (and, for log viewers, request logs)."""
+    username = request.args.get("username", "").strip()
+    query = request.args.get("q", "").strip()
+    scope = request.args.get("scope", "history").strip()
+    username_filter = request.args.get("user", "").strip()
+    conversation_id = request.args.get("conversation_id", "").strip()
+    limit = int(request.args.get("limit", 20))
+    offset = int(request.args.get("offset", 0))
     
-    # Sort by last timestamp (newest first)
-    result.sort(key=lambda x: x["last_timestamp"], reverse=True)
+    # Check authorization
+    if not auth_manager.is_authorized(username):
+        return jsonify({
+            "error": "unauthorized",
+            "message": "Access denied."
+        }), 403
+    
+    if not query:
+        return jsonify({
+            "error": "no_query",
+            "message": "No search query provided."
+        }), 400
+    
+    if scope not in ("history", "logs", "all"):
+        return jsonify({
+            "error": "invalid_scope",
+            "message": "Scope must be 'history', 'logs' or 'all'."
+        }), 400
+    
+    # Only log viewers can search logs or other users' history
+    can_view_logs = auth_manager.check_permission(username, "can_view_logs")
+    if not can_view_logs:
+        if scope != "history" or (username_filter and username_filter != username):
+            return jsonify({
+                "error": "permission_denied",
+                "message": "You don't have permission to search logs or other users' history."
+            }), 403
+        username_filter = username
+    
+    # Search
+    result = log_manager.search(
+        query,
+        scope=scope,
+        username=username_filter if username_filter else None,
+        conversation_id=conversation_id if conversation_id else None,
+        limit=limit,
+        offset=offset
+    )
     
     return jsonify({
-        "conversations": result
+        "results": result["results"],
+        "total": result["total"],
+        "limit": limit,
+        "offset": offset
     })
 
 @app.route("/clear_conversation", methods=["POST"])
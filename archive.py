@@ -0,0 +1,479 @@
+"""
+Log archive module for the Roblox Studio AI Plugin server.
+Rotates request logs into compressed, immutable archive segments that are
+only read on demand.
+"""
+import os
+import gzip
+import json
+import threading
+import itertools
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Iterator, Tuple
+from log_store import JsonlLogStore, LogIndex, migrate_json_logs
+from shared_state import file_lock, file_signature
+from persistence import BackgroundTask
+
+class LogArchive:
+    def __init__(self, archive_dir: str, cache_size: int = 4):
+        self.logs_dir = os.path.join(archive_dir, "logs")
+        self.manifest_file = os.path.join(self.logs_dir, "manifest.json")
+        self.cache_size = cache_size
+        # total_records counts every record ever archived, including expired segments
+        self.manifest = {"total_records": 0, "segments": []}
+        self.manifest_signature = None
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self._exclusive_depth = 0
+        self.ensure_archive_dir()
+        self.load_manifest()
+
+    def ensure_archive_dir(self):
+        """Ensure the archive directory exists."""
+        os.makedirs(self.logs_dir, exist_ok=True)
+
+    def load_manifest(self) -> Dict[str, Any]:
+        """Load the segment manifest."""
+        self.manifest_signature = file_signature(self.manifest_file)
+        if self.manifest_signature is None:
+            return self.manifest
+
+        try:
+            with open(self.manifest_file, "r") as f:
+                self.manifest = json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError):
+            self.manifest = {"total_records": 0, "segments": []}
+        return self.manifest
+
+    def refresh(self) -> None:
+        """Reload the manifest if another worker changed the archive."""
+        with self._lock:
+            if file_signature(self.manifest_file) != self.manifest_signature:
+                self.load_manifest()
+
+    def save_manifest(self) -> None:
+        """Atomically save the segment manifest."""
+        temp_path = f"{self.manifest_file}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.manifest_file)
+        self.manifest_signature = file_signature(self.manifest_file)
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        """Hold the archive lock across workers, starting from the latest manifest (reentrant)."""
+        with self._lock:
+            if self._exclusive_depth:
+                self._exclusive_depth += 1
+                try:
+                    yield
+                finally:
+                    self._exclusive_depth -= 1
+                return
+
+            with file_lock(self.manifest_file):
+                self._exclusive_depth = 1
+                try:
+                    self.load_manifest()
+                    yield
+                finally:
+                    self._exclusive_depth = 0
+
+    @property
+    def segments(self) -> List[Dict[str, Any]]:
+        """Segment metadata, oldest first."""
+        return self.manifest["segments"]
+
+    def segment_path(self, segment: Dict[str, Any]) -> str:
+        return os.path.join(self.logs_dir, segment["file"])
+
+    def write_segment(self, records: List[Dict[str, Any]], count_records: bool = True,
+                      replaces: List[Dict[str, Any]] = ()) -> Optional[Dict[str, Any]]:
+        """Write records to a new compressed segment and register it.
+
+        Segments in `replaces` are unregistered in the same manifest update
+        and deleted only once it is saved, so a crash at any point leaves
+        every record registered exactly once.
+        """
+        if not records:
+            return None
+
+        records = sorted(records, key=lambda x: x.get("timestamp", ""))
+        start = records[0].get("timestamp", "")
+        end = records[-1].get("timestamp", "")
+
+        usernames = {}
+        for record in records:
+            username = record.get("username", "")
+            usernames[username] = usernames.get(username, 0) + 1
+
+        with self.exclusive():
+            name = "logs-" + start.replace(":", "").replace(".", "")
+            file_name = f"{name}.jsonl.gz"
+            suffix = 1
+            while os.path.exists(os.path.join(self.logs_dir, file_name)):
+                suffix += 1
+                file_name = f"{name}-{suffix}.jsonl.gz"
+
+            data = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+            path = os.path.join(self.logs_dir, file_name)
+            temp_path = f"{path}.tmp"
+            with open(temp_path, "wb") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                    f.write(data)
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.replace(temp_path, path)
+
+            segment = {
+                "file": file_name,
+                "start": start,
+                "end": end,
+                "count": len(records),
+                "bytes": len(data),
+                "usernames": usernames
+            }
+            for replaced in replaces:
+                self.segments.remove(replaced)
+            self.segments.append(segment)
+            self.segments.sort(key=lambda x: x["start"])
+            if count_records:
+                self.manifest["total_records"] += len(records)
+            self.save_manifest()
+
+            for replaced in replaces:
+                self._delete_segment_file(replaced)
+            return segment
+
+    def archive_file(self, path: str) -> Optional[Dict[str, Any]]:
+        """Archive a rotated JSONL log file and remove it."""
+        with self.exclusive():
+            if not os.path.exists(path):
+                # Another worker archived it already
+                return None
+
+            records = []
+            with open(path, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+
+            segment = self.write_segment(records)
+            os.remove(path)
+            return segment
+
+    def iter_segment(self, segment: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Stream the records of a segment, oldest first."""
+        with gzip.open(self.segment_path(segment), "rt") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+    def read_segment(self, segment: Dict[str, Any]) -> LogIndex:
+        """Load a segment into an index, keeping the most recent few cached."""
+        with self._lock:
+            key = segment["file"]
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+            index = LogIndex()
+            index.rebuild(list(self.iter_segment(segment)))
+            self._cache[key] = index
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return index
+
+    def _current_segments(self, segments: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """The given segments, or the latest registered ones."""
+        if segments is not None:
+            return segments
+        self.refresh()
+        return list(self.segments)
+
+    def iter_records(self, segments: Optional[List[Dict[str, Any]]] = None) -> Iterator[Dict[str, Any]]:
+        """Stream every archived record (of the given segments, by default all), oldest first."""
+        for segment in self._current_segments(segments):
+            yield from self.iter_segment(segment)
+
+    def iter_range(self, username: Optional[str] = None, after: Optional[str] = None,
+                   start: Optional[str] = None, end: Optional[str] = None,
+                   segments: Optional[List[Dict[str, Any]]] = None) -> Iterator[Dict[str, Any]]:
+        """Stream matching archived records, oldest first, skipping segments outside the bounds."""
+        for segment in self._current_segments(segments):
+            if username is not None and username not in segment["usernames"]:
+                continue
+            if (after and segment["end"] <= after) or (start and segment["end"] < start) or \
+                    (end and segment["start"] > end):
+                continue
+
+            for record in self.iter_segment(segment):
+                timestamp = record.get("timestamp", "")
+                if username is not None and record.get("username", "") != username:
+                    continue
+                if (after and timestamp <= after) or (start and timestamp < start) or (end and timestamp > end):
+                    continue
+                yield record
+
+    def apply_retention(self, retention_days: int) -> int:
+        """Delete segments whose newest record is older than the retention period."""
+        if retention_days <= 0:
+            return 0
+
+        cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+        with self.exclusive():
+            expired = [segment for segment in self.segments if segment["end"] < cutoff]
+            if not expired:
+                return 0
+
+            # Unregister first: a crash then leaves unreferenced files, never missing ones
+            for segment in expired:
+                self.segments.remove(segment)
+            self.save_manifest()
+            for segment in expired:
+                self._delete_segment_file(segment)
+            return len(expired)
+
+    def compact(self, target_bytes: int) -> int:
+        """Merge runs of adjacent small segments into segments of about target_bytes."""
+        merged = 0
+        with self.exclusive():
+            groups = []
+            group = []
+            group_bytes = 0
+            for segment in self.segments:
+                if group and group_bytes + segment["bytes"] > target_bytes:
+                    groups.append(group)
+                    group = []
+                    group_bytes = 0
+                group.append(segment)
+                group_bytes += segment["bytes"]
+            if group:
+                groups.append(group)
+
+            for group in groups:
+                if len(group) < 2:
+                    continue
+                records = []
+                for segment in group:
+                    records.extend(self.iter_segment(segment))
+                self.write_segment(records, count_records=False, replaces=group)
+                merged += len(group)
+        return merged
+
+    def _delete_segment_file(self, segment: Dict[str, Any]) -> None:
+        self._cache.pop(segment["file"], None)
+        try:
+            os.remove(self.segment_path(segment))
+        except FileNotFoundError:
+            pass
+
+    def _segment_count(self, segment: Dict[str, Any], username: Optional[str],
+                       before: Optional[str], after: Optional[str],
+                       start: Optional[str], end: Optional[str]) -> int:
+        """Count matching records in a segment, only loading it if it straddles the bounds."""
+        if username is not None and username not in segment["usernames"]:
+            return 0
+
+        if ((before and segment["start"] >= before) or (end and segment["start"] > end) or
+                (after and segment["end"] <= after) or (start and segment["end"] < start)):
+            return 0
+
+        inside = ((not before or segment["end"] < before) and (not end or segment["end"] <= end) and
+                  (not after or segment["start"] > after) and (not start or segment["start"] >= start))
+        if inside:
+            return segment["usernames"][username] if username is not None else segment["count"]
+
+        return self.read_segment(segment).query(username, 0, 0, before, after, start, end)[1]
+
+    def query(self, live_index: LogIndex, username: Optional[str] = None, limit: int = 100, offset: int = 0,
+              before: Optional[str] = None, after: Optional[str] = None,
+              start: Optional[str] = None, end: Optional[str] = None,
+              segments: Optional[List[Dict[str, Any]]] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """Query the live index and the archive as one time-ordered log (see LogIndex.query).
+
+        `segments` are the archive segments the live index was loaded
+        against; by default the latest registered ones.
+        """
+        bounds = (before, after, start, end)
+
+        # Sources ordered newest first: the live index, then archive segments
+        sources = [(None, live_index)] + [(segment, None) for segment in reversed(self._current_segments(segments))]
+        forward = bool(after and not before)
+        if forward:
+            sources.reverse()
+
+        counts = []
+        for segment, index in sources:
+            if segment is None:
+                counts.append(index.query(username, 0, 0, *bounds)[1])
+            else:
+                counts.append(self._segment_count(segment, username, *bounds))
+
+        total = sum(counts)
+        offset = max(offset, 0)
+        remaining = max(limit, 0)
+        page = []
+        for (segment, index), count in zip(sources, counts):
+            if remaining <= 0:
+                break
+            if offset >= count:
+                offset -= count
+                continue
+
+            if index is None:
+                index = self.read_segment(segment)
+            records = index.query(username, remaining, offset, *bounds)[0]
+            page.extend(reversed(records) if forward else records)
+            remaining -= len(records)
+            offset = 0
+
+        return (page[::-1] if forward else page), total
+
+class ArchivedLogStore:
+    """Request logs kept as a live JSONL file plus compressed archive segments."""
+
+    def __init__(self, logs_file: str, archive_dir: str, legacy_logs_file: Optional[str] = None,
+                 fsync_policy: str = "interval", fsync_interval: float = 1.0, writer: Optional[Any] = None,
+                 rotate_max_bytes: int = 10 * 1024 * 1024, rotate_max_age_days: int = 7,
+                 retention_days: int = 0):
+        self.live_store = JsonlLogStore(logs_file, fsync_policy=fsync_policy,
+                                        fsync_interval=fsync_interval, writer=writer)
+        self.archive = LogArchive(archive_dir)
+        self.legacy_logs_file = legacy_logs_file
+        self.rotate_max_bytes = rotate_max_bytes
+        self.rotate_max_age_days = rotate_max_age_days
+        self.retention_days = retention_days
+        # Live records in the order they were logged, and indexed by time/username
+        self.live = []
+        self.index = LogIndex()
+        # The archive as of the live records: other workers' rotations are only
+        # picked up together with the live file they left
+        self.segments = []
+        self.archived_records = 0
+        self.manifest_signature = None
+        self._lock = threading.RLock()
+        # One rotation at a time, whether triggered by size or by maintenance
+        self._rotate_lock = threading.Lock()
+        self._rotation = BackgroundTask(self.rotate, "log-rotation")
+
+    def load(self) -> List[Dict[str, Any]]:
+        """Load the live logs, migrating the legacy JSON file if needed."""
+        with self._lock:
+            # Finish rotations interrupted by a restart
+            for rotated_path in self.live_store.pending_rotations():
+                self.archive.archive_file(rotated_path)
+
+            if (not self.live_store.exists() and not self.archive.manifest["total_records"] and
+                    self.legacy_logs_file and os.path.exists(self.legacy_logs_file)):
+                migrate_json_logs(self.legacy_logs_file, self.live_store.path)
+
+            self._reload()
+            return self.live
+
+    def _reload(self) -> None:
+        """Reload the live records together with the archive manifest they belong to."""
+        self.archive.refresh()
+        self.live = self.live_store.load()
+        index = LogIndex()
+        index.rebuild(self.live)
+        # Replaced rather than cleared: queries may still be reading the old one
+        self.index = index
+        self.segments = list(self.archive.segments)
+        self.archived_records = self.archive.manifest["total_records"]
+        self.manifest_signature = self.archive.manifest_signature
+
+    def _sync(self) -> None:
+        """Reload if the archive changed, e.g. another worker rotated the live file into it."""
+        with self._lock:
+            if file_signature(self.archive.manifest_file) != self.manifest_signature:
+                self._reload()
+
+    def count(self) -> int:
+        """Number of records ever logged, including archived and expired ones."""
+        with self._lock:
+            self._sync()
+            return self.archived_records + len(self.live)
+
+    def records_since(self, position: int) -> Optional[List[Dict[str, Any]]]:
+        """Records logged after the first `position` records, or None if they were archived."""
+        with self._lock:
+            self._sync()
+            if position < self.archived_records:
+                return None
+            return self.live[position - self.archived_records:]
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """Stream every record, archived segments first."""
+        with self._lock:
+            self._sync()
+            segments, live = self.segments, list(self.live)
+        return itertools.chain(self.archive.iter_records(segments), live)
+
+    def iter_range(self, username: Optional[str] = None, after: Optional[str] = None,
+                   start: Optional[str] = None, end: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Stream records matching the filters, oldest first, archived segments first.
+
+        `after` is an exclusive timestamp cursor, `start`/`end` an inclusive
+        time range (as in LogIndex.query).
+        """
+        with self._lock:
+            self._sync()
+            segments, index = self.segments, self.index
+        yield from self.archive.iter_range(username, after, start, end, segments)
+        yield from index.iter_range(username, after, start, end)
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Append a record, rotating the live file once it grows too large."""
+        with self._lock:
+            self.live.append(record)
+            self.live_store.append(record)
+            self.index.add(record)
+
+            if self.live_store.size >= self.rotate_max_bytes:
+                # Compressing the rotated file is left to a background thread
+                self._rotation.trigger()
+
+    def rotate(self) -> None:
+        """Move the live logs into a compressed archive segment."""
+        with self._rotate_lock:
+            with self._lock:
+                rotated_path = self.live_store.rotate()
+                if rotated_path is None:
+                    return
+
+            # Appends and queries go on, with the rotated records still live, while the file is compressed
+            self.archive.archive_file(rotated_path)
+            self._sync()
+
+    def run_maintenance(self) -> None:
+        """Rotate by age, expire old segments and compact small ones."""
+        with self._lock:
+            rotate = False
+            if self.index.records and self.rotate_max_age_days > 0:
+                oldest = self.index.records[0]["timestamp"]
+                rotate = oldest < (datetime.now() - timedelta(days=self.rotate_max_age_days)).isoformat()
+        if rotate:
+            self.rotate()
+
+        self.archive.apply_retention(self.retention_days)
+        self.archive.compact(self.rotate_max_bytes)
+
+    def query(self, username: Optional[str] = None, limit: int = 100, offset: int = 0,
+              before: Optional[str] = None, after: Optional[str] = None,
+              start: Optional[str] = None, end: Optional[str] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """Query live and archived logs as one time-ordered log (see LogIndex.query)."""
+        with self._lock:
+            self._sync()
+            segments, index = self.segments, self.index
+        return self.archive.query(index, username, limit, offset, before, after, start, end, segments)
@@ -0,0 +1,335 @@
+"""
+Async AI provider module for the Roblox Studio AI Plugin server.
+Sends the same provider requests as ai_provider.py over aiohttp, so one
+process can wait on thousands of generations without a thread for each.
+The response cache, coalescing, circuit breakers and hedging are shared
+with the blocking provider.
+"""
+import time
+import asyncio
+import functools
+import aiohttp
+from aiohttp.http_exceptions import HttpProcessingError
+from typing import Dict, List, Optional, Any, AsyncIterator, Awaitable, Callable, Tuple
+import config
+from ai_provider import ai_provider, AIProvider, ProviderClient, parse_stream_line
+from response_cache import response_cache
+from single_flight import single_flight
+from resilience import resilience, check_deadline, ProviderError
+from hedging import hedger
+
+async def iter_chunks(*chunks: str) -> AsyncIterator[str]:
+    """Stream the given chunks (e.g. a whole response as one chunk)."""
+    for chunk in chunks:
+        yield chunk
+
+async def prefetch_first(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Wait for a stream's first chunk (raising its errors now), then return an iterator over all chunks."""
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        return iter_chunks()
+
+    async def all_chunks() -> AsyncIterator[str]:
+        try:
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    return all_chunks()
+
+class AsyncProviderClient:
+    """Sends a provider client's requests with aiohttp, over its own connection pool."""
+
+    def __init__(self, client: ProviderClient):
+        self.client = client
+        self.name = client.name
+        self.timeout = client.timeout
+        self.session = None
+        self.loop = None
+
+    def _session(self) -> aiohttp.ClientSession:
+        # Sessions belong to the event loop they were created on
+        loop = asyncio.get_running_loop()
+        if self.session is None or self.session.closed or self.loop is not loop:
+            if self.session is not None and not self.session.closed:
+                self._close_stale(self.session, self.loop)
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=config.config["ASYNC_POOL_LIMIT"])
+            )
+            self.loop = loop
+        return self.session
+
+    @staticmethod
+    def _close_stale(session: aiohttp.ClientSession, loop: asyncio.AbstractEventLoop) -> None:
+        """Close a session left behind on another event loop, dropping its pooled connections."""
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+        else:
+            # A stopped loop's connections cannot be awaited; closing just releases them
+            asyncio.ensure_future(session.close())
+
+    def _invalid(self, error: Exception) -> ProviderError:
+        """Convert an unreadable response (bad JSON, or a stream line over the reader's limit)."""
+        return ProviderError(f"Invalid response from {self.client.label} API: {str(error)}", self.name)
+
+    def _error(self, error: Exception) -> ProviderError:
+        """Convert a failed aiohttp request; timeouts and connection errors are retryable."""
+        return ProviderError(
+            f"Error generating response: {str(error) or type(error).__name__}",
+            self.name,
+            retryable=isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError,
+                                         aiohttp.ClientPayloadError))
+        )
+
+    async def _post(self, url: str, payload: Dict[str, Any],
+                    timeout: Optional[Tuple[float, float]]) -> aiohttp.ClientResponse:
+        """POST a request, raising ProviderError unless it succeeds."""
+        connect_timeout, read_timeout = timeout or self.timeout
+        # Socket timeouts only bound each read; the total bounds the whole response by the call's deadline
+        deadline = getattr(timeout, "deadline", None)
+        total = max(deadline - time.monotonic(), 0.001) if deadline is not None else None
+        try:
+            response = await self._session().post(
+                url, headers=self.client.headers(), json=payload,
+                timeout=aiohttp.ClientTimeout(total=total, sock_connect=connect_timeout, sock_read=read_timeout)
+            )
+            if response.status != 200:
+                try:
+                    text = await response.text()
+                finally:
+                    response.release()
+                raise ProviderError.from_status(self.name, self.client.label, response.status, text,
+                                                response.headers.get("Retry-After", ""))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise self._error(e)
+        return response
+
+    async def _json(self, response: aiohttp.ClientResponse) -> Any:
+        try:
+            return await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise self._error(e)
+        except ValueError as e:
+            raise self._invalid(e)
+        finally:
+            response.release()
+
+    async def generate(self, model: str, messages: List[Dict[str, str]],
+                       timeout: Optional[Tuple[float, float]] = None) -> Tuple[str, Dict[str, Any]]:
+        """Generate a response; returns (content, raw response) or raises ProviderError."""
+        url, payload = self.client.request(model, messages)
+        response = await self._post(url, payload, timeout)
+        return self.client.parse_response(await self._json(response))
+
+    async def stream(self, model: str, messages: List[Dict[str, str]],
+                     timeout: Optional[Tuple[float, float]] = None) -> AsyncIterator[str]:
+        """Start a streamed response; returns an async iterator of text chunks or raises ProviderError."""
+        client = self.client
+        if client.stream_format is None:
+            content, _ = await self.generate(model, messages, timeout)
+            return iter_chunks(content)
+
+        url, payload = client.request(model, messages, stream=True)
+        response = await self._post(url, payload, timeout)
+        if not client.is_streamed(response.headers.get("Content-Type", "")):
+            return iter_chunks(client.parse_response(await self._json(response))[0])
+
+        async def chunks() -> AsyncIterator[str]:
+            try:
+                async for line in response.content:
+                    check_deadline(timeout, self.name)
+                    event = parse_stream_line(line.decode("utf-8").strip(), client.stream_format)
+                    if event is None:
+                        continue
+                    text = client.event_text(event)
+                    if text:
+                        yield text
+                    if client.is_last_event(event):
+                        break
+                else:
+                    raise client.incomplete_stream()
+                response.release()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise self._error(e)
+            except (ValueError, HttpProcessingError) as e:
+                # Lines over the reader's limit raise LineTooLong (a ValueError in older aiohttp)
+                raise self._invalid(e)
+            finally:
+                # Drops the connection if the stream was abandoned midway
+                response.close()
+
+        return chunks()
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+
+class AsyncAIProvider:
+    """Asyncio counterpart of AIProvider, with the same results and the same configuration."""
+
+    def __init__(self, provider: AIProvider):
+        self.provider = provider
+        self.clients = {name: AsyncProviderClient(client) for name, client in provider.clients.items()}
+
+    def resolve(self, provider: str, model: str) -> Tuple[Optional[AsyncProviderClient], str]:
+        """Get a provider's async client and full model name, or (None, error message)."""
+        client, model = self.provider.resolve(provider, model)
+        return (self.clients[client.name] if client is not None else None), model
+
+    def failover_targets(self, provider: str, model: str) -> List[Tuple[AsyncProviderClient, str]]:
+        return [(self.clients[client.name], target_model)
+                for client, target_model in self.provider.failover_targets(provider, model)]
+
+    async def _with_failover(self, client: AsyncProviderClient, model: str,
+                             call: Callable[[AsyncProviderClient, str, Tuple[float, float]], Awaitable[Any]],
+                             stream: bool = False) -> Tuple[Any, Optional[Dict[str, str]]]:
+        """Await call(client, model, timeout) resiliently, then on the failover targets (see AIProvider)."""
+        error = None
+        for index, (target, target_model) in enumerate([(client, model)] + self.failover_targets(client.name, model)):
+            try:
+                result = await resilience.call_async(
+                    target.name, lambda timeout: call(target, target_model, timeout), target.timeout, stream
+                )
+            except ProviderError as e:
+                # Only provider trouble is worth trying elsewhere
+                if not e.retryable:
+                    raise
+                error = e
+                continue
+            return result, ({"provider": target.name, "model": target_model} if index else None)
+        raise error
+
+    async def _hedged(self, client: AsyncProviderClient, model: str, role: Optional[str], kind: str,
+                      call: Callable[[AsyncProviderClient, str, Tuple[float, float]], Awaitable[Any]],
+                      discard: Optional[Callable[[Any], None]] = None,
+                      stream: bool = False) -> Tuple[Any, Optional[Dict[str, Any]]]:
+        """Await call(client, model, timeout) with failover, hedged like AIProvider._hedged.
+
+        A losing hedge or primary is cancelled, aborting its upstream request.
+        """
+        async def timed(target: AsyncProviderClient, target_model: str, timeout: Tuple[float, float]) -> Any:
+            started = time.monotonic()
+            result = await call(target, target_model, timeout)
+            hedger.record(target.name, kind, time.monotonic() - started)
+            return result
+
+        delay = hedger.delay(client.name, kind) if hedger.enabled and role else None
+        targets = self.failover_targets(client.name, model) if delay is not None else []
+        if not targets:
+            return await self._with_failover(client, model, timed, stream)
+
+        hedge_client, hedge_model = targets[0]
+
+        async def hedge() -> Tuple[Any, Dict[str, Any]]:
+            result = await resilience.call_async(
+                hedge_client.name, lambda timeout: timed(hedge_client, hedge_model, timeout), hedge_client.timeout,
+                stream
+            )
+            return result, {"provider": hedge_client.name, "model": hedge_model, "hedged": True}
+
+        (result, failover), _ = await hedger.race_async(
+            role, delay, lambda: self._with_failover(client, model, timed, stream), hedge,
+            discard=(lambda outcome: discard(outcome[0])) if discard is not None else None
+        )
+        return result, failover
+
+    async def _cache_lookup(self, provider: str, model: str, messages: List[Dict[str, str]],
+                            client: AsyncProviderClient, use_cache: bool) -> Tuple[Dict[str, Any], Optional[str], Dict[str, Any]]:
+        # The cache may read its SQLite tier, so it is used from a worker thread
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+            AIProvider._cache_lookup, provider, model, messages, client.client, use_cache
+        ))
+
+    @staticmethod
+    async def _cache_set(target: Dict[str, Any], provider: str, model: str, content: str) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+            response_cache.set, target["key"], provider, model, content, target["scope"], target["prompt"]
+        ))
+
+    async def generate_response(self, provider: str, model: str, messages: List[Dict[str, str]],
+                                system_prompt: Optional[str] = None, use_cache: bool = True,
+                                role: Optional[str] = None) -> Tuple[bool, str, Dict[str, Any]]:
+        """Generate a response, like AIProvider.generate_response."""
+        client, model = self.resolve(provider, model)
+        if client is None:
+            return False, model, {}
+
+        messages = AIProvider._with_system_prompt(messages, system_prompt)
+        target, content, cache_data = await self._cache_lookup(provider, model, messages, client, use_cache)
+        if content is not None:
+            return True, content, cache_data
+
+        async def call() -> Tuple[bool, str, Dict[str, Any]]:
+            try:
+                (content, response_data), failover = await self._hedged(
+                    client, model, role, "response", lambda target_client, target_model, timeout:
+                    target_client.generate(target_model, messages, timeout)
+                )
+            except ProviderError as e:
+                return False, e.message, {"retry_after": e.retry_after} if e.retryable else {}
+            except Exception as e:
+                return False, f"Error generating response: {str(e)}", {}
+
+            if failover is not None:
+                # Answers from another model are not cached for this one
+                return True, content, dict(response_data, failover=failover)
+            await self._cache_set(target, provider, model, content)
+            return True, content, response_data
+
+        result, _ = await single_flight.do_async(target["key"], call)
+        return result
+
+    async def stream_response(self, provider: str, model: str, messages: List[Dict[str, str]],
+                              system_prompt: Optional[str] = None, use_cache: bool = True,
+                              role: Optional[str] = None) -> Tuple[bool, str, AsyncIterator[str], Dict[str, Any]]:
+        """Start streaming a response, like AIProvider.stream_response; chunks are iterated asynchronously."""
+        client, model = self.resolve(provider, model)
+        if client is None:
+            return False, model, iter_chunks(), {}
+
+        messages = AIProvider._with_system_prompt(messages, system_prompt)
+        target, content, _ = await self._cache_lookup(provider, model, messages, client, use_cache)
+        if content is not None:
+            return True, "", iter_chunks(content), {}
+
+        async def open_stream(target_client: AsyncProviderClient, target_model: str,
+                              timeout: Tuple[float, float]) -> AsyncIterator[str]:
+            return await prefetch_first(await target_client.stream(target_model, messages, timeout))
+
+        try:
+            chunks, failover = await self._hedged(
+                client, model, role, "first_token", open_stream,
+                discard=lambda chunks: asyncio.ensure_future(chunks.aclose()),
+                stream=True
+            )
+        except ProviderError as e:
+            return False, e.message, iter_chunks(), {"retry_after": e.retry_after} if e.retryable else {}
+        except Exception as e:
+            return False, f"Error generating response: {str(e)}", iter_chunks(), {}
+
+        if failover is not None:
+            return True, "", chunks, {}
+        return True, "", self._cache_stream(chunks, target, provider, model), {}
+
+    async def _cache_stream(self, chunks: AsyncIterator[str], target: Dict[str, Any], provider: str,
+                            model: str) -> AsyncIterator[str]:
+        """Pass chunks through, caching the response once the stream completes."""
+        parts = []
+        try:
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+        finally:
+            await chunks.aclose()
+        await self._cache_set(target, provider, model, "".join(parts))
+
+    async def close(self) -> None:
+        """Close the clients' connection pools."""
+        for client in self.clients.values():
+            await client.close()
+
+# Create a singleton instance
+async_provider = AsyncAIProvider(ai_provider)
@@ -0,0 +1,207 @@
+"""
+Async server for the Roblox Studio AI Plugin server.
+Serves /generate and /generate_batch on an asyncio event loop, so a worker
+can hold thousands of generations in flight, and passes every other
+request to the Flask app in a worker thread. Run with:
+
+    gunicorn async_server:app --worker-class aiohttp.GunicornWebWorker
+"""
+import asyncio
+import contextvars
+import functools
+from typing import Any, AsyncIterator, Dict, List, Optional
+from aiohttp import web
+from multidict import CIMultiDict
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Response as WSGIResponse
+import config
+from app import app as flask_app, prepare_generation, prepare_batch, finish_generation, record_generation, \
+    format_stream_event, item_error, STREAM_FORMATS, STREAM_HEADERS
+from async_provider import async_provider
+
+async def run_blocking(fn, *args) -> Any:
+    """Run a blocking call (file, database or lock access) in a worker thread."""
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args))
+
+async def stream_generation(request: web.Request, chunks: AsyncIterator[str],
+                            generation: Dict[str, Any]) -> web.StreamResponse:
+    """Relay a provider's text chunks as stream events, recording the generation once it completes."""
+    stream_format = generation["stream_format"]
+    response = web.StreamResponse(headers=dict(STREAM_HEADERS, **{"Content-Type": STREAM_FORMATS[stream_format]}))
+    parts = []
+    try:
+        await response.prepare(request)
+        await response.write(format_stream_event(
+            "start", {"conversation_id": generation["conversation_id"], "tokens": generation["tokens"]},
+            stream_format
+        ).encode())
+
+        while True:
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                break
+            except Exception as e:
+                await response.write(format_stream_event("error", {
+                    "error": "generation_error",
+                    "message": f"Error generating response: {str(e)}"
+                }, stream_format).encode())
+                return response
+            parts.append(chunk)
+            await response.write(format_stream_event("delta", {"content": chunk}, stream_format).encode())
+
+        await run_blocking(
+            record_generation, generation["username"], generation["conversation_id"], generation["model"],
+            generation["prompt"], "".join(parts), generation["context_used"]
+        )
+        await response.write(format_stream_event(
+            "done", {"conversation_id": generation["conversation_id"]}, stream_format
+        ).encode())
+        return response
+    finally:
+        # Release the upstream connection if the client went away mid-stream
+        await chunks.aclose()
+
+async def read_json(request: web.Request) -> Optional[Dict[str, Any]]:
+    """Get a request's JSON object body, or None."""
+    try:
+        data = await request.json()
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def invalid_request() -> web.Response:
+    return web.json_response({
+        "error": "invalid_request",
+        "message": "Request body must be a JSON object."
+    }, status=400)
+
+async def generate(request: web.Request) -> web.StreamResponse:
+    """Generate a response from the AI model, like the Flask /generate route."""
+    data = await read_json(request)
+    if data is None:
+        return invalid_request()
+
+    error, generation = await run_blocking(prepare_generation, data)
+    if error is not None:
+        body, status, headers = error
+        return web.json_response(body, status=status, headers=headers)
+
+    if generation["stream_format"] is not None:
+        success, message, chunks, response_data = await async_provider.stream_response(
+            generation["provider"], generation["model"], generation["messages"],
+            use_cache=generation["use_cache"], role=generation["role"]
+        )
+        if not success:
+            body, status, headers = finish_generation(generation, False, message, response_data)
+            return web.json_response(body, status=status, headers=headers)
+        return await stream_generation(request, chunks, generation)
+
+    success, content, response_data = await async_provider.generate_response(
+        generation["provider"], generation["model"], generation["messages"],
+        use_cache=generation["use_cache"], role=generation["role"]
+    )
+
+    body, status, headers = await run_blocking(finish_generation, generation, success, content, response_data)
+    return web.json_response(body, status=status, headers=headers)
+
+async def generate_item(index: int, generation: Dict[str, Any], semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    """Generate and record one batch item, like app.generate_item."""
+    try:
+        async with semaphore:
+            success, content, response_data = await async_provider.generate_response(
+                generation["provider"], generation["model"], generation["messages"],
+                use_cache=generation["use_cache"], role=generation["role"]
+            )
+        body, status, _ = await run_blocking(finish_generation, generation, success, content, response_data)
+    except Exception as e:
+        return item_error(index, e)
+    return dict(body, index=index, status=status)
+
+async def generate_batch(request: web.Request) -> web.StreamResponse:
+    """Generate responses to several prompts concurrently, like the Flask /generate_batch route."""
+    data = await read_json(request)
+    if data is None:
+        return invalid_request()
+
+    error, batch = await run_blocking(prepare_batch, data)
+    if error is not None:
+        body, status, headers = error
+        return web.json_response(body, status=status, headers=headers)
+
+    semaphore = asyncio.Semaphore(batch["parallelism"])
+    tasks = [asyncio.ensure_future(generate_item(index, generation, semaphore))
+             for index, generation in enumerate(batch["items"])]
+    try:
+        stream_format = batch["stream_format"]
+        if stream_format is None:
+            results: List[Dict[str, Any]] = await asyncio.gather(*tasks)
+            return web.json_response({
+                "results": results,
+                "failed": sum(1 for result in results if result["status"] != 200)
+            })
+
+        response = web.StreamResponse(headers=dict(STREAM_HEADERS, **{"Content-Type": STREAM_FORMATS[stream_format]}))
+        await response.prepare(request)
+        failed = 0
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            failed += result["status"] != 200
+            await response.write(format_stream_event("result", result, stream_format).encode())
+        await response.write(format_stream_event("done", {"count": len(tasks), "failed": failed},
+                                                 stream_format).encode())
+        return response
+    finally:
+        # Items still running are cancelled if the client went away
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+async def wsgi(request: web.Request) -> web.StreamResponse:
+    """Serve a request with the Flask app in worker threads, relaying the response as it is produced."""
+    environ = EnvironBuilder(
+        path=request.path,
+        base_url=f"{request.scheme}://{request.host}",
+        query_string=request.query_string,
+        method=request.method,
+        headers=list(request.headers.items()),
+        data=await request.read(),
+        environ_overrides={"REMOTE_ADDR": request.remote or ""}
+    ).get_environ()
+
+    # Every step runs in one context, so the app's context variables carry over between worker threads
+    context = contextvars.copy_context()
+    response = await run_blocking(context.run, WSGIResponse.from_app, flask_app, environ)
+    try:
+        stream = web.StreamResponse(status=response.status_code,
+                                    headers=CIMultiDict(response.headers.to_wsgi_list()))
+        await stream.prepare(request)
+        chunks = response.iter_encoded()
+        while True:
+            chunk = await run_blocking(context.run, next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                await stream.write(chunk)
+        await stream.write_eof()
+        return stream
+    finally:
+        await run_blocking(context.run, response.close)
+
+async def close_clients(app: web.Application) -> None:
+    await async_provider.close()
+
+def create_app() -> web.Application:
+    """Create the aiohttp application."""
+    app = web.Application(client_max_size=config.config["ASYNC_MAX_REQUEST_BYTES"])
+    app.router.add_post("/generate", generate)
+    app.router.add_post("/generate_batch", generate_batch)
+    app.router.add_route("*", "/{path:.*}", wsgi)
+    app.on_cleanup.append(close_clients)
+    return app
+
+app = create_app()
+
+if __name__ == "__main__":
+    # Run the async server
+    web.run_app(app, host=config.config["HOST"], port=config.config["PORT"])
@@ -4,48 +4,98 @@ Handles user management, authentication, and permissions.
 """
 import os
 import json
+import sys
 import time
-from typing import Dict, List, Optional, Any, Tuple
+import atexit
+import threading
+import itertools
+from typing import Dict, List, Optional, Any, Iterable, Tuple
 from datetime import datetime
 import config
+import storage
+from rate_limiter import rate_limiter
+from persistence import writer
+from shared_state import file_signature
+
+# Operations accepted by apply_batch()
+BATCH_OPERATIONS = ("add", "update", "remove")
+
+# User fields updated on every login/request and saved by checkpoint()
+USAGE_FIELDS = ("last_login", "request_count", "daily_used", "last_reset")
+
+class PermissionTable:
+    """Immutable snapshot of the authorized users and their permissions.
+
+    Readers use whichever table is current without locking; changes build a
+    new table with a higher version and swap it in.
+    """
+
+    __slots__ = ("version", "roles", "user_permissions")
+
+    def __init__(self, version: int, roles: Dict[str, Dict[str, Any]],
+                 user_permissions: Dict[str, Dict[str, Any]]):
+        self.version = version
+        self.roles = roles
+        # username -> permissions of the user's role (empty for unknown roles)
+        self.user_permissions = user_permissions
+
+    @classmethod
+    def build(cls, version: int, roles: Dict[str, Dict[str, Any]], users: Dict[str, Any]) -> "PermissionTable":
+        """Build a table for all users."""
+        return cls(version, roles, {
+            username: roles.get(user.get("role"), {}) for username, user in users.items()
+            if isinstance(user, dict)
+        })
+
+    def with_users(self, changes: Dict[str, Optional[Dict[str, Any]]]) -> "PermissionTable":
+        """Get the next version of the table with some users changed (None removes a user)."""
+        user_permissions = dict(self.user_permissions)
+        for username, user in changes.items():
+            if user is None:
+                user_permissions.pop(username, None)
+            else:
+                user_permissions[username] = self.roles.get(user.get("role"), {})
+        return PermissionTable(self.version + 1, self.roles, user_permissions)
+
+    def is_authorized(self, username: str) -> bool:
+        return username in self.user_permissions
+
+    def check(self, username: str, permission: str) -> bool:
+        permissions = self.user_permissions.get(username)
+        if permissions is None:
+            return False
+        return permissions.get(permission, False)
 
 class AuthManager:
     def __init__(self):
         self.users_file = config.config["USERS_FILE"]
+        self.roles_file = config.config["ROLES_FILE"]
+        # Replaced (never modified in place) so readers need no lock
         self.users = {}
+        self.permissions = PermissionTable(0, config.roles, {})
+        self.store = storage.create_user_store()
+        self.rate_limiter = rate_limiter
+        # Users whose usage counters changed since the last checkpoint
+        self._dirty = set()
+        self._last_checkpoint = time.monotonic()
+        self._roles_signature = None
+        self._next_reload = 0.0
+        # Serializes changes to users/permissions; readers never take it
+        self._write_lock = threading.RLock()
         self.ensure_data_dir()
+        self.load_roles()
         self.load_users()
+        atexit.register(self.checkpoint)
     
     def ensure_data_dir(self):
         """Ensure the data directory exists."""
         os.makedirs(os.path.dirname(self.users_file), exist_ok=True)
     
     def load_users(self) -> Dict[str, Any]:
-        """Load users from the JSON file."""
-        if not os.path.exists(self.users_file):
-            # Create default users file with admin user
-            default_users = {
-                user: {
-                    "username": user,
-                    "role": "Admin",
-                    "added_on": datetime.now().isoformat(),
-                    "last_login": None,
-                    "request_count": 0,
-                    "daily_limit": config.roles["Admin"]["daily_limit"],
-                    "daily_used": 0,
-                    "last_reset": datetime.now().isoformat()
-                } for user in config.config["ADMIN_USERNAMES"]
-            }
-            self.save_users(default_users)
-            self.users = default_users
-            return default_users
-        
-        try:
-            with open(self.users_file, "r") as f:
-                self.users = json.load(f)
-                return self.users
-        except (json.JSONDecodeError, FileNotFoundError):
-            # If file is corrupted or doesn't exist, create a new one
+        """Load users from the storage backend."""
+        users = self.store.load()
+        if users is None:
+            # If there are no users yet (or the file is corrupted), create the default admins
             default_users = {
                 user: {
                     "username": user,
@@ -59,21 +109,96 @@ class AuthManager:
                 } for user in config.config["ADMIN_USERNAMES"]
             }
             self.save_users(default_users)
-            self.users = default_users
-            return default_users
+            users = default_users
+        
+        with self._write_lock:
+            self.users = users
+            self.permissions = PermissionTable.build(self.permissions.version + 1, config.roles, users)
+        return self.users
+    
+    def load_roles(self) -> Dict[str, Dict[str, Any]]:
+        """Load the roles from config.py, overridden or extended by the optional roles file."""
+        roles = {role: dict(permissions) for role, permissions in config.ROLES.items()}
+        self._roles_signature = file_signature(self.roles_file)
+        if self._roles_signature is not None:
+            try:
+                with open(self.roles_file, "r") as f:
+                    overrides = json.load(f)
+            except json.JSONDecodeError as e:
+                print(f"Error loading roles file '{self.roles_file}': {str(e)}", file=sys.stderr)
+                return config.roles
+            
+            for role, permissions in overrides.items():
+                if isinstance(permissions, dict):
+                    roles.setdefault(role, {}).update(permissions)
+        
+        config.roles = roles
+        return roles
+    
+    def reload(self) -> int:
+        """Apply user and role changes made by other workers; returns the permission table version.
+
+        Polls run it on the write-behind thread (see _maybe_reload), after
+        this worker's queued user writes.
+        """
+        with self._write_lock:
+            if file_signature(self.roles_file) != self._roles_signature:
+                roles = self.load_roles()
+                self.permissions = PermissionTable.build(self.permissions.version + 1, roles, self.users)
+            
+            if self.store.changed():
+                # Only changed records are applied (and, with SQLite, read)
+                changes = self.store.load_changes(self.users)
+                if changes:
+                    self._apply_changes(changes, keep_usage=True)
+        return self.permissions.version
+    
+    def _maybe_reload(self) -> None:
+        """Poll for changes every USERS_RELOAD_INTERVAL seconds, without blocking readers."""
+        interval = config.config["USERS_RELOAD_INTERVAL"]
+        if interval <= 0 or time.monotonic() < self._next_reload:
+            return
+        
+        # Readers keep using the current table while the write-behind thread reloads
+        self._next_reload = time.monotonic() + interval
+        writer.replace(f"{self.users_file}.reload", "", lambda _: self.reload())
+    
+    def _apply_changes(self, changes: Dict[str, Optional[Dict[str, Any]]], keep_usage: bool = False) -> None:
+        """Swap in new users and permission tables with some users changed (None removes a user)."""
+        with self._write_lock:
+            users = dict(self.users)
+            for username, user in changes.items():
+                if user is None:
+                    users.pop(username, None)
+                    continue
+                if keep_usage and username in self._dirty and username in users:
+                    # Counters not yet checkpointed are newer than the stored ones
+                    user = dict(user, **{field: users[username].get(field) for field in USAGE_FIELDS})
+                users[username] = user
+            
+            self.users = users
+            self.permissions = self.permissions.with_users(changes)
     
     def save_users(self, users: Dict[str, Any]) -> None:
-        """Save users to the JSON file."""
+        """Save all users to the storage backend."""
         self.ensure_data_dir()
-        with open(self.users_file, "w") as f:
-            json.dump(users, f, indent=2)
+        self.store.save_all(users)
+    
+    def save_user(self, username: str) -> None:
+        """Save a single user to the storage backend."""
+        if username in self.users:
+            self.store.upsert(self.users[username])
+        else:
+            self.store.delete(username)
     
     def is_authorized(self, username: str) -> bool:
         """Check if a user is authorized."""
-        return username in self.users
+        self._maybe_reload()
+        return self.permissions.is_authorized(username)
     
     def get_user(self, username: str) -> Optional[Dict[str, Any]]:
         """Get user information."""
+        self._maybe_reload()
         return self.users.get(username)
     
     def add_user(self, username: str, role: str = "User") -> Tuple[bool, str]:
@@ -87,18 +212,9 @@ class AuthManager:
         if role not in config.roles:
             return False, f"Invalid role: {role}"
         
-        self.users[username] = {
-            "username": username,
-            "role": role,
-            "added_on": datetime.now().isoformat(),
-            "last_login": None,
-            "request_count": 0,
-            "daily_limit": config.roles[role]["daily_limit"],
-            "daily_used": 0,
-            "last_reset": datetime.now().isoformat()
-        }
+        self._apply_changes({username: self.new_user(username, role)})
         
-        self.save_users(self.users)
+        self.save_user(username)
         return True, f"User '{username}' added with role '{role}'"
     
     def remove_user(self, username: str) -> Tuple[bool, str]:
@@ -106,8 +222,10 @@ class AuthManager:
         if username not in self.users:
             return False, f"User '{username}' not found"
         
-        del self.users[username]
-        self.save_users(self.users)
+        self._apply_changes({username: None})
+        self._dirty.discard(username)
+        self.rate_limiter.reset_user(username)
+        self.save_user(username)
         return True, f"User '{username}' removed"
     
     def update_user(self, username: str, role: Optional[str] = None) -> Tuple[bool, str]:
@@ -118,57 +236,190 @@ class AuthManager:
         if role is not None:
             if role not in config.roles:
                 return False, f"Invalid role: {role}"
-            self.users[username]["role"] = role
-            self.users[username]["daily_limit"] = config.roles[role]["daily_limit"]
+            self._apply_changes({username: dict(
+                self.users[username],
+                role=role,
+                daily_limit=config.roles[role]["daily_limit"]
+            )})
+            self.rate_limiter.reset_user(username)
         
-        self.save_users(self.users)
+        self.save_user(username)
         return True, f"User '{username}' updated"
     
+    def new_user(self, username: str, role: str) -> Dict[str, Any]:
+        """Create a user record."""
+        return {
+            "username": username,
+            "role": role,
+            "added_on": datetime.now().isoformat(),
+            "last_login": None,
+            "request_count": 0,
+            "daily_limit": config.roles[role]["daily_limit"],
+            "daily_used": 0,
+            "last_reset": datetime.now().isoformat()
+        }
+    
+    def apply_batch(self, operations: Iterable[Dict[str, Any]]) -> Tuple[bool, List[Dict[str, Any]]]:
+        """Validate and apply add/update/remove operations atomically, persisting once.
+        
+        Operations are validated in order, each seeing the effect of the
+        previous ones. If any is invalid nothing is applied. Returns
+        (success, per-operation results).
+        """
+        max_operations = config.config["BULK_USERS_MAX_OPERATIONS"]
+        # Read (possibly streamed) operations before locking
+        operations = list(itertools.islice(operations, max_operations + 1))
+        if len(operations) > max_operations:
+            return False, [{
+                "index": max_operations,
+                "success": False,
+                "message": f"Too many operations (max {max_operations})"
+            }]
+        
+        self._maybe_reload()
+        results = []
+        # username -> new record, or None once removed
+        changes = {}
+        # Users whose rate limit state must be reset (removed or role changed)
+        reset = set()
+        failed = False
+        
+        with self._write_lock:
+            for index, operation in enumerate(operations):
+                if not isinstance(operation, dict):
+                    operation = {}
+                op = str(operation.get("op", "")).strip().lower()
+                username = str(operation.get("username", "")).strip()
+                role = str(operation.get("role", "") or "").strip()
+                current = changes[username] if username in changes else self.users.get(username)
+                
+                if op not in BATCH_OPERATIONS:
+                    success, message = False, f"Invalid operation: {op}"
+                elif not username:
+                    success, message = False, "Username cannot be empty"
+                elif op == "add" and current is not None:
+                    success, message = False, f"User '{username}' already exists"
+                elif op != "add" and current is None:
+                    success, message = False, f"User '{username}' not found"
+                elif op != "remove" and (role or op == "add") and (role or "User") not in config.roles:
+                    success, message = False, f"Invalid role: {role}"
+                elif op == "add":
+                    changes[username] = self.new_user(username, role or "User")
+                    success, message = True, f"User '{username}' added with role '{role or 'User'}'"
+                elif op == "update":
+                    if role:
+                        changes[username] = dict(current, role=role, daily_limit=config.roles[role]["daily_limit"])
+                        reset.add(username)
+                    success, message = True, f"User '{username}' updated"
+                else:
+                    changes[username] = None
+                    reset.add(username)
+                    success, message = True, f"User '{username}' removed"
+                
+                failed = failed or not success
+                results.append({
+                    "index": index,
+                    "op": op,
+                    "username": username,
+                    "success": success,
+                    "message": message
+                })
+            
+            if failed or not changes:
+                return not failed, results
+            
+            self._apply_changes(changes)
+            for username in reset:
+                if changes[username] is None:
+                    self._dirty.discard(username)
+                self.rate_limiter.reset_user(username)
+        
+        self.store.save_changes(changes)
+        return True, results
+    
     def list_users(self) -> List[Dict[str, Any]]:
         """List all users."""
+        self._maybe_reload()
         return [user for user in self.users.values()]
     
+    def _update_usage(self, username: str, fields: Dict[str, Any]) -> None:
+        """Swap in new users with some usage fields of a user changed, to be saved by checkpoint()."""
+        with self._write_lock:
+            user = self.users.get(username)
+            if user is None:
+                # Removed in the meantime
+                return
+            users = dict(self.users)
+            users[username] = dict(user, **fields)
+            self.users = users
+            self._dirty.add(username)
+        self.maybe_checkpoint()
+    
     def record_login(self, username: str) -> None:
         """Record user login."""
         if username in self.users:
-            self.users[username]["last_login"] = datetime.now().isoformat()
-            self.save_users(self.users)
+            self._update_usage(username, {"last_login": datetime.now().isoformat()})
     
-    def record_request(self, username: str) -> Tuple[bool, str]:
-        """Record a user request and check rate limits."""
-        if username not in self.users:
-            return False, "User not found"
+    def record_request(self, username: str, count: int = 1) -> Tuple[bool, str, int]:
+        """Record a user request (or `count` of them at once) and check rate limits.
         
-        user = self.users[username]
+        Returns (success, message, retry_after seconds). Counters are updated
+        in memory and saved by checkpoint().
+        """
+        user = self.users.get(username)
+        if user is None:
+            return False, "User not found", 0
         
-        # Check if we need to reset daily usage
-        last_reset = datetime.fromisoformat(user["last_reset"])
-        now = datetime.now()
-        if last_reset.date() < now.date():
-            user["daily_used"] = 0
-            user["last_reset"] = now.isoformat()
+        success, message, retry_after = self.rate_limiter.acquire(
+            username,
+            user["role"],
+            user["daily_limit"],
+            user,
+            count
+        )
+        if not success:
+            return False, message, retry_after
         
-        # Check daily limit
-        if user["daily_used"] >= user["daily_limit"]:
-            return False, "Daily request limit reached"
+        # Record the request (the limiter's counters are shared by all workers)
+        usage = self.rate_limiter.get_usage(username)
+        fields = {"daily_used": usage["daily_used"], "request_count": usage["request_count"]}
+        if not (user.get("last_reset") or "").startswith(usage["day"]):
+            fields["last_reset"] = datetime.now().isoformat()
+        self._update_usage(username, fields)
         
-        # Record the request
-        user["request_count"] += 1
-        user["daily_used"] += 1
-        self.save_users(self.users)
-        
-        return True, "Request recorded"
+        return True, message, 0
+    
+    def request_capacity(self, username: str) -> Optional[int]:
+        """Get the most requests a user can record at once (e.g. a batch's items), or None if unlimited."""
+        user = self.users.get(username)
+        if user is None:
+            return None
+        return self.rate_limiter.capacity(username, user["role"], user["daily_limit"])
+    
+    def maybe_checkpoint(self) -> None:
+        """Checkpoint usage counters if the checkpoint interval has passed."""
+        if time.monotonic() - self._last_checkpoint >= config.config["RATE_LIMIT_CHECKPOINT_INTERVAL"]:
+            self.checkpoint()
+    
+    def checkpoint(self) -> None:
+        """Save the usage fields of users whose counters changed."""
+        self._last_checkpoint = time.monotonic()
+        # Request threads add to the dirty set and replace the users dict under the write lock
+        with self._write_lock:
+            dirty, self._dirty = self._dirty, set()
+            users = self.users
+        # Only usage fields are written, so role changes made by other workers are kept
+        updates = {
+            username: {field: users[username].get(field) for field in USAGE_FIELDS}
+            for username in dirty if username in users
+        }
+        if updates:
+            self.store.update_fields(updates)
     
     def check_permission(self, username: str, permission: str) -> bool:
         """Check if a user has a specific permission."""
-        if username not in self.users:
-            return False
-        
-        user_role = self.users[username]["role"]
-        if user_role not in config.roles:
-            return False
-        
-        return config.roles[user_role].get(permission, False)
+        self._maybe_reload()
+        return self.permissions.check(username, permission)
 
 # Create a singleton instance
 auth_manager = AuthManager()
@@ -12,12 +12,51 @@ DEFAULT_CONFIG = {
     "PORT": int(os.environ.get("PORT", 5000)),
     "DEBUG": False,
     
+    # Storage backend: "json" (files under data/, fine for small installs) or
+    # "sqlite" (one WAL-mode database shared by all workers)
+    "STORAGE_BACKEND": "json",
+    "SQLITE_FILE": "data/plugin.db",
+    
     # File paths
     "USERS_FILE": "data/users.json",
-    "LOGS_FILE": "data/logs.json",
-    "HISTORY_FILE": "data/history.json",
+    "ROLES_FILE": "data/roles.json",  # Optional overrides of ROLES, reloaded on change
+    "USERS_RELOAD_INTERVAL": 1,  # seconds between checks for user/role changes by other workers (0 disables)
+    "BULK_USERS_MAX_OPERATIONS": 10000,  # per /bulk_users request
+    "LOGS_FILE": "data/logs.jsonl",
+    "LEGACY_LOGS_FILE": "data/logs.json",  # Migrated into LOGS_FILE on first start
+    "HISTORY_DIR": "data/history",  # One JSONL segment per conversation
+    "LEGACY_HISTORY_FILE": "data/history.json",  # Migrated into HISTORY_DIR on first start
+    "HISTORY_CACHE_SIZE": 256,  # Conversations kept in memory
     "UPLOADS_DIR": "data/uploads",
     
+    # Persistence ("sync" writes in the request thread; "group" and "async"
+    # queue writes for a background thread, with and without fsync)
+    "PERSISTENCE_MODE": "group",
+    "PERSISTENCE_FLUSH_INTERVAL_MS": 50,  # Group commit window
+    "PERSISTENCE_MAX_BATCH": 512,  # Writes per group commit
+    "PERSISTENCE_MAX_QUEUE": 10000,  # Writers block once this many writes are queued
+    
+    # Log durability
+    "LOGS_FSYNC": "interval",  # "always", "interval" or "never"
+    "LOGS_FSYNC_INTERVAL": 1,  # seconds between fsyncs for "interval"
+    
+    # Archiving and retention (0 days keeps data forever)
+    "ARCHIVE_DIR": "data/archive",  # Compressed, immutable log and history segments
+    "LOGS_ROTATE_MAX_BYTES": 10 * 1024 * 1024,  # Rotate the live log file past this size
+    "LOGS_ROTATE_MAX_AGE_DAYS": 7,  # or once its oldest entry is this old
+    "LOGS_RETENTION_DAYS": 0,
+    "HISTORY_ARCHIVE_AFTER_DAYS": 30,  # Compress conversations idle for this long
+    "HISTORY_RETENTION_DAYS": 0,
+    "ARCHIVE_CHECK_INTERVAL": 300,  # seconds between maintenance runs
+    
+    # Full-text search over history and logs
+    "SEARCH_ENABLED": True,
+    "SEARCH_INDEX_FILE": "data/search_index.jsonl",  # Rebuilt from the logs and history if missing
+    
+    # Usage statistics
+    "USAGE_STATS_FILE": "data/usage_stats.json",  # Rollups rebuilt from the logs if missing
+    "USAGE_STATS_SAVE_INTERVAL": 5,  # seconds between rollup saves
+    
     # AI Provider settings
     "DEFAULT_PROVIDER": "openrouter",
     "DEFAULT_MODEL": "mistralai/mistral-7b-instruct:free",
@@ -27,9 +66,73 @@ DEFAULT_CONFIG = {
     "HUGGINGFACE_API_KEY": "",  # Add your Hugging Face API key here
     "OLLAMA_BASE_URL": "http://localhost:11434",  # For self-hosted Ollama
     
+    # Provider HTTP connections (providers may override "connect_timeout"/"read_timeout")
+    "HTTP_POOL_CONNECTIONS": 4,  # Hosts kept in each provider session's pool
+    "HTTP_POOL_MAXSIZE": 32,  # Keep-alive connections per host; at least the worker's thread count
+    "HTTP_CONNECT_TIMEOUT": 5,  # seconds
+    "HTTP_READ_TIMEOUT": 120,  # seconds between bytes of a response
+    "ASYNC_POOL_LIMIT": 1000,  # Connections per provider for the async server (async_server.py)
+    "ASYNC_MAX_REQUEST_BYTES": 64 * 1024 * 1024,  # Largest request body the async server accepts
+    
+    # Most recent conversation messages sent with a prompt, as far as the model's
+    # token budget allows (see MODEL_FAMILIES)
+    "CONTEXT_HISTORY_MESSAGES": 10,
+    
+    # /generate_batch: prompts per batch, and how many are generated at once
+    "BATCH_MAX_ITEMS": 100,
+    "BATCH_PARALLELISM": 8,  # default for requests without "parallelism"
+    "BATCH_MAX_PARALLELISM": 32,
+    "BATCH_MAX_WORKERS": 64,  # threads generating batch items, shared by all batches
+    
+    # Provider resilience (providers may override "deadline")
+    "PROVIDER_DEADLINE": 90,  # seconds per provider call, retries included
+    "RETRY_MAX_ATTEMPTS": 3,  # on 429/5xx, timeouts and connection errors
+    "RETRY_BASE_DELAY_MS": 250,  # doubled per attempt, with full jitter
+    "RETRY_MAX_DELAY_MS": 4000,
+    "BREAKER_WINDOW": 20,  # recent calls considered by a provider's circuit breaker
+    "BREAKER_MIN_CALLS": 5,
+    "BREAKER_ERROR_RATE": 0.5,  # open at this share of failed calls
+    "BREAKER_SLOW_CALL_SECONDS": 30,
+    "BREAKER_SLOW_CALL_RATE": 0.5,  # or at this share of slow calls
+    "BREAKER_COOLDOWN": 30,  # seconds open before a trial call
+    # Providers tried in order when one fails, with the same shorthand model name
+    # (e.g. "mistral"); a comma-separated list in the environment, empty to disable
+    "FAILOVER_CHAIN": ["openrouter", "ollama"],
+    
+    # Hedged requests: once a provider is slower than this percentile of its recent
+    # latency (or time to first token), also ask the next FAILOVER_CHAIN provider
+    "HEDGE_ENABLED": False,
+    "HEDGE_PERCENTILE": 95.0,
+    "HEDGE_MIN_DELAY_MS": 500,
+    "HEDGE_MIN_SAMPLES": 20,  # latencies needed before hedging a provider
+    "HEDGE_BUDGET": 0.05,  # hedges per request, unless the role sets "hedge_budget"
+    "HEDGE_MAX_WORKERS": 32,  # threads sending hedge requests
+    "HEDGE_MAX_PRIMARIES": 64,  # hedgeable requests in flight; more are sent unhedged
+    
+    # Response cache for identical generations (same provider, model, messages and params)
+    "RESPONSE_CACHE_ENABLED": True,
+    "RESPONSE_CACHE_TTL": 24 * 60 * 60,  # seconds
+    "RESPONSE_CACHE_MAX_ENTRIES": 1000,  # In-memory tier, per worker
+    "RESPONSE_CACHE_MAX_BYTES": 16 * 1024 * 1024,
+    "RESPONSE_CACHE_DISK_FILE": "",  # e.g. "data/response_cache.db" to add a tier shared by all workers
+    "RESPONSE_CACHE_DISK_MAX_BYTES": 256 * 1024 * 1024,
+    # Near-duplicate prompts (same provider, model and earlier messages, e.g. the system prompt)
+    "NEAR_CACHE_ENABLED": True,
+    "NEAR_CACHE_THRESHOLD": 0.8,  # Jaccard similarity of prompt shingles
+    "NEAR_CACHE_SHINGLE_SIZE": 2,  # words per shingle
+    "NEAR_CACHE_MAX_ENTRIES": 1000,  # per worker
+    
+    # Concurrent identical generations share one upstream call (per worker)
+    "SINGLE_FLIGHT_ENABLED": True,
+    "SINGLE_FLIGHT_TIMEOUT": 130,  # seconds to wait for the shared call before making one's own
+    
     # Rate limiting
     "RATE_LIMIT_ENABLED": True,
-    "RATE_LIMIT_DEFAULT": 20,  # requests per minute
+    "RATE_LIMIT_DEFAULT": 20,  # requests per minute per user, unless the role sets "rate_limit"
+    "RATE_LIMIT_CHECKPOINT_INTERVAL": 30,  # seconds between saves of the usage counters
+    # "memory" (per process) or "shared" (SHARED_STATE_FILE, used by all workers on the node)
+    "RATE_LIMIT_BACKEND": "shared",
+    "SHARED_STATE_FILE": "data/shared_state.db",
     
     # Security
     "REQUIRE_AUTH": True,
@@ -70,6 +173,9 @@ PROVIDERS = {
 }
 
 # User roles and permissions
+# Optional rate limits (requests per minute): "rate_limit" per user of the role
+# and "role_rate_limit" shared by all users of the role. Optional "hedge_budget":
+# extra hedged upstream requests allowed per request (see HEDGE_BUDGET)
 ROLES = {
     "Admin": {
         "can_manage_users": True,
@@ -77,7 +183,8 @@ ROLES = {
         "can_use_all_models": True,
         "can_upload_files": True,
         "can_modify_workspace": True,
-        "daily_limit": 1000
+        "daily_limit": 1000,
+        "rate_limit": 60
     },
     "Developer": {
         "can_manage_users": False,
@@ -85,7 +192,8 @@ ROLES = {
         "can_use_all_models": True,
         "can_upload_files": True,
         "can_modify_workspace": True,
-        "daily_limit": 500
+        "daily_limit": 500,
+        "rate_limit": 40
     },
     "Manager": {
         "can_manage_users": True,
@@ -101,7 +209,8 @@ ROLES = {
         "can_use_all_models": False,
         "can_upload_files": False,
         "can_modify_workspace": False,
-        "daily_limit": 100
+        "daily_limit": 100,
+        "role_rate_limit": 300
     }
 }
 
@@ -113,6 +222,22 @@ SYSTEM_PROMPTS = {
     "debugging": "You are a debugging assistant for Roblox Studio. Help users identify and fix issues in their code and games."
 }
 
+# Token estimation and prompt budgets per model family. A model uses the first
+# family contained in its name (lowercased), else "default". chars_per_token
+# calibrates the token estimator for the family's tokenizer; budget is the most
+# tokens sent per request (the context window less room for the response)
+MODEL_FAMILIES = {
+    "llama3": {"chars_per_token": 4.0, "budget": 6000},
+    "codellama": {"chars_per_token": 3.2, "budget": 12000},
+    "llama": {"chars_per_token": 3.2, "budget": 3000},
+    "mixtral": {"chars_per_token": 3.3, "budget": 28000},
+    "mistral": {"chars_per_token": 3.3, "budget": 6000},
+    "gpt-4": {"chars_per_token": 4.0, "budget": 6000},
+    "claude": {"chars_per_token": 3.8, "budget": 150000},
+    "deepseek": {"chars_per_token": 4.0, "budget": 28000},
+    "default": {"chars_per_token": 3.5, "budget": 3000}
+}
+
 # Load environment variables to override defaults
 for key in DEFAULT_CONFIG:
     if key in os.environ:
@@ -120,6 +245,8 @@ for key in DEFAULT_CONFIG:
             DEFAULT_CONFIG[key] = os.environ[key].lower() == 'true'
         elif isinstance(DEFAULT_CONFIG[key], int):
             DEFAULT_CONFIG[key] = int(os.environ[key])
+        elif isinstance(DEFAULT_CONFIG[key], float):
+            DEFAULT_CONFIG[key] = float(os.environ[key])
         else:
             DEFAULT_CONFIG[key] = os.environ[key]
 
@@ -128,4 +255,5 @@ config = DEFAULT_CONFIG
 providers = PROVIDERS
 roles = ROLES
 system_prompts = SYSTEM_PROMPTS
+model_families = MODEL_FAMILIES
 
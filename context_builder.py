@@ -0,0 +1,136 @@
+"""
+Context builder module for the Roblox Studio AI Plugin server.
+Assembles the messages sent for a generation within the model's token
+budget, by priority: the system prompt, the current prompt, the most
+recent conversation turns, then the workspace context. Parts that do not
+fit are truncated or dropped; the system prompt and the prompt are only
+cut short, never dropped.
+"""
+import math
+import re
+from typing import Dict, List, Any, Tuple
+import config
+
+# Words and single punctuation marks: roughly where BPE tokenizers split text
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+# Tokens of framing (role markers, separators) per message
+MESSAGE_OVERHEAD = 4
+WORKSPACE_HEADER = "\n\nWorkspace Context:\n"
+TRUNCATION_MARKER = "\n...[truncated]"
+
+class ContextOverflow(ValueError):
+    """Raised when a model's budget leaves no room for any of the prompt."""
+
+class ContextBuilder:
+    def __init__(self, families: Dict[str, Dict[str, Any]], history_messages: int = 10):
+        # family -> {"chars_per_token", "budget"}; see MODEL_FAMILIES
+        self.families = families
+        self.history_messages = history_messages
+
+    def family(self, model: str) -> str:
+        """Get the family whose settings apply to a model: the first one contained in its name."""
+        name = model.lower()
+        return next((family for family in self.families if family != "default" and family in name), "default")
+
+    def _piece_tokens(self, piece: str, family: str) -> int:
+        return math.ceil(len(piece) / float(self.families[family]["chars_per_token"]))
+
+    def estimate(self, text: str, family: str) -> int:
+        """Estimate how many tokens a model family's tokenizer makes of a text."""
+        return sum(self._piece_tokens(piece, family) for piece in TOKEN_PATTERN.findall(text))
+
+    def _prefix_end(self, text: str, max_tokens: int, family: str) -> int:
+        """Get the end of the longest start of a text estimated at most max_tokens."""
+        used = end = 0
+        for match in TOKEN_PATTERN.finditer(text):
+            used += self._piece_tokens(match.group(), family)
+            if used > max_tokens:
+                break
+            end = match.end()
+        return end
+
+    def truncate(self, text: str, max_tokens: int, family: str) -> str:
+        """Cut a text to at most about max_tokens, keeping its start and marking the cut.
+
+        The marker is left out when it would not leave room for any text;
+        returns "" only if not even the first word fits.
+        """
+        if self.estimate(text, family) <= max_tokens:
+            return text
+
+        end = self._prefix_end(text, max_tokens - self.estimate(TRUNCATION_MARKER, family), family)
+        if end:
+            return text[:end] + TRUNCATION_MARKER
+        return text[:self._prefix_end(text, max_tokens, family)]
+
+    def build(self, model: str, system_prompt: str, prompt: str, conversation: List[Dict[str, Any]],
+              workspace_context: str = "") -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+        """Assemble the messages for a prompt within the model's budget.
+
+        Returns the messages and their estimated token counts: per part,
+        the total and budget, and what was truncated or dropped. Raises
+        ContextOverflow if the budget leaves no room for the prompt.
+        """
+        family = self.family(model)
+        budget = int(self.families[family]["budget"])
+
+        # The system prompt and prompt always go; if together they overflow, the system
+        # prompt is cut to leave the prompt at least half the budget, then the prompt is cut
+        system_tokens = self.estimate(system_prompt, family) + MESSAGE_OVERHEAD
+        prompt_tokens = self.estimate(prompt, family) + MESSAGE_OVERHEAD
+        system_truncated = prompt_truncated = False
+        if system_tokens + prompt_tokens > budget:
+            system_budget = budget - min(prompt_tokens, budget // 2)
+            if system_tokens > system_budget:
+                system_truncated = True
+                system_prompt = self.truncate(system_prompt, system_budget - MESSAGE_OVERHEAD, family)
+                system_tokens = self.estimate(system_prompt, family) + MESSAGE_OVERHEAD
+
+            if system_tokens + prompt_tokens > budget:
+                prompt_truncated = True
+                prompt = self.truncate(prompt, budget - system_tokens - MESSAGE_OVERHEAD, family)
+                if not prompt:
+                    raise ContextOverflow(f"The token budget of model '{model}' ({budget}) leaves no room for the prompt")
+                prompt_tokens = self.estimate(prompt, family) + MESSAGE_OVERHEAD
+        remaining = budget - system_tokens - prompt_tokens
+
+        # Most recent turns first, up to the first one that does not fit
+        recent = conversation[-self.history_messages:] if self.history_messages > 0 else []
+        history = []
+        history_tokens = 0
+        for message in reversed(recent):
+            tokens = self.estimate(message["content"], family) + MESSAGE_OVERHEAD
+            if tokens > remaining:
+                break
+            history.insert(0, {"role": message["role"], "content": message["content"]})
+            history_tokens += tokens
+            remaining -= tokens
+
+        # The workspace context gets what is left
+        workspace_tokens = 0
+        workspace = ""
+        if workspace_context:
+            available = remaining - self.estimate(WORKSPACE_HEADER, family)
+            workspace = self.truncate(workspace_context, available, family) if available > 0 else ""
+            if workspace:
+                system_prompt += WORKSPACE_HEADER + workspace
+                workspace_tokens = self.estimate(WORKSPACE_HEADER + workspace, family)
+
+        messages = [{"role": "system", "content": system_prompt}] + history + [{"role": "user", "content": prompt}]
+        return messages, {
+            "family": family,
+            "budget": budget,
+            "total": system_tokens + prompt_tokens + history_tokens + workspace_tokens,
+            "system": system_tokens,
+            "prompt": prompt_tokens,
+            "history": history_tokens,
+            "workspace": workspace_tokens,
+            "history_messages": len(history),
+            "history_dropped": len(recent) - len(history),
+            "system_truncated": system_truncated,
+            "prompt_truncated": prompt_truncated,
+            "workspace_truncated": workspace != workspace_context
+        }
+
+# Create a singleton instance
+context_builder = ContextBuilder(config.model_families, config.config["CONTEXT_HISTORY_MESSAGES"])
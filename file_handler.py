@@ -10,12 +10,14 @@ from typing import Dict, List, Optional, Any, Tuple
 from datetime import datetime
 from werkzeug.utils import secure_filename
 import config
+import storage
 
 class FileHandler:
     def __init__(self):
         self.uploads_dir = config.config["UPLOADS_DIR"]
         self.ensure_uploads_dir()
         self.metadata_file = os.path.join(self.uploads_dir, "metadata.json")
+        self.store = storage.create_file_store(self.metadata_file)
         self.metadata = self.load_metadata()
     
     def ensure_uploads_dir(self):
@@ -23,24 +25,25 @@ class FileHandler:
         os.makedirs(self.uploads_dir, exist_ok=True)
     
     def load_metadata(self) -> Dict[str, Any]:
-        """Load file metadata from JSON file."""
-        if not os.path.exists(self.metadata_file):
+        """Load file metadata from the storage backend."""
+        files = self.store.load()
+        if files is None:
             metadata = {"files": {}}
             self.save_metadata(metadata)
             return metadata
         
-        try:
-            with open(self.metadata_file, "r") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            metadata = {"files": {}}
-            self.save_metadata(metadata)
-            return metadata
+        return {"files": files}
+    
+    def refresh_metadata(self) -> None:
+        """Reload file metadata if another worker changed it."""
+        if self.store.changed():
+            files = self.store.load()
+            if files is not None:
+                self.metadata = {"files": files}
     
     def save_metadata(self, metadata: Dict[str, Any]) -> None:
-        """Save file metadata to JSON file."""
-        with open(self.metadata_file, "w") as f:
-            json.dump(metadata, f, indent=2)
+        """Save all file metadata to the storage backend."""
+        self.store.save_all(metadata["files"])
     
     def save_file(self, file_data: bytes, filename: str, file_type: str, 
                  username: str, description: str = "") -> Tuple[bool, str, Dict[str, Any]]:
@@ -75,12 +78,13 @@ class FileHandler:
         
         # Add to metadata
         self.metadata["files"][file_id] = file_metadata
-        self.save_metadata(self.metadata)
+        self.store.upsert(file_metadata)
         
         return True, file_id, file_metadata
     
     def get_file(self, file_id: str) -> Tuple[bool, str, Optional[bytes]]:
         """Get a file by ID."""
+        self.refresh_metadata()
         if file_id not in self.metadata["files"]:
             return False, "File not found", None
         
@@ -99,6 +103,7 @@ class FileHandler:
     
     def delete_file(self, file_id: str) -> Tuple[bool, str]:
         """Delete a file by ID."""
+        self.refresh_metadata()
         if file_id not in self.metadata["files"]:
             return False, "File not found"
         
@@ -111,7 +116,7 @@ class FileHandler:
             
             # Remove from metadata
             del self.metadata["files"][file_id]
-            self.save_metadata(self.metadata)
+            self.store.delete(file_id)
             
             return True, "File deleted"
         except Exception as e:
@@ -120,6 +125,7 @@ class FileHandler:
     def list_files(self, username: Optional[str] = None, 
                   file_type: Optional[str] = None) -> List[Dict[str, Any]]:
         """List files with optional filtering."""
+        self.refresh_metadata()
         files = list(self.metadata["files"].values())
         
         if username:
@@ -135,6 +141,7 @@ class FileHandler:
     
     def get_file_types(self) -> List[str]:
         """Get a list of all file types."""
+        self.refresh_metadata()
         return list(set(f["type"] for f in self.metadata["files"].values()))
 
 # Create a singleton instance
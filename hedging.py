@@ -0,0 +1,248 @@
+"""
+Hedging module for the Roblox Studio AI Plugin server.
+Races a second provider against a slow primary: once the primary has taken
+longer than a percentile of its observed latency, a hedge request is sent
+and whichever answers first wins. Per-role budgets cap the extra traffic.
+"""
+import math
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+from typing import Dict, Optional, Any, Awaitable, Callable, Tuple
+import config
+
+class LatencyTracker:
+    """Recent latencies of one provider and request kind."""
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+
+    def record(self, latency: float) -> None:
+        self.samples.append(latency)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Get the latency below which `percentile` percent of the recent samples fall."""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(math.ceil(percentile / 100 * len(ordered)) - 1, 0))
+        return ordered[index]
+
+class HedgeBudget:
+    """Lets a role send at most `ratio` hedge requests per primary request.
+
+    Every primary request deposits `ratio` tokens (up to `burst`), every
+    hedge spends one.
+    """
+
+    def __init__(self, ratio: float, burst: float = 10):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = 0.0
+
+    def deposit(self) -> None:
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class Hedger:
+    def __init__(self, enabled: bool = False, percentile: float = 95, min_delay: float = 0.5,
+                 min_samples: int = 20, default_budget: float = 0.05, max_workers: int = 32,
+                 max_primaries: int = 64):
+        self.enabled = enabled
+        self.percentile = percentile
+        # Never hedge sooner than this many seconds
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        # Hedges per primary request for roles without "hedge_budget"
+        self.default_budget = default_budget
+        # Hedges and primaries get separate pools, so a hedge never waits behind primaries
+        self.max_workers = max_workers
+        self.max_primaries = max_primaries
+        self.executors = {}
+        # A free primary worker per slot: a primary never queues, so the delay runs from its start
+        self._primary_slots = threading.BoundedSemaphore(max_primaries)
+        # (provider, kind) -> LatencyTracker; kind is "response" or "first_token"
+        self.latencies = {}
+        # role -> HedgeBudget
+        self.budgets = {}
+        self.stats = {
+            "requests": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "budget_denied": 0,
+            "primary_pool_full": 0
+        }
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, kind: str, latency: float) -> None:
+        """Record the latency of a successful call."""
+        with self._lock:
+            tracker = self.latencies.get((provider, kind))
+            if tracker is None:
+                tracker = self.latencies[(provider, kind)] = LatencyTracker()
+            tracker.record(latency)
+
+    def delay(self, provider: str, kind: str) -> Optional[float]:
+        """Get how long to wait for a provider before hedging, or None until enough latencies are known."""
+        with self._lock:
+            tracker = self.latencies.get((provider, kind))
+            if tracker is None or len(tracker.samples) < self.min_samples:
+                return None
+            return max(tracker.percentile(self.percentile), self.min_delay)
+
+    def _budget(self, role: str) -> HedgeBudget:
+        budget = self.budgets.get(role)
+        ratio = float(config.roles.get(role, {}).get("hedge_budget", self.default_budget))
+        if budget is None or budget.ratio != ratio:
+            budget = self.budgets[role] = HedgeBudget(ratio)
+        return budget
+
+    def _start(self, role: str) -> None:
+        """Count a hedgeable request, adding to its role's budget."""
+        with self._lock:
+            self.stats["requests"] += 1
+            self._budget(role).deposit()
+
+    def _allow_hedge(self, role: str) -> bool:
+        """Spend from a role's budget for a hedge, if it allows one."""
+        with self._lock:
+            allowed = self._budget(role).withdraw()
+            self.stats["hedged" if allowed else "budget_denied"] += 1
+        return allowed
+
+    def _count_win(self) -> None:
+        with self._lock:
+            self.stats["hedge_wins"] += 1
+
+    def _executor(self, kind: str) -> ThreadPoolExecutor:
+        with self._lock:
+            executor = self.executors.get(kind)
+            if executor is None:
+                workers = self.max_primaries if kind == "primary" else self.max_workers
+                executor = self.executors[kind] = ThreadPoolExecutor(max_workers=workers,
+                                                                     thread_name_prefix=f"hedge-{kind}")
+            return executor
+
+    def race(self, role: str, delay: float, primary: Callable[[], Any], hedge: Callable[[], Any],
+             discard: Optional[Callable[[Any], None]] = None) -> Tuple[Any, bool]:
+        """Run primary; if it is still running after `delay` seconds and the role's budget
+        allows, also run hedge. Returns the first successful result and whether it was
+        the hedge's. The losing call's result is passed to discard when it arrives.
+        """
+        self._start(role)
+        if not self._primary_slots.acquire(blocking=False):
+            # Every primary worker is busy: run unhedged rather than queue for one
+            with self._lock:
+                self.stats["primary_pool_full"] += 1
+            return primary(), False
+
+        def run_primary() -> Any:
+            try:
+                return primary()
+            finally:
+                self._primary_slots.release()
+
+        first = self._executor("primary").submit(run_primary)
+        try:
+            return first.result(timeout=delay), False
+        except FutureTimeoutError:
+            pass
+
+        if not self._allow_hedge(role):
+            return first.result(), False
+
+        second = self._executor("hedge").submit(hedge)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+
+                # Cancel the loser if it has not started, or discard its result
+                for other in pending:
+                    if not other.cancel() and discard is not None:
+                        other.add_done_callback(
+                            lambda f: discard(f.result()) if not f.cancelled() and f.exception() is None else None
+                        )
+                if future is second:
+                    self._count_win()
+                return future.result(), future is second
+        raise error
+
+    async def race_async(self, role: str, delay: float, primary: Callable[[], Awaitable[Any]],
+                         hedge: Callable[[], Awaitable[Any]],
+                         discard: Optional[Callable[[Any], None]] = None) -> Tuple[Any, bool]:
+        """Like race(), for coroutine functions; the losing call is cancelled.
+
+        discard only gets a losing result that arrived together with the winner.
+        """
+        self._start(role)
+        first = asyncio.ensure_future(primary())
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or not self._allow_hedge(role):
+                return await first, False
+
+            second = asyncio.ensure_future(hedge())
+            tasks.append(second)
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in tasks if task in done and task.exception() is None]
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                if not succeeded:
+                    continue
+
+                winner = succeeded[0]
+                if discard is not None:
+                    for task in succeeded[1:]:
+                        discard(task.result())
+                if winner is second:
+                    self._count_win()
+                return winner.result(), winner is second
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hedging counters, latency percentiles and role budgets."""
+        with self._lock:
+            return dict(
+                self.stats,
+                enabled=self.enabled,
+                latencies={
+                    f"{provider}:{kind}": {
+                        "samples": len(tracker.samples),
+                        "p50": tracker.percentile(50),
+                        f"p{self.percentile:g}": tracker.percentile(self.percentile)
+                    }
+                    for (provider, kind), tracker in self.latencies.items()
+                },
+                budgets={role: round(budget.tokens, 2) for role, budget in self.budgets.items()}
+            )
+
+# Create a singleton instance
+hedger = Hedger(
+    enabled=config.config["HEDGE_ENABLED"],
+    percentile=config.config["HEDGE_PERCENTILE"],
+    min_delay=config.config["HEDGE_MIN_DELAY_MS"] / 1000,
+    min_samples=config.config["HEDGE_MIN_SAMPLES"],
+    default_budget=config.config["HEDGE_BUDGET"],
+    max_workers=config.config["HEDGE_MAX_WORKERS"],
+    max_primaries=config.config["HEDGE_MAX_PRIMARIES"]
+)
@@ -0,0 +1,553 @@
+"""
+Chat history storage module for the Roblox Studio AI Plugin server.
+Stores each conversation as its own append-only JSONL segment.
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Iterator, Tuple
+from urllib.parse import quote, unquote
+from persistence import atomic_write, append_write
+from shared_state import file_lock, file_signature
+
+SEGMENT_SUFFIX = ".jsonl"
+ARCHIVE_SUFFIX = ".jsonl.gz"
+SUMMARY_FILE = "_index.json"
+# Summary changes since the last snapshot of the index
+SUMMARY_JOURNAL = "_index.jsonl"
+# The journal is folded into the snapshot once larger than this or the snapshot
+SUMMARY_JOURNAL_MIN_BYTES = 64 * 1024
+PREVIEW_LENGTH = 100
+
+def encode_name(name: str) -> str:
+    """Encode a username or conversation ID as a safe, reversible file name."""
+    return quote(name, safe="").replace(".", "%2E")
+
+def decode_name(name: str) -> str:
+    """Decode a file name produced by encode_name."""
+    return unquote(name)
+
+def new_summary() -> Dict[str, Any]:
+    """Create an empty conversation summary."""
+    return {
+        "message_count": 0,
+        "first_timestamp": None,
+        "last_timestamp": None,
+        "preview": ""
+    }
+
+def update_summary(summary: Dict[str, Any], messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Fold newly appended messages into a conversation summary."""
+    if not messages:
+        return summary
+
+    if summary["first_timestamp"] is None:
+        summary["first_timestamp"] = messages[0].get("timestamp")
+    summary["last_timestamp"] = messages[-1].get("timestamp")
+    summary["message_count"] += len(messages)
+
+    if not summary["preview"]:
+        # The preview is the first user message
+        for message in messages:
+            if message.get("role") == "user":
+                preview = message.get("content", "")
+                summary["preview"] = preview[:PREVIEW_LENGTH] + "..." if len(preview) > PREVIEW_LENGTH else preview
+                break
+
+    return summary
+
+def merge_summary(summary: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """Fold the summary of later messages (see update_summary) into a conversation summary."""
+    if not delta["message_count"]:
+        return summary
+
+    if summary["first_timestamp"] is None:
+        summary["first_timestamp"] = delta["first_timestamp"]
+    summary["last_timestamp"] = delta["last_timestamp"]
+    summary["message_count"] += delta["message_count"]
+    if not summary["preview"]:
+        summary["preview"] = delta["preview"]
+    return summary
+
+def apply_summary_changes(summaries: Dict[str, Dict[str, Any]], lines: List[str]) -> None:
+    """Apply journal lines to summaries: "append" merges a delta, "set" replaces and "delete" removes."""
+    for line in lines:
+        try:
+            change = json.loads(line)
+        except json.JSONDecodeError:
+            # A line cut short by a crash
+            continue
+        conversation_id = change["conversation_id"]
+        if change["op"] == "append":
+            merge_summary(summaries.setdefault(conversation_id, new_summary()), change["summary"])
+        elif change["op"] == "set":
+            summaries[conversation_id] = change["summary"]
+        else:
+            summaries.pop(conversation_id, None)
+
+def page_summaries(summaries: Dict[str, Dict[str, Any]], limit: Optional[int] = None,
+                   before: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Get non-empty conversation summaries, newest first, older than the `before` cursor."""
+    result = [
+        dict(summary, conversation_id=conversation_id)
+        for conversation_id, summary in summaries.items()
+        if summary["message_count"] and (not before or summary["last_timestamp"] < before)
+    ]
+    result.sort(key=lambda x: x["last_timestamp"], reverse=True)
+
+    if limit is not None and len(result) > limit:
+        result = result[:limit]
+        return result, result[-1]["last_timestamp"] if result else None
+    return result, None
+
+class HistoryStore:
+    def __init__(self, history_dir: str, cache_size: int = 256, archive_dir: Optional[str] = None,
+                 writer: Optional[Any] = None):
+        self.history_dir = history_dir
+        # Optional WriteBehindWriter; segment writes then happen off the request thread
+        self.writer = writer
+        self.archive_dir = archive_dir or os.path.join(history_dir, "archive")
+        self.cache_size = cache_size
+        # (username, conversation_id) -> [messages, segment size they were read at]
+        self._cache = OrderedDict()
+        # username -> {conversation_id: summary}, loaded lazily from each user's index file
+        self._summaries = {}
+        # username -> index snapshot and journal signatures as last loaded or written by this process
+        self._summary_signatures = {}
+        # Appends hold this lock shared; archiving holds it exclusively
+        self.lock_path = os.path.join(history_dir, "_history")
+        self._lock = threading.RLock()
+        self.ensure_data_dir()
+
+    def ensure_data_dir(self):
+        """Ensure the history directory exists."""
+        os.makedirs(self.history_dir, exist_ok=True)
+
+    def user_dir(self, username: str) -> str:
+        """Get the directory holding a user's conversations."""
+        return os.path.join(self.history_dir, encode_name(username))
+
+    def segment_path(self, username: str, conversation_id: str) -> str:
+        """Get the segment file for a conversation."""
+        return os.path.join(self.user_dir(username), encode_name(conversation_id) + SEGMENT_SUFFIX)
+
+    def archive_path(self, username: str, conversation_id: str) -> str:
+        """Get the compressed archive segment for a conversation."""
+        return os.path.join(self.archive_dir, encode_name(username), encode_name(conversation_id) + ARCHIVE_SUFFIX)
+
+    def _read_segment(self, path: str) -> List[Dict[str, Any]]:
+        """Read all messages from a live or archived segment file."""
+        messages = []
+        opener = gzip.open if path.endswith(ARCHIVE_SUFFIX) else open
+        with opener(path, "rt") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    messages.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return messages
+
+    def _segment_size(self, path: str) -> int:
+        """Size of a live segment, or -1 if it is missing (archived or never written)."""
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return -1
+
+    def _cache_put(self, key: Tuple[str, str], messages: List[Dict[str, Any]], size: int) -> None:
+        self._cache[key] = [messages, size]
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _wait_for_writes(self, path: str) -> None:
+        """Wait for queued writes to a segment to reach disk."""
+        if self.writer is not None:
+            self.writer.flush(path)
+
+    def _write(self, path: str, data: str, replace: bool = False) -> None:
+        """Append to (or replace) a segment, through the writer if one is set."""
+        def write_fn(payload: str) -> None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with file_lock(self.lock_path, shared=True), open(path, "w" if replace else "a") as f:
+                f.write(payload)
+
+        if self.writer is None:
+            write_fn(data)
+        elif replace:
+            self.writer.replace(path, data, write_fn)
+        else:
+            self.writer.append(path, data, write_fn)
+
+    def exists(self, username: str, conversation_id: str) -> bool:
+        """Check if a conversation exists."""
+        if (username, conversation_id) in self._cache:
+            return True
+        self._wait_for_writes(self.segment_path(username, conversation_id))
+        return (os.path.exists(self.segment_path(username, conversation_id)) or
+                os.path.exists(self.archive_path(username, conversation_id)))
+
+    def _restore(self, username: str, conversation_id: str) -> None:
+        """Move an archived conversation back to the live directory."""
+        archive_path = self.archive_path(username, conversation_id)
+        if not os.path.exists(archive_path):
+            return
+
+        os.makedirs(self.user_dir(username), exist_ok=True)
+        with file_lock(self.lock_path):
+            if not os.path.exists(archive_path):
+                # Another worker restored it first
+                return
+            with gzip.open(archive_path, "rb") as src, open(self.segment_path(username, conversation_id), "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(archive_path)
+
+    def append(self, username: str, conversation_id: str, message: Dict[str, Any]) -> None:
+        """Append a message to a conversation segment."""
+        self.append_many(username, conversation_id, [message])
+
+    def append_many(self, username: str, conversation_id: str, messages: List[Dict[str, Any]]) -> None:
+        """Append messages to a conversation segment with a single write."""
+        if not messages:
+            return
+
+        key = (username, conversation_id)
+        data = "".join(json.dumps(message) + "\n" for message in messages)
+
+        with self._lock:
+            path = self.segment_path(username, conversation_id)
+            if not os.path.exists(path) and not (self.writer and self.writer.has_pending(path)):
+                self._restore(username, conversation_id)
+                self._cache.pop(key, None)
+
+            summaries = self._load_summaries(username)
+            self._write(path, data)
+
+            if key in self._cache:
+                entry = self._cache[key]
+                entry[0].extend(messages)
+                # A size that no longer matches means another worker appended too
+                entry[1] = max(entry[1], 0) + len(data.encode("utf-8"))
+                self._cache.move_to_end(key)
+
+            update_summary(summaries.setdefault(conversation_id, new_summary()), messages)
+            self._save_summaries(username, {conversation_id: ("append", messages)})
+
+    def get(self, username: str, conversation_id: str) -> List[Dict[str, Any]]:
+        """Get the messages of a single conversation."""
+        key = (username, conversation_id)
+
+        with self._lock:
+            path = self.segment_path(username, conversation_id)
+            self._wait_for_writes(path)
+            size = self._segment_size(path)
+
+            # Cached messages are valid while the segment has the size they were read at
+            entry = self._cache.get(key)
+            if entry is not None and entry[1] == size:
+                self._cache.move_to_end(key)
+                # A copy: appends extend the cached list in place
+                return list(entry[0])
+
+            if size < 0:
+                # Archived conversations are only decompressed on demand
+                path = self.archive_path(username, conversation_id)
+                if not os.path.exists(path):
+                    return []
+
+            messages = self._read_segment(path)
+            self._cache_put(key, messages, size)
+            return list(messages)
+
+    def clear(self, username: str, conversation_id: str) -> bool:
+        """Truncate a conversation segment."""
+        key = (username, conversation_id)
+
+        with self._lock:
+            path = self.segment_path(username, conversation_id)
+            archive_path = self.archive_path(username, conversation_id)
+            self._wait_for_writes(path)
+            if not os.path.exists(path):
+                if not os.path.exists(archive_path):
+                    return False
+                os.remove(archive_path)
+
+            self._write(path, "", replace=True)
+            self._cache_put(key, [], 0)
+            self._load_summaries(username)[conversation_id] = new_summary()
+            self._save_summaries(username, {conversation_id: ("set", None)})
+            return True
+
+    def summary_path(self, username: str) -> str:
+        """Get the conversation index file of a user."""
+        return os.path.join(self.user_dir(username), SUMMARY_FILE)
+
+    def journal_path(self, username: str) -> str:
+        """Get the journal of conversation index changes of a user."""
+        return os.path.join(self.user_dir(username), SUMMARY_JOURNAL)
+
+    def _index_signature(self, username: str) -> Tuple[Any, Any]:
+        return file_signature(self.summary_path(username)), file_signature(self.journal_path(username))
+
+    def _read_index(self, username: str) -> Tuple[Optional[Dict[str, Dict[str, Any]]], int]:
+        """Read a user's index snapshot and replay its journal (the caller holds the index lock).
+
+        Returns the summaries, or None if the index must be rebuilt, and the
+        snapshot's generation. A journal from an older generation was folded
+        into the snapshot already (compaction stopped before resetting it).
+        """
+        generation = 0
+        summaries = None
+        try:
+            with open(self.summary_path(username), "r") as f:
+                stored = json.load(f)
+            if isinstance(stored.get("generation"), int):
+                generation, summaries = stored["generation"], stored["summaries"]
+            else:
+                # Written before the journal existed
+                summaries = stored
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError:
+            return None, generation
+
+        try:
+            with open(self.journal_path(username), "r") as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return summaries, generation
+
+        # Compaction starts the journal with a {"generation"} header
+        journal_generation = 0
+        if lines and lines[0].startswith('{"generation": '):
+            journal_generation = json.loads(lines.pop(0))["generation"]
+        if journal_generation >= generation:
+            summaries = summaries if summaries is not None else {}
+            apply_summary_changes(summaries, lines)
+        return summaries, generation
+
+    def _load_summaries(self, username: str) -> Dict[str, Dict[str, Any]]:
+        """Load a user's conversation index, building it from the segments if missing.
+
+        The cached index is reloaded when another worker changed its files,
+        unless this process still has changes waiting to be journaled.
+        """
+        journal_path = self.journal_path(username)
+        if username in self._summaries:
+            pending = self.writer is not None and self.writer.has_pending(journal_path)
+            if pending or self._index_signature(username) == self._summary_signatures.get(username):
+                return self._summaries[username]
+
+        self._wait_for_writes(journal_path)
+        with file_lock(self.summary_path(username), shared=True):
+            signature = self._index_signature(username)
+            summaries, _ = self._read_index(username)
+
+        rebuilt = summaries is None
+        if rebuilt:
+            summaries = {
+                conversation_id: update_summary(new_summary(), self.get(username, conversation_id))
+                for conversation_id in self.list_conversation_ids(username)
+            }
+
+        self._summaries[username] = summaries
+        self._summary_signatures[username] = signature
+        if rebuilt and summaries:
+            self._save_summaries(username, {conversation_id: ("set", None) for conversation_id in summaries})
+        return summaries
+
+    def _save_summaries(self, username: str, changes: Dict[str, Tuple[str, Optional[List[Dict[str, Any]]]]]) -> None:
+        """Journal summary changes: ("append", messages), ("set", None) for the cached summary, or ("delete", None).
+
+        Appends are journaled as the summary of the new messages, so workers
+        writing to the same conversation do not lose counts.
+        """
+        summaries = self._summaries.get(username, {})
+        lines = []
+        for conversation_id, (op, messages) in changes.items():
+            if op == "append":
+                change = {"summary": update_summary(new_summary(), messages)}
+            elif op == "set" and conversation_id in summaries:
+                change = {"summary": dict(summaries[conversation_id])}
+            else:
+                op, change = "delete", {}
+            lines.append(json.dumps(dict(change, conversation_id=conversation_id, op=op)) + "\n")
+
+        def write_fn(payload: str) -> None:
+            self._append_journal(username, payload)
+
+        if self.writer is not None:
+            self.writer.append(self.journal_path(username), "".join(lines), write_fn)
+        else:
+            write_fn("".join(lines))
+
+    def _append_journal(self, username: str, data: str) -> None:
+        """Append changes to a user's index journal, folding it into the snapshot once it has grown."""
+        fsync = self.writer.fsync if self.writer is not None else False
+        path = self.summary_path(username)
+        journal_path = self.journal_path(username)
+        with file_lock(path):
+            signature = self._index_signature(username)
+            append_write(journal_path, data, fsync=fsync)
+            current = signature == self._summary_signatures.get(username)
+
+            snapshot_size = signature[0][1] if signature[0] is not None else 0
+            if os.path.getsize(journal_path) > max(SUMMARY_JOURNAL_MIN_BYTES, snapshot_size):
+                summaries, generation = self._read_index(username)
+                if summaries is not None:
+                    # The snapshot goes first; until the journal is reset, its older generation is skipped
+                    snapshot = {"generation": generation + 1, "summaries": summaries}
+                    atomic_write(path, json.dumps(snapshot), fsync=fsync)
+                    atomic_write(journal_path, json.dumps({"generation": generation + 1}) + "\n", fsync=fsync)
+
+            if current:
+                # Other workers' changes stay visible to _load_summaries until the next reload
+                self._summary_signatures[username] = self._index_signature(username)
+
+    def list_summaries(self, username: str, limit: Optional[int] = None,
+                       before: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Get a page of a user's conversation summaries (newest first) and the next cursor."""
+        with self._lock:
+            return page_summaries(self._load_summaries(username), limit, before)
+
+    def list_conversation_ids(self, username: str) -> List[str]:
+        """List the conversation IDs of a user, including archived ones."""
+        conversation_ids = set()
+        for directory, suffix in ((self.user_dir(username), SEGMENT_SUFFIX),
+                                  (os.path.join(self.archive_dir, encode_name(username)), ARCHIVE_SUFFIX)):
+            if not os.path.isdir(directory):
+                continue
+            conversation_ids.update(
+                decode_name(name[:-len(suffix)])
+                for name in os.listdir(directory)
+                if name.endswith(suffix)
+            )
+        return list(conversation_ids)
+
+    def list_conversations(self, username: str) -> Dict[str, List[Dict[str, Any]]]:
+        """Get all conversations of a user."""
+        return {
+            conversation_id: self.get(username, conversation_id)
+            for conversation_id in self.list_conversation_ids(username)
+        }
+
+    def list_usernames(self) -> List[str]:
+        """List all users with stored history."""
+        usernames = set()
+        for directory in (self.history_dir, self.archive_dir):
+            if not os.path.isdir(directory):
+                continue
+            usernames.update(
+                decode_name(name) for name in os.listdir(directory)
+                if os.path.isdir(os.path.join(directory, name)) and
+                os.path.abspath(os.path.join(directory, name)) != os.path.abspath(self.archive_dir)
+            )
+        return list(usernames)
+
+    def iter_conversations(self) -> Iterator[Tuple[str, str, List[Dict[str, Any]]]]:
+        """Iterate over every stored conversation."""
+        for username in self.list_usernames():
+            for conversation_id in self.list_conversation_ids(username):
+                yield username, conversation_id, self.get(username, conversation_id)
+
+    def archive_idle(self, max_age_days: int) -> int:
+        """Compress conversations that have not been written to for max_age_days."""
+        if max_age_days <= 0 or not os.path.isdir(self.history_dir):
+            return 0
+
+        cutoff = time.time() - max_age_days * 86400
+        archived = 0
+        with self._lock, file_lock(self.lock_path):
+            for user_name in os.listdir(self.history_dir):
+                user_dir = os.path.join(self.history_dir, user_name)
+                if not os.path.isdir(user_dir) or os.path.abspath(user_dir) == os.path.abspath(self.archive_dir):
+                    continue
+
+                for name in os.listdir(user_dir):
+                    path = os.path.join(user_dir, name)
+                    if not name.endswith(SEGMENT_SUFFIX) or os.path.getmtime(path) >= cutoff:
+                        continue
+                    if self.writer is not None and self.writer.has_pending(path):
+                        continue
+
+                    archive_user_dir = os.path.join(self.archive_dir, user_name)
+                    os.makedirs(archive_user_dir, exist_ok=True)
+                    archive_path = os.path.join(archive_user_dir, name[:-len(SEGMENT_SUFFIX)] + ARCHIVE_SUFFIX)
+                    with open(path, "rb") as src, gzip.open(archive_path, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                    # Keep the last-write time so retention is measured from the last message
+                    mtime = os.path.getmtime(path)
+                    os.utime(archive_path, (mtime, mtime))
+                    os.remove(path)
+
+                    key = (decode_name(user_name), decode_name(name[:-len(SEGMENT_SUFFIX)]))
+                    self._cache.pop(key, None)
+                    archived += 1
+        return archived
+
+    def apply_retention(self, retention_days: int) -> int:
+        """Delete archived conversations whose last message is older than the retention period."""
+        if retention_days <= 0 or not os.path.isdir(self.archive_dir):
+            return 0
+
+        cutoff = time.time() - retention_days * 86400
+        removed = 0
+        with self._lock:
+            for user_name in os.listdir(self.archive_dir):
+                user_dir = os.path.join(self.archive_dir, user_name)
+                if not os.path.isdir(user_dir):
+                    continue
+
+                for name in os.listdir(user_dir):
+                    path = os.path.join(user_dir, name)
+                    if name.endswith(ARCHIVE_SUFFIX) and os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        username, conversation_id = decode_name(user_name), decode_name(name[:-len(ARCHIVE_SUFFIX)])
+                        self._cache.pop((username, conversation_id), None)
+                        self._load_summaries(username).pop(conversation_id, None)
+                        self._save_summaries(username, {conversation_id: ("delete", None)})
+                        removed += 1
+        return removed
+
+def migrate_json_history(json_path: str, history_dir: str) -> Tuple[bool, str]:
+    """Split a legacy {"conversations": {...}} file into per-conversation segments."""
+    if not os.path.exists(json_path):
+        return False, f"Legacy history file '{json_path}' not found"
+
+    try:
+        with open(json_path, "r") as f:
+            legacy = json.load(f)
+    except json.JSONDecodeError as e:
+        return False, f"Legacy history file is not valid JSON: {str(e)}"
+
+    conversations = legacy.get("conversations", {}) if isinstance(legacy, dict) else {}
+    if not isinstance(conversations, dict):
+        conversations = {}
+
+    store = HistoryStore(history_dir, cache_size=0)
+    count = 0
+    for username, user_conversations in conversations.items():
+        for conversation_id, messages in user_conversations.items():
+            if not messages or store.exists(username, conversation_id):
+                continue
+            store.append_many(username, conversation_id, messages)
+            count += 1
+
+    return True, f"Migrated {count} conversations to '{history_dir}'"
+
+if __name__ == "__main__":
+    # Usage: python history_store.py [legacy_json_path] [history_dir]
+    import config
+    source = sys.argv[1] if len(sys.argv) > 1 else config.config["LEGACY_HISTORY_FILE"]
+    target = sys.argv[2] if len(sys.argv) > 2 else config.config["HISTORY_DIR"]
+    success, message = migrate_json_history(source, target)
+    print(message)
+    sys.exit(0 if success else 1)
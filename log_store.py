@@ -0,0 +1,308 @@
+"""
+Log storage module for the Roblox Studio AI Plugin server.
+Stores request logs as an append-only, line-delimited JSON (JSONL) file.
+"""
+import os
+import sys
+import json
+import time
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Any, Iterator, Tuple
+from shared_state import file_lock
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+class JsonlLogStore:
+    def __init__(self, path: str, fsync_policy: str = "interval", fsync_interval: float = 1.0,
+                 writer: Optional[Any] = None):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy: {fsync_policy}")
+
+        self.path = path
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        # Optional WriteBehindWriter; appends then happen off the request thread
+        self.writer = writer
+        self._fd = None
+        self._last_fsync = 0.0
+        self._lock = threading.Lock()
+        self.ensure_data_dir()
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+
+    def ensure_data_dir(self):
+        """Ensure the data directory exists."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+    def exists(self) -> bool:
+        """Check if the log file exists."""
+        return os.path.exists(self.path)
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """Iterate over the stored records, oldest first."""
+        self.wait_for_writes()
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn write (e.g. crash mid-append) only affects its own line
+                    continue
+
+    def load(self) -> List[Dict[str, Any]]:
+        """Load all records from the log file."""
+        return list(self.iter_records())
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Append a single record to the log file."""
+        self.append_many([record])
+
+    def append_many(self, records: List[Dict[str, Any]]) -> None:
+        """Append records to the log file with a single write."""
+        if not records:
+            return
+
+        data = "".join(json.dumps(record) + "\n" for record in records)
+        self.size += len(data.encode("utf-8"))
+
+        if self.writer is not None:
+            self.writer.append(self.path, data, self._write)
+        else:
+            self._write(data)
+
+    def _write(self, data: str) -> None:
+        """Append already serialized lines to the log file."""
+        # Shared with other writers; rotation takes the lock exclusively
+        with self._lock, file_lock(self.path, shared=True):
+            if self._fd is not None and not self._is_current():
+                # Another worker rotated the file; follow it to the new one
+                self._close_fd()
+            if self._fd is None:
+                self.ensure_data_dir()
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+            # O_APPEND keeps concurrent appends from separate processes line-atomic
+            os.write(self._fd, data.encode("utf-8"))
+            self._maybe_fsync()
+            # Includes appends from other workers, so they all rotate at the same size
+            self.size = os.fstat(self._fd).st_size
+
+    def _is_current(self) -> bool:
+        """Check if the open descriptor still refers to the file at self.path."""
+        try:
+            return os.fstat(self._fd).st_ino == os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return False
+
+    def wait_for_writes(self) -> None:
+        """Wait for queued appends to reach the log file."""
+        if self.writer is not None:
+            self.writer.flush(self.path)
+
+    def _maybe_fsync(self) -> None:
+        """Fsync the log file according to the configured policy."""
+        if self.fsync_policy == "never":
+            return
+
+        now = time.monotonic()
+        if self.fsync_policy == "always" or now - self._last_fsync >= self.fsync_interval:
+            os.fsync(self._fd)
+            self._last_fsync = now
+
+    def rewrite(self, records: List[Dict[str, Any]]) -> None:
+        """Atomically replace the log file with the given records."""
+        self.wait_for_writes()
+        with self._lock, file_lock(self.path):
+            self._close_fd()
+            self.ensure_data_dir()
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            self.size = os.path.getsize(self.path)
+
+    def rotate(self) -> Optional[str]:
+        """Move the live file aside so appends start a fresh one; returns the rotated path."""
+        self.wait_for_writes()
+        with self._lock, file_lock(self.path):
+            if not os.path.exists(self.path):
+                return None
+            if self._fd is not None and not self._is_current():
+                # Another worker rotated it already
+                self._close_fd()
+                self.size = os.path.getsize(self.path)
+                return None
+
+            self._close_fd()
+            rotated_path = f"{self.path}.{int(time.time() * 1000)}.rotating"
+            os.replace(self.path, rotated_path)
+            self.size = 0
+            return rotated_path
+
+    def pending_rotations(self) -> List[str]:
+        """Rotated files left behind by an interrupted rotation."""
+        directory = os.path.dirname(self.path) or "."
+        prefix = os.path.basename(self.path) + "."
+        return sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.startswith(prefix) and name.endswith(".rotating")
+        )
+
+    def flush(self) -> None:
+        """Force pending appends to disk."""
+        self.wait_for_writes()
+        with self._lock:
+            if self._fd is not None:
+                os.fsync(self._fd)
+                self._last_fsync = time.monotonic()
+
+    def close(self) -> None:
+        """Close the underlying file descriptor."""
+        with self._lock:
+            self._close_fd()
+
+    def _close_fd(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+class LogIndex:
+    def __init__(self):
+        # Primary index: all records ordered by timestamp
+        self.timestamps = []
+        self.records = []
+        # Secondary index: username -> (timestamps, records), also time ordered
+        self.by_username = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @staticmethod
+    def _insert(timestamps: List[str], records: List[Dict[str, Any]], record: Dict[str, Any]) -> None:
+        timestamp = record.get("timestamp", "")
+        if not timestamps or timestamp >= timestamps[-1]:
+            # Entries almost always arrive in time order
+            timestamps.append(timestamp)
+            records.append(record)
+            return
+
+        position = bisect_right(timestamps, timestamp)
+        timestamps.insert(position, timestamp)
+        records.insert(position, record)
+
+    def add(self, record: Dict[str, Any]) -> None:
+        """Add a record to the primary and secondary indexes."""
+        with self._lock:
+            self._insert(self.timestamps, self.records, record)
+            username = record.get("username", "")
+            if username not in self.by_username:
+                self.by_username[username] = ([], [])
+            self._insert(*self.by_username[username], record)
+
+    def rebuild(self, records: List[Dict[str, Any]]) -> None:
+        """Rebuild the indexes from the given records."""
+        with self._lock:
+            self.timestamps = []
+            self.records = []
+            self.by_username = {}
+        for record in sorted(records, key=lambda x: x.get("timestamp", "")):
+            self.add(record)
+
+    def _bounds(self, timestamps: List[str], before: Optional[str], after: Optional[str],
+                start: Optional[str], end: Optional[str]) -> Tuple[int, int]:
+        """Get the [lo, hi) slice matching the cursors and time range."""
+        hi = len(timestamps)
+        if before:
+            hi = bisect_left(timestamps, before)
+        if end:
+            hi = min(hi, bisect_right(timestamps, end))
+
+        lo = 0
+        if after:
+            lo = bisect_right(timestamps, after)
+        if start:
+            lo = max(lo, bisect_left(timestamps, start))
+
+        return lo, max(lo, hi)
+
+    def iter_range(self, username: Optional[str] = None, after: Optional[str] = None,
+                   start: Optional[str] = None, end: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Iterate over the records matching the filters, oldest first."""
+        with self._lock:
+            if username is None:
+                timestamps, records = self.timestamps, self.records
+            elif username in self.by_username:
+                timestamps, records = self.by_username[username]
+            else:
+                return iter(())
+
+            lo, hi = self._bounds(timestamps, None, after, start, end)
+            return iter(records[lo:hi])
+
+    def query(self, username: Optional[str] = None, limit: int = 100, offset: int = 0,
+              before: Optional[str] = None, after: Optional[str] = None,
+              start: Optional[str] = None, end: Optional[str] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """Get a page of records (newest first) and the number of matching records.
+
+        `before`/`after` are exclusive timestamp cursors, `start`/`end` an
+        inclusive time range. With only `after` set, the page holds the
+        records immediately newer than the cursor.
+        """
+        with self._lock:
+            if username is None:
+                timestamps, records = self.timestamps, self.records
+            elif username in self.by_username:
+                timestamps, records = self.by_username[username]
+            else:
+                return [], 0
+
+            lo, hi = self._bounds(timestamps, before, after, start, end)
+            offset = max(offset, 0)
+            limit = max(limit, 0)
+
+            if after and not before:
+                page = records[lo + offset:min(hi, lo + offset + limit)]
+            else:
+                page = records[max(lo, hi - offset - limit):max(lo, hi - offset)]
+
+            return page[::-1], hi - lo
+
+def migrate_json_logs(json_path: str, jsonl_path: str) -> Tuple[bool, str]:
+    """Convert a legacy {"logs": [...]} file into a JSONL log file."""
+    if not os.path.exists(json_path):
+        return False, f"Legacy log file '{json_path}' not found"
+
+    if os.path.exists(jsonl_path):
+        return False, f"Log file '{jsonl_path}' already exists"
+
+    try:
+        with open(json_path, "r") as f:
+            legacy = json.load(f)
+    except json.JSONDecodeError as e:
+        return False, f"Legacy log file is not valid JSON: {str(e)}"
+
+    records = legacy.get("logs", []) if isinstance(legacy, dict) else []
+    records = [record for record in records if isinstance(record, dict)]
+    records.sort(key=lambda x: x.get("timestamp", ""))
+
+    JsonlLogStore(jsonl_path).rewrite(records)
+    return True, f"Migrated {len(records)} log entries to '{jsonl_path}'"
+
+if __name__ == "__main__":
+    # Usage: python log_store.py [legacy_json_path] [jsonl_path]
+    import config
+    source = sys.argv[1] if len(sys.argv) > 1 else config.config["LEGACY_LOGS_FILE"]
+    target = sys.argv[2] if len(sys.argv) > 2 else config.config["LOGS_FILE"]
+    success, message = migrate_json_logs(source, target)
+    print(message)
+    sys.exit(0 if success else 1)
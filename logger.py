@@ -3,68 +3,75 @@ Logging module for the Roblox Studio AI Plugin server.
 Handles request logging, chat history, and usage statistics.
 """
 import os
-import json
 import time
-from typing import Dict, List, Optional, Any
+import atexit
+from typing import Dict, List, Optional, Any, Iterator
 from datetime import datetime
 import config
+import storage
+from usage_stats import UsageRollup
+from search_index import SearchIndex
+from persistence import writer, BackgroundTask
 
 class LogManager:
     def __init__(self):
         self.logs_file = config.config["LOGS_FILE"]
-        self.history_file = config.config["HISTORY_FILE"]
-        self.logs = {"logs": []}
-        self.history = {"conversations": {}}
+        self.history_dir = config.config["HISTORY_DIR"]
+        self.log_store = storage.create_log_store()
+        self.usage = UsageRollup(
+            config.config["USAGE_STATS_FILE"],
+            save_interval=config.config["USAGE_STATS_SAVE_INTERVAL"],
+            writer=writer
+        )
+        self.history_store = None
+        self.search_index = None
+        self._last_maintenance = 0.0
+        self._maintenance = BackgroundTask(self.run_maintenance, "log-maintenance")
         self.ensure_data_dir()
         self.load_logs()
+        self.load_usage_stats()
         self.load_history()
+        self.load_search_index()
+        self.run_maintenance()
+        atexit.register(self.usage.save)
     
     def ensure_data_dir(self):
         """Ensure the data directory exists."""
         os.makedirs(os.path.dirname(self.logs_file), exist_ok=True)
-        os.makedirs(os.path.dirname(self.history_file), exist_ok=True)
+        os.makedirs(os.path.dirname(self.history_dir), exist_ok=True)
     
-    def load_logs(self) -> Dict[str, List[Dict[str, Any]]]:
-        """Load logs from the JSON file."""
-        if not os.path.exists(self.logs_file):
-            self.save_logs(self.logs)
-            return self.logs
-        
-        try:
-            with open(self.logs_file, "r") as f:
-                self.logs = json.load(f)
-                return self.logs
-        except (json.JSONDecodeError, FileNotFoundError):
-            self.logs = {"logs": []}
-            self.save_logs(self.logs)
-            return self.logs
-    
-    def save_logs(self, logs: Dict[str, List[Dict[str, Any]]]) -> None:
-        """Save logs to the JSON file."""
-        self.ensure_data_dir()
-        with open(self.logs_file, "w") as f:
-            json.dump(logs, f, indent=2)
-    
-    def load_history(self) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
-        """Load chat history from the JSON file."""
-        if not os.path.exists(self.history_file):
-            self.save_history(self.history)
-            return self.history
+    def load_logs(self) -> List[Dict[str, Any]]:
+        """Load the live logs from the storage backend."""
+        return self.log_store.load()
+    
+    def load_usage_stats(self) -> None:
+        """Load the usage rollups, catching up or rebuilding them from the logs."""
+        self.usage.catch_up(self.log_store)
+    
+    def load_history(self):
+        """Open the chat history store from the storage backend."""
+        self.history_store = storage.create_history_store()
+        return self.history_store
+    
+    def load_search_index(self):
+        """Load the full-text search index, building it from the logs and history if missing."""
+        if not config.config["SEARCH_ENABLED"]:
+            return None
+        
+        self.search_index = SearchIndex(config.config["SEARCH_INDEX_FILE"], writer=writer)
+        if self.search_index.exists():
+            self.search_index.load()
+        else:
+            self.search_index.rebuild(self.log_store.iter_records(), self.history_store.iter_conversations())
+        return self.search_index
+    
+    def run_maintenance(self) -> None:
+        """Rotate, compact and expire logs and history according to the retention settings."""
+        self._last_maintenance = time.monotonic()
         
-        try:
-            with open(self.history_file, "r") as f:
-                self.history = json.load(f)
-                return self.history
-        except (json.JSONDecodeError, FileNotFoundError):
-            self.history = {"conversations": {}}
-            self.save_history(self.history)
-            return self.history
-    
-    def save_history(self, history: Dict[str, Dict[str, List[Dict[str, Any]]]]) -> None:
-        """Save chat history to the JSON file."""
-        self.ensure_data_dir()
-        with open(self.history_file, "w") as f:
-            json.dump(history, f, indent=2)
+        self.log_store.run_maintenance()
+        self.history_store.archive_idle(config.config["HISTORY_ARCHIVE_AFTER_DAYS"])
+        self.history_store.apply_retention(config.config["HISTORY_RETENTION_DAYS"])
     
     def log_request(self, username: str, model: str, prompt: str, response: str, 
                    context_used: bool = False, files_used: List[str] = None) -> None:
@@ -82,107 +89,127 @@ class LogManager:
             "files_used": files_used
         }
         
-        self.logs["logs"].append(log_entry)
-        self.save_logs(self.logs)
+        self.log_store.append(log_entry)
+        self.usage.record(log_entry)
+        self.usage.maybe_save()
+        if self.search_index is not None:
+            self.search_index.add_log(log_entry)
+        if time.monotonic() - self._last_maintenance >= config.config["ARCHIVE_CHECK_INTERVAL"]:
+            # Rotation, compaction and retention run off the request thread
+            self._maintenance.trigger()
     
     def add_to_history(self, username: str, conversation_id: str, 
                       role: str, content: str) -> None:
         """Add a message to the chat history."""
-        if username not in self.history["conversations"]:
-            self.history["conversations"][username] = {}
-        
-        if conversation_id not in self.history["conversations"][username]:
-            self.history["conversations"][username][conversation_id] = []
-        
         message = {
             "timestamp": datetime.now().isoformat(),
             "role": role,
             "content": content
         }
         
-        self.history["conversations"][username][conversation_id].append(message)
-        self.save_history(self.history)
+        self.history_store.append(username, conversation_id, message)
+        if self.search_index is not None:
+            self.search_index.add_message(username, conversation_id, message)
     
     def get_conversation(self, username: str, conversation_id: str) -> List[Dict[str, Any]]:
         """Get a specific conversation."""
-        if username not in self.history["conversations"]:
-            return []
-        
-        if conversation_id not in self.history["conversations"][username]:
-            return []
-        
-        return self.history["conversations"][username][conversation_id]
+        return self.history_store.get(username, conversation_id)
     
     def get_user_conversations(self, username: str) -> Dict[str, List[Dict[str, Any]]]:
         """Get all conversations for a user."""
-        if username not in self.history["conversations"]:
-            return {}
-        
-        return self.history["conversations"][username]
+        return self.history_store.list_conversations(username)
+    
+    def get_conversation_summaries(self, username: str, limit: Optional[int] = None,
+                                   before: Optional[str] = None) -> Dict[str, Any]:
+        """Get a page of a user's conversation summaries (newest first) without reading messages."""
+        conversations, next_cursor = self.history_store.list_summaries(username, limit, before)
+        return {
+            "conversations": conversations,
+            "next_cursor": next_cursor
+        }
     
     def clear_conversation(self, username: str, conversation_id: str) -> bool:
         """Clear a specific conversation."""
-        if username not in self.history["conversations"]:
-            return False
-        
-        if conversation_id not in self.history["conversations"][username]:
-            return False
+        cleared = self.history_store.clear(username, conversation_id)
+        if cleared and self.search_index is not None:
+            self.search_index.remove_conversation(username, conversation_id)
+        return cleared
+    
+    def search(self, query: str, scope: str = "history", username: Optional[str] = None,
+               conversation_id: Optional[str] = None, limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+        """Search history messages ("history"), request logs ("logs") or both ("all")."""
+        if self.search_index is None:
+            return {"results": [], "total": 0}
+        
+        kinds = {"history": "message", "logs": "log", "all": None}
+        results, total = self.search_index.search(
+            query,
+            kind=kinds.get(scope, "message"),
+            username=username,
+            conversation_id=conversation_id,
+            limit=limit,
+            offset=offset
+        )
         
-        self.history["conversations"][username][conversation_id] = []
-        self.save_history(self.history)
-        return True
+        return {
+            "results": results,
+            "total": total
+        }
     
     def get_logs(self, username: Optional[str] = None, 
-                limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
-        """Get logs with optional filtering."""
-        logs = self.logs["logs"]
-        
-        if username:
-            logs = [log for log in logs if log["username"] == username]
-        
-        # Sort by timestamp (newest first)
-        logs.sort(key=lambda x: x["timestamp"], reverse=True)
-        
-        # Apply pagination
-        return logs[offset:offset + limit]
+                limit: int = 100, offset: int = 0,
+                before: Optional[str] = None, after: Optional[str] = None,
+                start: Optional[str] = None, end: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get logs (newest first) with optional filtering."""
+        return self.query_logs(username, limit, offset, before, after, start, end)["logs"]
     
-    def get_usage_stats(self) -> Dict[str, Any]:
-        """Get usage statistics."""
-        logs = self.logs["logs"]
-        
-        # Get total request count
-        total_requests = len(logs)
-        
-        # Get requests per model
-        model_counts = {}
-        for log in logs:
-            model = log["model"]
-            if model not in model_counts:
-                model_counts[model] = 0
-            model_counts[model] += 1
-        
-        # Get requests per user
-        user_counts = {}
-        for log in logs:
-            username = log["username"]
-            if username not in user_counts:
-                user_counts[username] = 0
-            user_counts[username] += 1
-        
-        # Get requests per day
-        day_counts = {}
-        for log in logs:
-            day = datetime.fromisoformat(log["timestamp"]).strftime("%Y-%m-%d")
-            if day not in day_counts:
-                day_counts[day] = 0
-            day_counts[day] += 1
+    def query_logs(self, username: Optional[str] = None, 
+                  limit: int = 100, offset: int = 0,
+                  before: Optional[str] = None, after: Optional[str] = None,
+                  start: Optional[str] = None, end: Optional[str] = None) -> Dict[str, Any]:
+        """Get a page of logs with the match count and paging cursors."""
+        logs, total = self.log_store.query(
+            username=username,
+            limit=limit,
+            offset=offset,
+            before=before,
+            after=after,
+            start=start,
+            end=end
+        )
         
         return {
-            "total_requests": total_requests,
-            "model_counts": model_counts,
-            "user_counts": user_counts,
-            "day_counts": day_counts
+            "logs": logs,
+            "total": total,
+            # Pass as `before` for older logs, or as `after` for newer ones
+            "next_cursor": logs[-1]["timestamp"] if logs else None,
+            "prev_cursor": logs[0]["timestamp"] if logs else None
         }
+    
+    def export_logs(self, username: Optional[str] = None, after: Optional[str] = None,
+                    start: Optional[str] = None, end: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Stream logs oldest first; resume by passing the last exported timestamp as `after`."""
+        return self.log_store.iter_range(username=username, after=after, start=start, end=end)
+    
+    def export_history(self, username: str, after: Optional[str] = None,
+                       start: Optional[str] = None, end: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Stream a user's history one conversation at a time, in conversation ID order.
+        
+        Resume by passing the last fully exported conversation ID as `after`.
+        """
+        for conversation_id in sorted(self.history_store.list_conversation_ids(username)):
+            if after and conversation_id <= after:
+                continue
+            
+            for message in self.history_store.get(username, conversation_id):
+                timestamp = message.get("timestamp", "")
+                if (start and timestamp < start) or (end and timestamp > end):
+                    continue
+                yield dict(message, conversation_id=conversation_id)
+    
+    def get_usage_stats(self) -> Dict[str, Any]:
+        """Get usage statistics."""
+        return self.usage.get_stats()
 
 # Create a singleton instance
 log_manager = LogManager()
@@ -0,0 +1,251 @@
+"""
+Persistence module for the Roblox Studio AI Plugin server.
+Queues file writes and flushes them from a background thread in batches
+(group commit) so request handlers never wait on disk.
+"""
+import os
+import sys
+import time
+import queue
+import atexit
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Callable, Tuple
+import config
+
+PERSISTENCE_MODES = ("sync", "group", "async")
+
+def atomic_write(path: str, data: str, fsync: bool = True) -> None:
+    """Replace a file's contents atomically."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def append_write(path: str, data: str, fsync: bool = True) -> None:
+    """Append to a file, creating it if needed."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+class WriteBehindWriter:
+    """Write-behind queue for file writes.
+
+    Modes:
+        sync  - write in the calling thread and fsync (no queue)
+        group - queue writes; the background thread fsyncs each batch
+        async - queue writes without fsync, leaving flushing to the OS
+    """
+
+    def __init__(self, mode: str = "group", flush_interval: float = 0.05,
+                 max_batch: int = 512, max_queue: int = 10000):
+        if mode not in PERSISTENCE_MODES:
+            raise ValueError(f"Invalid persistence mode: {mode}")
+
+        self.mode = mode
+        self.fsync = mode != "async"
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self.metrics = {
+            "queued": 0,
+            "written": 0,
+            "batches": 0,
+            "coalesced": 0,
+            "errors": 0,
+            "backpressure_waits": 0
+        }
+
+        if mode != "sync":
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def append(self, key: str, data: str, write_fn: Callable[[str], None]) -> None:
+        """Queue data to be appended via write_fn(data); appends to the same key are concatenated."""
+        self._submit("append", key, data, write_fn)
+
+    def replace(self, key: str, data: str, write_fn: Callable[[str], None]) -> None:
+        """Queue a full replacement via write_fn(data); only the latest replacement of a key is written."""
+        self._submit("replace", key, data, write_fn)
+
+    def write_file(self, path: str, data: str) -> None:
+        """Queue an atomic replacement of a file."""
+        self.replace(path, data, lambda d: atomic_write(path, d, self.fsync))
+
+    def append_file(self, path: str, data: str) -> None:
+        """Queue an append to a file."""
+        self.append(path, data, lambda d: append_write(path, d, self.fsync))
+
+    def _submit(self, kind: str, key: str, data: str, write_fn: Callable[[str], None]) -> None:
+        if self._thread is None or self._stopped:
+            write_fn(data)
+            return
+
+        with self._cond:
+            self._pending[key] = self._pending.get(key, 0) + 1
+            self.metrics["queued"] += 1
+
+        op = (kind, key, data, write_fn)
+        try:
+            self._queue.put_nowait(op)
+        except queue.Full:
+            # Backpressure: block the caller until the writer catches up
+            with self._cond:
+                self.metrics["backpressure_waits"] += 1
+            self._queue.put(op)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._stopped:
+                    return
+                continue
+
+            if first is None:
+                return
+
+            # Group commit: collect whatever arrives within the flush interval
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    op = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if op is None:
+                    stop = True
+                    break
+                batch.append(op)
+
+            self._write_batch(batch)
+            if stop:
+                return
+
+    def _write_batch(self, batch: List[Tuple[str, str, str, Callable[[str], None]]]) -> None:
+        """Coalesce a batch per key and write it."""
+        grouped = OrderedDict()
+        counts = {}
+        for kind, key, data, write_fn in batch:
+            counts[key] = counts.get(key, 0) + 1
+            if key not in grouped or kind == "replace":
+                grouped[key] = [kind, data, write_fn]
+            else:
+                # An append after an append or replacement extends the pending data
+                grouped[key][1] += data
+
+        for key, (kind, data, write_fn) in grouped.items():
+            try:
+                write_fn(data)
+            except Exception as e:
+                self.metrics["errors"] += 1
+                print(f"Write-behind error for '{key}': {str(e)}", file=sys.stderr)
+
+        with self._cond:
+            self.metrics["batches"] += 1
+            self.metrics["written"] += len(grouped)
+            self.metrics["coalesced"] += len(batch) - len(grouped)
+            for key, count in counts.items():
+                self._pending[key] -= count
+                if self._pending[key] <= 0:
+                    del self._pending[key]
+            self._cond.notify_all()
+
+    def has_pending(self, key: str) -> bool:
+        """Check if writes for a key are still queued."""
+        with self._cond:
+            return key in self._pending
+
+    def flush(self, key: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+        """Wait until queued writes (for one key, or all) are on disk."""
+        if self._thread is None:
+            return True
+
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: (key not in self._pending) if key is not None else not self._pending,
+                timeout=timeout
+            )
+
+    def close(self) -> None:
+        """Flush queued writes and stop the background thread."""
+        if self._thread is None or self._stopped:
+            return
+
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join()
+
+        # Anything submitted while stopping is written synchronously
+        while True:
+            try:
+                op = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if op is not None:
+                self._write_batch([op])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get writer metrics."""
+        with self._cond:
+            return dict(self.metrics, mode=self.mode, queue_size=self._queue.qsize(),
+                        pending_keys=len(self._pending))
+
+class BackgroundTask:
+    """Runs a function on a daemon thread when triggered, one run at a time.
+
+    Triggers while a run is in progress are dropped; slow maintenance
+    (e.g. compressing rotated logs) then never holds up a request.
+    """
+
+    def __init__(self, fn: Callable[[], None], name: str):
+        self.fn = fn
+        self.name = name
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def trigger(self) -> bool:
+        """Start a run unless one is in progress; returns whether one was started."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self) -> None:
+        try:
+            self.fn()
+        except Exception as e:
+            print(f"Background task '{self.name}' failed: {str(e)}", file=sys.stderr)
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Wait for the current run, if any, to finish."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+# Create a singleton instance
+writer = WriteBehindWriter(
+    mode=config.config["PERSISTENCE_MODE"],
+    flush_interval=config.config["PERSISTENCE_FLUSH_INTERVAL_MS"] / 1000,
+    max_batch=config.config["PERSISTENCE_MAX_BATCH"],
+    max_queue=config.config["PERSISTENCE_MAX_QUEUE"]
+)
@@ -0,0 +1,250 @@
+"""
+Rate limiting module for the Roblox Studio AI Plugin server.
+Keeps per-user and per-role token buckets and daily quotas, either in memory
+(one process) or in a SQLite file shared by all workers on the node.
+"""
+import time
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Tuple
+import config
+from storage import SqliteDatabase
+
+RATE_LIMIT_BACKENDS = ("memory", "shared")
+
+RATE_LIMIT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    key TEXT PRIMARY KEY,
+    capacity REAL NOT NULL,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS rate_usage (
+    username TEXT PRIMARY KEY,
+    day TEXT NOT NULL,
+    daily_used INTEGER NOT NULL,
+    request_count INTEGER NOT NULL
+);
+"""
+
+class TokenBucket:
+    """Allows `capacity` requests per `period` seconds, refilled continuously."""
+
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, period: float = 60.0, tokens: Optional[float] = None,
+                 updated: Optional[float] = None):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity if tokens is None else tokens
+        self.updated = time.time() if updated is None else updated
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, count: int = 1) -> float:
+        """Seconds until `count` tokens are available (0 if they are available now)."""
+        if self.tokens >= count:
+            return 0.0
+        return (count - self.tokens) / self.rate
+
+class RateLimiter:
+    def __init__(self, enabled: bool = True, default_rate: int = 20):
+        self.enabled = enabled
+        self.default_rate = default_rate
+        # ("user", username) or ("role", role) -> TokenBucket
+        self.buckets = {}
+        # username -> [day ("YYYY-MM-DD"), requests used that day, total requests]
+        self.daily = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key: Tuple[str, str], rate: int) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None or bucket.capacity != rate:
+            # New key, or the configured rate changed
+            bucket = self.buckets[key] = TokenBucket(rate)
+        return bucket
+
+    def _bucket_rates(self, username: str, role: str) -> List[Tuple[Tuple[str, str], int]]:
+        """Get the buckets (key, requests per minute) a request from the user draws from."""
+        if not self.enabled:
+            return []
+
+        role_config = config.roles.get(role, {})
+        rates = [(("user", username), role_config.get("rate_limit", self.default_rate))]
+        if role_config.get("role_rate_limit"):
+            rates.append((("role", role), role_config["role_rate_limit"]))
+        return rates
+
+    def capacity(self, username: str, role: str, daily_limit: int) -> Optional[int]:
+        """Get the most requests that can ever be taken at once, or None if unlimited."""
+        rates = [rate for _, rate in self._bucket_rates(username, role)]
+        return int(min(rates + [daily_limit])) if rates else None
+
+    @staticmethod
+    def _take(buckets: List[TokenBucket], now: float, count: int = 1) -> float:
+        """Take `count` tokens from every bucket, or none; returns 0 or the seconds to wait."""
+        wait = 0.0
+        for bucket in buckets:
+            bucket.refill(now)
+            wait = max(wait, bucket.wait_time(count))
+        if wait == 0:
+            for bucket in buckets:
+                bucket.tokens -= count
+        return wait
+
+    @staticmethod
+    def _check(buckets: List[TokenBucket], now: float, count: int,
+               usage: List[Any], daily_limit: int) -> Optional[Tuple[bool, str, int]]:
+        """Take `count` requests from the buckets and check the daily quota.
+
+        Returns None if allowed, else the result for acquire().
+        """
+        if usage[1] + count > daily_limit:
+            return False, "Daily request limit reached", RateLimiter._seconds_until_midnight()
+
+        capacity = min((bucket.capacity for bucket in buckets), default=count)
+        if count > capacity:
+            # Waiting would not help
+            return False, f"{count} requests exceed the rate limit of {capacity:g} per minute", 0
+
+        wait = RateLimiter._take(buckets, now, count)
+        if wait > 0:
+            retry_after = int(wait) + 1
+            return False, f"Rate limit exceeded. Try again in {retry_after} seconds.", retry_after
+        return None
+
+    @staticmethod
+    def _seed_usage(today: str, user: Dict[str, Any]) -> List[Any]:
+        """Start a usage counter [day, daily_used, request_count] from a stored user record."""
+        daily_used = user.get("daily_used", 0) if (user.get("last_reset") or "")[:10] == today else 0
+        return [today, daily_used, user.get("request_count", 0)]
+
+    def acquire(self, username: str, role: str, daily_limit: int, user: Dict[str, Any],
+                count: int = 1) -> Tuple[bool, str, int]:
+        """Take `count` requests from the user's quota and buckets, all or none.
+
+        The user record seeds the usage counters the first time a user is
+        seen. Returns (allowed, message, retry_after seconds); retry_after
+        is 0 when more requests were asked for than a bucket holds.
+        """
+        today = datetime.now().strftime("%Y-%m-%d")
+
+        with self._lock:
+            usage = self.daily.get(username)
+            if usage is None:
+                usage = self.daily[username] = self._seed_usage(today, user)
+            elif usage[0] != today:
+                usage[0] = today
+                usage[1] = 0
+
+            buckets = [self._bucket(key, rate) for key, rate in self._bucket_rates(username, role)]
+            denied = self._check(buckets, time.time(), count, usage, daily_limit)
+            if denied is not None:
+                return denied
+
+            usage[1] += count
+            usage[2] += count
+            return True, "Request recorded", 0
+
+    def get_usage(self, username: str) -> Optional[Dict[str, Any]]:
+        """Get a user's usage counters (day, daily_used, request_count), if they were seen."""
+        with self._lock:
+            usage = self.daily.get(username)
+            if usage is None:
+                return None
+            return {"day": usage[0], "daily_used": usage[1], "request_count": usage[2]}
+
+    def reset_user(self, username: str) -> None:
+        """Forget a user's buckets and counters (e.g. after removal or a role change)."""
+        with self._lock:
+            self.buckets.pop(("user", username), None)
+            self.daily.pop(username, None)
+
+    @staticmethod
+    def _seconds_until_midnight() -> int:
+        now = datetime.now()
+        midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return int((midnight - now).total_seconds()) + 1
+
+class SharedRateLimiter(RateLimiter):
+    """Rate limiter whose buckets and counters live in SQLite, so all workers share them."""
+
+    def __init__(self, state_file: str, enabled: bool = True, default_rate: int = 20):
+        super().__init__(enabled=enabled, default_rate=default_rate)
+        self.db = SqliteDatabase(state_file, schema=RATE_LIMIT_SCHEMA, schema_columns=[], schema_indexes="")
+
+    def acquire(self, username: str, role: str, daily_limit: int, user: Dict[str, Any],
+                count: int = 1) -> Tuple[bool, str, int]:
+        """Take `count` requests from the user's quota and buckets (see RateLimiter.acquire)."""
+        today = datetime.now().strftime("%Y-%m-%d")
+
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT day, daily_used, request_count FROM rate_usage WHERE username = ?", (username,)
+            ).fetchone()
+            usage = list(row) if row is not None else self._seed_usage(today, user)
+            if usage[0] != today:
+                usage[0] = today
+                usage[1] = 0
+
+            buckets = []
+            for key, rate in self._bucket_rates(username, role):
+                row = conn.execute(
+                    "SELECT capacity, tokens, updated FROM rate_buckets WHERE key = ?", (":".join(key),)
+                ).fetchone()
+                if row is not None and row[0] == rate:
+                    buckets.append((key, TokenBucket(rate, tokens=row[1], updated=row[2])))
+                else:
+                    buckets.append((key, TokenBucket(rate)))
+
+            denied = self._check([bucket for _, bucket in buckets], time.time(), count, usage, daily_limit)
+            if denied is not None:
+                return denied
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO rate_buckets (key, capacity, tokens, updated) VALUES (?, ?, ?, ?)",
+                [(":".join(key), bucket.capacity, bucket.tokens, bucket.updated) for key, bucket in buckets]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_usage (username, day, daily_used, request_count) VALUES (?, ?, ?, ?)",
+                (username, usage[0], usage[1] + count, usage[2] + count)
+            )
+            return True, "Request recorded", 0
+
+    def get_usage(self, username: str) -> Optional[Dict[str, Any]]:
+        """Get a user's usage counters (day, daily_used, request_count), if they were seen."""
+        row = self.db.execute(
+            "SELECT day, daily_used, request_count FROM rate_usage WHERE username = ?", (username,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"day": row[0], "daily_used": row[1], "request_count": row[2]}
+
+    def reset_user(self, username: str) -> None:
+        """Forget a user's buckets and counters (e.g. after removal or a role change)."""
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM rate_buckets WHERE key = ?", (f"user:{username}",))
+            conn.execute("DELETE FROM rate_usage WHERE username = ?", (username,))
+
+def create_rate_limiter() -> RateLimiter:
+    """Create the rate limiter for the configured backend."""
+    backend = config.config["RATE_LIMIT_BACKEND"]
+    if backend not in RATE_LIMIT_BACKENDS:
+        raise ValueError(f"Invalid rate limit backend: {backend}")
+
+    if backend == "shared":
+        return SharedRateLimiter(
+            config.config["SHARED_STATE_FILE"],
+            enabled=config.config["RATE_LIMIT_ENABLED"],
+            default_rate=config.config["RATE_LIMIT_DEFAULT"]
+        )
+    return RateLimiter(
+        enabled=config.config["RATE_LIMIT_ENABLED"],
+        default_rate=config.config["RATE_LIMIT_DEFAULT"]
+    )
+
+# Create a singleton instance
+rate_limiter = create_rate_limiter()
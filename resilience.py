@@ -0,0 +1,398 @@
+"""
+Resilience module for the Roblox Studio AI Plugin server.
+Retries failed provider calls with jittered exponential backoff within a
+per-provider deadline, and stops calling failing providers for a while
+with circuit breakers. Blocking and asyncio calls share the breakers.
+"""
+import time
+import asyncio
+import random
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Any, AsyncIterator, Awaitable, Callable, Iterator, Tuple
+import requests
+import config
+
+# HTTP statuses worth retrying: throttling and transient server errors
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+class ProviderError(Exception):
+    """A failed provider call, with whether retrying (or another provider) may help."""
+
+    def __init__(self, message: str, provider: Optional[str] = None, status: Optional[int] = None,
+                 retryable: bool = False, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.message = message
+        self.provider = provider
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+    @classmethod
+    def from_status(cls, provider: str, label: str, status: int, text: str,
+                    retry_after: str = "") -> "ProviderError":
+        """Create an error from an unsuccessful HTTP status, body and Retry-After header."""
+        return cls(
+            f"Error from {label} API: {text}",
+            provider,
+            status=status,
+            retryable=status in RETRYABLE_STATUSES,
+            retry_after=int(retry_after) if retry_after.isdigit() else None
+        )
+    
+    @classmethod
+    def from_response(cls, provider: str, label: str, response: requests.Response) -> "ProviderError":
+        """Create an error from an unsuccessful HTTP response (closing it)."""
+        error = cls.from_status(provider, label, response.status_code, response.text,
+                                response.headers.get("Retry-After", ""))
+        response.close()
+        return error
+
+    @classmethod
+    def from_exception(cls, provider: str, error: requests.RequestException) -> "ProviderError":
+        """Create an error from a failed HTTP request; timeouts and connection errors are retryable."""
+        return cls(
+            f"Error generating response: {str(error)}",
+            provider,
+            retryable=isinstance(error, (requests.Timeout, requests.ConnectionError))
+        )
+
+class CallTimeout(tuple):
+    """(connect, read) timeouts of an attempt, carrying its call's deadline (a time.monotonic() value).
+
+    Socket timeouts only bound each read, so clients reading a response
+    check the deadline themselves (see check_deadline).
+    """
+
+    def __new__(cls, connect: float, read: float, deadline: Optional[float] = None) -> "CallTimeout":
+        timeout = super().__new__(cls, (connect, read))
+        timeout.deadline = deadline
+        return timeout
+
+def check_deadline(timeout: Optional[Tuple[float, float]], provider: str) -> None:
+    """Raise a retryable ProviderError once the deadline carried by a CallTimeout has passed."""
+    deadline = getattr(timeout, "deadline", None)
+    if deadline is not None and time.monotonic() >= deadline:
+        raise ProviderError(f"Provider '{provider}' did not finish within its deadline", provider, retryable=True)
+
+class CircuitBreaker:
+    """Opens after too many failed or slow calls among the recent ones.
+
+    While open, calls are rejected; after `cooldown` seconds one trial call
+    is let through (half-open), which closes the breaker if it succeeds.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, window: int = 20, min_calls: int = 5, error_rate: float = 0.5,
+                 slow_call_seconds: float = 30, slow_call_rate: float = 0.5, cooldown: float = 30):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.cooldown = cooldown
+        # (failed, slow) of the most recent calls
+        self.outcomes = deque(maxlen=window)
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.trial_running = False
+        self.stats = {"opened": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Check if a call may go ahead (claiming the trial call when half-open)."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    self.stats["rejected"] += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self.trial_running = False
+
+            if self.state == self.HALF_OPEN:
+                if self.trial_running:
+                    self.stats["rejected"] += 1
+                    return False
+                self.trial_running = True
+            return True
+
+    def retry_after(self) -> int:
+        """Seconds until the breaker lets a trial call through."""
+        return max(int(self.cooldown - (time.monotonic() - self.opened_at)) + 1, 1)
+
+    def release(self) -> None:
+        """End an allowed call whose outcome says nothing about the provider's health
+        (e.g. a bad request, or one abandoned by the client); a trial call may be retried."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.trial_running = False
+
+    def record_error(self, error: BaseException, latency: float) -> None:
+        """Record a failed call; client errors (e.g. a bad request) say nothing about the provider's health."""
+        if isinstance(error, ProviderError) and not error.retryable:
+            self.release()
+        else:
+            self.record(True, latency)
+
+    def record(self, failed: bool, latency: float) -> None:
+        """Record the outcome of an allowed call."""
+        slow = latency >= self.slow_call_seconds
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.trial_running = False
+                if failed or slow:
+                    self._open()
+                else:
+                    self.state = self.CLOSED
+                    self.outcomes.clear()
+                return
+
+            self.outcomes.append((failed, slow))
+            if len(self.outcomes) < self.min_calls:
+                return
+            failures = sum(1 for failed, _ in self.outcomes if failed) / len(self.outcomes)
+            slow_calls = sum(1 for _, slow in self.outcomes if slow) / len(self.outcomes)
+            if failures >= self.error_rate or slow_calls >= self.slow_call_rate:
+                self._open()
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.outcomes.clear()
+        self.stats["opened"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, state=self.state, recent_calls=len(self.outcomes),
+                        recent_failures=sum(1 for failed, _ in self.outcomes if failed))
+
+class MonitoredStream:
+    """Passes a streamed call's chunks through, recording its outcome with the breaker once it ends.
+
+    Mid-stream failures count against the provider; the latency recorded is
+    the time to the first chunk, so long streams are not slow calls. A
+    stream closed before its end (e.g. the client went away) is neither.
+    Iterates synchronously or asynchronously, like the wrapped stream.
+    """
+
+    def __init__(self, chunks: Any, breaker: CircuitBreaker, latency: float):
+        self.chunks = chunks
+        self.breaker = breaker
+        self.latency = latency
+        self.ended = False
+
+    def _end(self, error: Optional[BaseException] = None, abandoned: bool = False) -> None:
+        if self.ended:
+            return
+        self.ended = True
+        if abandoned:
+            self.breaker.release()
+        elif error is not None:
+            self.breaker.record_error(error, self.latency)
+        else:
+            self.breaker.record(False, self.latency)
+
+    def __iter__(self) -> Iterator[str]:
+        return self
+
+    def __next__(self) -> str:
+        try:
+            return next(self.chunks)
+        except StopIteration:
+            self._end()
+            raise
+        except GeneratorExit:
+            self._end(abandoned=True)
+            raise
+        except Exception as e:
+            self._end(e)
+            raise
+
+    def close(self) -> None:
+        try:
+            close = getattr(self.chunks, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._end(abandoned=True)
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self
+
+    async def __anext__(self) -> str:
+        try:
+            return await self.chunks.__anext__()
+        except StopAsyncIteration:
+            self._end()
+            raise
+        except asyncio.CancelledError:
+            self._end(abandoned=True)
+            raise
+        except Exception as e:
+            self._end(e)
+            raise
+
+    async def aclose(self) -> None:
+        try:
+            await self.chunks.aclose()
+        finally:
+            self._end(abandoned=True)
+
+class Resilience:
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.25, max_delay: float = 4.0,
+                 deadline: float = 90):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Default seconds a provider call may take, retries included
+        self.deadline = deadline
+        # provider -> CircuitBreaker
+        self.breakers = {}
+        self.stats = {"calls": 0, "retries": 0, "failures": 0}
+        self._lock = threading.Lock()
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self.breakers.get(provider)
+            if breaker is None:
+                breaker = self.breakers[provider] = CircuitBreaker(
+                    window=config.config["BREAKER_WINDOW"],
+                    min_calls=config.config["BREAKER_MIN_CALLS"],
+                    error_rate=config.config["BREAKER_ERROR_RATE"],
+                    slow_call_seconds=config.config["BREAKER_SLOW_CALL_SECONDS"],
+                    slow_call_rate=config.config["BREAKER_SLOW_CALL_RATE"],
+                    cooldown=config.config["BREAKER_COOLDOWN"]
+                )
+            return breaker
+
+    def is_available(self, provider: str) -> bool:
+        """Check if a provider's breaker is not open (without claiming a trial call)."""
+        breaker = self.breaker(provider)
+        return breaker.state != CircuitBreaker.OPEN or time.monotonic() - breaker.opened_at >= breaker.cooldown
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _start(self, provider: str) -> Tuple[CircuitBreaker, float]:
+        """Count a call; returns the provider's breaker and the call's deadline."""
+        self._count("calls")
+        return self.breaker(provider), time.monotonic() + config.providers.get(provider, {}).get("deadline", self.deadline)
+
+    def _allow(self, provider: str, breaker: CircuitBreaker) -> None:
+        """Raise ProviderError if the breaker rejects the attempt."""
+        if not breaker.allow():
+            self._count("failures")
+            raise ProviderError(
+                f"Provider '{provider}' is temporarily unavailable",
+                provider, retryable=True, retry_after=breaker.retry_after()
+            )
+
+    @staticmethod
+    def _timeout(timeout: Tuple[float, float], deadline: float) -> CallTimeout:
+        """Cap (connect, read) timeouts by the time left before the deadline."""
+        remaining = max(deadline - time.monotonic(), 0.001)
+        return CallTimeout(min(timeout[0], remaining), min(timeout[1], remaining), deadline)
+
+    def _backoff(self, error: ProviderError, breaker: CircuitBreaker, latency: float,
+                 attempt: int, deadline: float) -> float:
+        """Record a failed attempt; returns the delay before retrying, or raises the error."""
+        breaker.record_error(error, latency)
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if error.retry_after:
+            delay = max(delay, error.retry_after)
+        # A Retry-After beyond max_delay is left to failover to another provider
+        if (not error.retryable or attempt >= self.max_attempts or delay > self.max_delay
+                or time.monotonic() + delay >= deadline):
+            self._count("failures")
+            raise error
+
+        self._count("retries")
+        return delay
+
+    def call(self, provider: str, fn: Callable[[Tuple[float, float]], Any], timeout: Tuple[float, float],
+             stream: bool = False) -> Any:
+        """Call fn(timeout) with retries, within the provider's deadline and circuit breaker.
+
+        fn gets the (connect, read) timeouts to use, capped by the time left,
+        as a CallTimeout carrying the deadline. With `stream`, fn returns an
+        iterator of chunks whose outcome is recorded once it ends. Raises
+        ProviderError once retries are exhausted or not worthwhile.
+        """
+        breaker, deadline = self._start(provider)
+        attempt = 0
+
+        while True:
+            self._allow(provider, breaker)
+            started = time.monotonic()
+            try:
+                result = fn(self._timeout(timeout, deadline))
+            except ProviderError as e:
+                error = e
+            except requests.RequestException as e:
+                error = ProviderError.from_exception(provider, e)
+            except BaseException:
+                breaker.record(True, time.monotonic() - started)
+                raise
+            else:
+                if stream:
+                    return MonitoredStream(result, breaker, time.monotonic() - started)
+                breaker.record(False, time.monotonic() - started)
+                return result
+
+            attempt += 1
+            time.sleep(self._backoff(error, breaker, time.monotonic() - started, attempt, deadline))
+
+    async def call_async(self, provider: str, fn: Callable[[Tuple[float, float]], Awaitable[Any]],
+                         timeout: Tuple[float, float], stream: bool = False) -> Any:
+        """Await fn(timeout) with retries, like call(). fn must raise ProviderError on failure."""
+        breaker, deadline = self._start(provider)
+        attempt = 0
+
+        while True:
+            self._allow(provider, breaker)
+            started = time.monotonic()
+            try:
+                result = await fn(self._timeout(timeout, deadline))
+            except ProviderError as e:
+                error = e
+            except asyncio.CancelledError:
+                # Abandoned (e.g. a lost hedge or a closed connection), not failed
+                breaker.release()
+                raise
+            except BaseException:
+                breaker.record(True, time.monotonic() - started)
+                raise
+            else:
+                if stream:
+                    return MonitoredStream(result, breaker, time.monotonic() - started)
+                breaker.record(False, time.monotonic() - started)
+                return result
+
+            attempt += 1
+            await asyncio.sleep(self._backoff(error, breaker, time.monotonic() - started, attempt, deadline))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get retry counters and the state of each provider's circuit breaker."""
+        with self._lock:
+            stats = dict(self.stats)
+            breakers = dict(self.breakers)
+        stats["breakers"] = {provider: breaker.get_stats() for provider, breaker in breakers.items()}
+        return stats
+
+def failover_chain() -> List[str]:
+    """Get the configured provider failover order."""
+    chain = config.config["FAILOVER_CHAIN"]
+    if isinstance(chain, str):
+        chain = [name.strip() for name in chain.split(",") if name.strip()]
+    return chain
+
+# Create a singleton instance
+resilience = Resilience(
+    max_attempts=config.config["RETRY_MAX_ATTEMPTS"],
+    base_delay=config.config["RETRY_BASE_DELAY_MS"] / 1000,
+    max_delay=config.config["RETRY_MAX_DELAY_MS"] / 1000,
+    deadline=config.config["PROVIDER_DEADLINE"]
+)
@@ -0,0 +1,363 @@
+"""
+Response cache module for the Roblox Studio AI Plugin server.
+Caches generated responses by a hash of the request, in an in-memory LRU
+tier and an optional SQLite tier shared by all workers on the node, and
+finds responses to near-duplicate prompts with MinHash/LSH.
+"""
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Tuple
+import config
+from storage import SqliteDatabase
+
+RESPONSE_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS response_cache (
+    key TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    content TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_response_cache_accessed ON response_cache (accessed);
+"""
+
+# MinHash uses hash functions (a * x + b) mod MERSENNE_PRIME with fixed seeds
+MERSENNE_PRIME = (1 << 61) - 1
+MINHASH_SEED = 1
+WORD_PATTERN = re.compile(r"\w+")
+
+def normalize_prompt(prompt: str) -> List[str]:
+    """Reduce a prompt to lowercase word tokens, ignoring whitespace, case and punctuation."""
+    return WORD_PATTERN.findall(prompt.lower())
+
+def shingles(tokens: List[str], size: int) -> frozenset:
+    """Get the set of `size`-token shingles (the whole prompt if it is shorter)."""
+    if len(tokens) <= size:
+        return frozenset([" ".join(tokens)]) if tokens else frozenset()
+    return frozenset(" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1))
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+class NearDuplicateIndex:
+    """Finds earlier responses to similar prompts within a scope, using MinHash and LSH.
+    
+    Signatures are split into `bands` bands of `rows` rows; prompts sharing a
+    band are candidates, then accepted on the Jaccard similarity of their
+    shingles. Memory only, bounded by `max_entries` (least recently used out).
+    """
+
+    def __init__(self, threshold: float = 0.8, shingle_size: int = 2, bands: int = 16, rows: int = 4,
+                 max_entries: int = 1000, ttl: int = 86400):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.bands = bands
+        self.rows = rows
+        self.max_entries = max_entries
+        self.ttl = ttl
+        rng = random.Random(MINHASH_SEED)
+        self.hash_params = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME))
+                            for _ in range(bands * rows)]
+        # entry id -> (scope, shingles, band keys, expires, provider, model, content)
+        self.entries = OrderedDict()
+        # (scope, band, band values) -> entry ids
+        self.buckets = {}
+        # (scope, shingles) -> entry id, so storing a prompt again replaces its entry
+        self.prompts = {}
+        self.next_id = 1
+
+    def signature(self, prompt_shingles: frozenset) -> List[int]:
+        """Compute the MinHash signature of a shingle set."""
+        hashes = [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+                  for shingle in prompt_shingles]
+        return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self.hash_params]
+
+    def band_keys(self, scope: str, signature: List[int]) -> List[Tuple[str, int, Tuple[int, ...]]]:
+        return [(scope, band, tuple(signature[band * self.rows:(band + 1) * self.rows]))
+                for band in range(self.bands)]
+
+    def fingerprint(self, scope: str, prompt: str) -> Optional[Tuple[str, frozenset, List[Tuple[str, int, Tuple[int, ...]]]]]:
+        """Compute a prompt's (scope, shingles, band keys) for find and add, or None if it has no shingles.
+
+        Reads no index state, so callers compute it before taking their lock.
+        """
+        prompt_shingles = shingles(normalize_prompt(prompt), self.shingle_size)
+        if not prompt_shingles:
+            return None
+        return scope, prompt_shingles, self.band_keys(scope, self.signature(prompt_shingles))
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return
+        if self.prompts.get((entry[0], entry[1])) == entry_id:
+            del self.prompts[(entry[0], entry[1])]
+        for band_key in entry[2]:
+            bucket = self.buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self.buckets[band_key]
+
+    def find(self, fingerprint: Tuple[str, frozenset, List[Tuple[str, int, Tuple[int, ...]]]],
+             now: float) -> Optional[Tuple[str, float]]:
+        """Get the response to the most similar prompt above the threshold, with its similarity."""
+        _, prompt_shingles, band_keys = fingerprint
+        candidates = set()
+        for band_key in band_keys:
+            candidates.update(self.buckets.get(band_key, ()))
+
+        best = None
+        for entry_id in candidates:
+            entry = self.entries[entry_id]
+            if entry[3] <= now:
+                self._remove(entry_id)
+                continue
+            similarity = jaccard(prompt_shingles, entry[1])
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (entry_id, similarity)
+
+        if best is None:
+            return None
+        self.entries.move_to_end(best[0])
+        return self.entries[best[0]][6], best[1]
+
+    def add(self, fingerprint: Tuple[str, frozenset, List[Tuple[str, int, Tuple[int, ...]]]],
+            provider: str, model: str, content: str, now: float) -> None:
+        """Index a response by its prompt, replacing an earlier response to the same prompt."""
+        scope, prompt_shingles, band_keys = fingerprint
+        previous = self.prompts.get((scope, prompt_shingles))
+        if previous is not None:
+            self._remove(previous)
+
+        entry_id = self.next_id
+        self.next_id += 1
+        self.prompts[(scope, prompt_shingles)] = entry_id
+        self.entries[entry_id] = (scope, prompt_shingles, band_keys, now + self.ttl, provider, model, content)
+        for band_key in band_keys:
+            self.buckets.setdefault(band_key, set()).add(entry_id)
+
+        while len(self.entries) > self.max_entries:
+            self._remove(next(iter(self.entries)))
+
+    def purge(self, provider: Optional[str] = None, model: Optional[str] = None) -> int:
+        """Remove entries, optionally only those of a provider and/or model."""
+        entry_ids = [entry_id for entry_id, entry in self.entries.items()
+                     if (provider is None or entry[4] == provider) and (model is None or entry[5] == model)]
+        for entry_id in entry_ids:
+            self._remove(entry_id)
+        return len(entry_ids)
+
+def cache_key(provider: str, model: str, messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+    """Hash a request canonically: same provider, model, messages and sampling params, same key."""
+    canonical = json.dumps({
+        "provider": provider,
+        "model": model,
+        "messages": [{"role": m.get("role", ""), "content": m.get("content", "")} for m in messages],
+        "params": params
+    }, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    def __init__(self, enabled: bool = True, ttl: int = 86400, max_entries: int = 1000,
+                 max_bytes: int = 16 * 1024 * 1024, disk_file: Optional[str] = None,
+                 disk_max_bytes: int = 256 * 1024 * 1024, near: Optional[NearDuplicateIndex] = None):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        # key -> (expires, provider, model, content, size), least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.db = SqliteDatabase(disk_file, schema=RESPONSE_CACHE_SCHEMA, schema_columns=[],
+                                 schema_indexes="") if disk_file else None
+        # Optional approximate tier, consulted after exact misses
+        self.near = near
+        self.stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "near_hits": 0,
+            "near_misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0,
+            "bypassed": 0
+        }
+        self._lock = threading.Lock()
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[4]
+
+    def _put(self, key: str, entry: Tuple[float, str, str, str, int]) -> None:
+        """Add an entry to the memory tier, evicting least recently used ones past the bounds."""
+        self._remove(key)
+        if entry[4] > self.max_bytes:
+            return
+        self.entries[key] = entry
+        self.size += entry[4]
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted[4]
+            self.stats["evictions"] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a cached response, or None on a miss."""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry[3]
+                self._remove(key)
+                self.stats["expired"] += 1
+
+        if self.db is not None:
+            row = self.db.execute(
+                "SELECT expires, provider, model, content, size FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[0] > now:
+                self.db.execute("UPDATE response_cache SET accessed = ? WHERE key = ?", (now, key))
+                with self._lock:
+                    self._put(key, tuple(row))
+                    self.stats["disk_hits"] += 1
+                return row[3]
+
+        self._count("misses")
+        return None
+
+    def get_near(self, scope: str, prompt: str) -> Optional[Tuple[str, float]]:
+        """Get a response to a similar prompt in the same scope, with its similarity, or None."""
+        if not self.enabled or self.near is None:
+            return None
+
+        # Hashing is the costly part, so it is done before taking the cache's lock
+        fingerprint = self.near.fingerprint(scope, prompt)
+        with self._lock:
+            match = self.near.find(fingerprint, time.time()) if fingerprint is not None else None
+            self.stats["near_hits" if match is not None else "near_misses"] += 1
+        return match
+
+    def set(self, key: str, provider: str, model: str, content: str,
+            scope: Optional[str] = None, prompt: Optional[str] = None) -> None:
+        """Cache a response for the configured TTL (also by prompt similarity, given a scope and prompt)."""
+        if not self.enabled or not content:
+            return
+
+        now = time.time()
+        size = len(content.encode("utf-8"))
+        entry = (now + self.ttl, provider, model, content, size)
+        fingerprint = self.near.fingerprint(scope, prompt) if self.near is not None and scope is not None and prompt else None
+        with self._lock:
+            self._put(key, entry)
+            self.stats["stores"] += 1
+            if fingerprint is not None:
+                self.near.add(fingerprint, provider, model, content, now)
+
+        if self.db is not None:
+            with self.db.transaction() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, provider, model, content, size, expires, accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, provider, model, content, size, entry[0], now)
+                )
+                self._trim_disk(conn, now)
+
+    def _trim_disk(self, conn: Any, now: float) -> None:
+        """Drop expired disk entries, then least recently used ones past the size bound."""
+        conn.execute("DELETE FROM response_cache WHERE expires <= ?", (now,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+        if total <= self.disk_max_bytes:
+            return
+
+        excess = total - self.disk_max_bytes
+        keys = []
+        for key, size in conn.execute("SELECT key, size FROM response_cache ORDER BY accessed"):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM response_cache WHERE key = ?", keys)
+        with self._lock:
+            self.stats["evictions"] += len(keys)
+
+    def record_bypass(self) -> None:
+        """Count a request that skipped the cache."""
+        self._count("bypassed")
+
+    def purge(self, provider: Optional[str] = None, model: Optional[str] = None) -> int:
+        """Remove cached responses, optionally only those of a provider and/or model."""
+        def matches(entry_provider: str, entry_model: str) -> bool:
+            return (provider is None or entry_provider == provider) and (model is None or entry_model == model)
+
+        with self._lock:
+            keys = [key for key, entry in self.entries.items() if matches(entry[1], entry[2])]
+            for key in keys:
+                self._remove(key)
+            if self.near is not None:
+                self.near.purge(provider, model)
+        removed = len(keys)
+
+        if self.db is not None:
+            with self.db.transaction() as conn:
+                cursor = conn.execute(
+                    "DELETE FROM response_cache WHERE (? IS NULL OR provider = ?) AND (? IS NULL OR model = ?)",
+                    (provider, provider, model, model)
+                )
+                removed = max(removed, cursor.rowcount)
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and the size of each tier."""
+        with self._lock:
+            stats = dict(self.stats, entries=len(self.entries), bytes=self.size, enabled=self.enabled)
+            if self.near is not None:
+                stats["near_entries"] = len(self.near.entries)
+                stats["near_threshold"] = self.near.threshold
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        near_lookups = stats["near_hits"] + stats["near_misses"]
+        stats["near_hit_rate"] = round(stats["near_hits"] / near_lookups, 4) if near_lookups else 0.0
+
+        if self.db is not None:
+            row = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache").fetchone()
+            stats["disk_entries"], stats["disk_bytes"] = row
+        return stats
+
+# Create a singleton instance
+response_cache = ResponseCache(
+    enabled=config.config["RESPONSE_CACHE_ENABLED"],
+    ttl=config.config["RESPONSE_CACHE_TTL"],
+    max_entries=config.config["RESPONSE_CACHE_MAX_ENTRIES"],
+    max_bytes=config.config["RESPONSE_CACHE_MAX_BYTES"],
+    disk_file=config.config["RESPONSE_CACHE_DISK_FILE"] or None,
+    disk_max_bytes=config.config["RESPONSE_CACHE_DISK_MAX_BYTES"],
+    near=NearDuplicateIndex(
+        threshold=config.config["NEAR_CACHE_THRESHOLD"],
+        shingle_size=config.config["NEAR_CACHE_SHINGLE_SIZE"],
+        max_entries=config.config["NEAR_CACHE_MAX_ENTRIES"],
+        ttl=config.config["RESPONSE_CACHE_TTL"]
+    ) if config.config["NEAR_CACHE_ENABLED"] else None
+)
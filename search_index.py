@@ -0,0 +1,361 @@
+"""
+Search module for the Roblox Studio AI Plugin server.
+Inverted index over chat history messages and request logs, ranked with BM25.
+"""
+import os
+import re
+import json
+import math
+import uuid
+import heapq
+import threading
+from typing import Dict, List, Optional, Any, Iterable, Tuple
+from persistence import atomic_write, append_write
+from shared_state import file_lock, file_signature
+
+# Identifiers with their Lua member access, e.g. game.Workspace.Part or part:FindFirstChild
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*(?:[.:][A-Za-z_][A-Za-z0-9_]*)*|\d+(?:\.\d+)?")
+CAMEL_CASE_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+SNIPPET_LENGTH = 200
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Journal entries no longer describing a live document before the journal is compacted
+COMPACT_MIN_DEAD = 1000
+
+def tokenize(text: str) -> List[str]:
+    """Split text into search terms, understanding Lua/Roblox identifiers.
+
+    "workspace.SpawnLocation:GetChildren" yields the whole path, each part
+    ("workspace", "spawnlocation", "getchildren") and each camelCase or
+    snake_case word ("spawn", "location", "get", "children").
+    """
+    terms = []
+    for match in IDENTIFIER_PATTERN.finditer(text):
+        token = match.group(0)
+        parts = re.split(r"[.:]", token) if not token[0].isdigit() else [token]
+        if len(parts) > 1:
+            terms.append(token.lower().replace(":", "."))
+
+        for part in parts:
+            lowered = part.lower()
+            terms.append(lowered)
+            words = [word.lower() for chunk in part.split("_") for word in CAMEL_CASE_PATTERN.findall(chunk)]
+            if len(words) > 1:
+                terms.extend(word for word in words if word != lowered)
+    return terms
+
+class SearchIndex:
+    """BM25 index persisted as a journal shared by every worker on the node.
+
+    Each worker appends its own documents, under IDs prefixed with a
+    per-instance token so they never collide, and tails the journal for
+    the other workers' changes before serving a search.
+    """
+
+    def __init__(self, index_file: Optional[str] = None, writer: Optional[Any] = None):
+        self.index_file = index_file
+        self.writer = writer
+        # Unique to this instance, so workers sharing the journal never reuse an ID
+        self.id_prefix = uuid.uuid4().hex[:12]
+        self.next_seq = 1
+        self._reset()
+        self._lock = threading.Lock()
+
+    def _reset(self) -> None:
+        # term -> {doc_id: term frequency}
+        self.postings = {}
+        # doc_id -> document metadata (kind, username, conversation_id, timestamp, snippet, length)
+        self.docs = {}
+        # (username, conversation_id) -> doc ids, for clearing conversations
+        self.conversation_docs = {}
+        self.total_length = 0
+        # Journal position read so far: (inode, byte offset) of the file replayed
+        self.inode = None
+        self.offset = 0
+        # Journal entries read or written, live or not; drives compaction
+        self.entries = 0
+
+    def exists(self) -> bool:
+        """Check if a persisted index exists."""
+        return bool(self.index_file) and os.path.exists(self.index_file)
+
+    def load(self) -> int:
+        """Replay the persisted index journal; returns the number of documents."""
+        with self._lock:
+            self._reset()
+            self._catch_up()
+            return len(self.docs)
+
+    def _catch_up(self) -> None:
+        """Replay journal entries appended since the last read, reloading if the journal was replaced."""
+        signature = file_signature(self.index_file) if self.index_file else None
+        if signature is None:
+            return
+
+        inode, size, _ = signature
+        if inode != self.inode or size < self.offset:
+            # Rebuilt or compacted by another worker
+            self._reset()
+            self.inode = inode
+        if size <= self.offset:
+            return
+
+        with open(self.index_file, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        # A line still being appended is read next time
+        data = data[:data.rfind(b"\n") + 1]
+        self.offset += len(data)
+
+        for line in data.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+
+            self.entries += 1
+            if entry.get("op") == "add":
+                self._add(entry["doc"], entry["terms"])
+            elif entry.get("op") == "delete":
+                self._delete_conversation(entry["username"], entry["conversation_id"])
+
+    def _journal(self, entries: List[Dict[str, Any]]) -> None:
+        """Append entries to the index journal."""
+        if not self.index_file:
+            return
+
+        data = "".join(json.dumps(entry) + "\n" for entry in entries)
+        if self.writer is not None:
+            self.writer.append(self.index_file, data, self._write)
+        else:
+            self._write(data)
+
+    def _write(self, data: str) -> None:
+        # Shared with other workers' appends; compaction takes the lock exclusively
+        with file_lock(self.index_file, shared=True):
+            append_write(self.index_file, data, fsync=self.writer.fsync if self.writer is not None else True)
+
+    def _add(self, doc: Dict[str, Any], terms: Dict[str, int]) -> None:
+        doc_id = doc["id"] = str(doc["id"])
+        if doc_id in self.docs:
+            # Our own entry read back from the journal, or repeated by a compaction
+            return
+
+        doc["terms"] = list(terms)
+        self.docs[doc_id] = doc
+        self.total_length += doc["length"]
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+
+        if doc.get("conversation_id") is not None:
+            self.conversation_docs.setdefault((doc["username"], doc["conversation_id"]), []).append(doc_id)
+
+    def _delete_conversation(self, username: str, conversation_id: str) -> int:
+        doc_ids = self.conversation_docs.pop((username, conversation_id), [])
+        for doc_id in doc_ids:
+            doc = self.docs.pop(doc_id, None)
+            if doc is None:
+                continue
+            self.total_length -= doc["length"]
+            for term in doc["terms"]:
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self.postings[term]
+        return len(doc_ids)
+
+    def _new_document(self, kind: str, text: str, username: str, timestamp: str,
+                      conversation_id: Optional[str], fields: Dict[str, Any]) -> Dict[str, Any]:
+        """Tokenize a document and give it the next ID; returns its journal entry."""
+        terms = {}
+        for term in tokenize(text):
+            terms[term] = terms.get(term, 0) + 1
+
+        doc = dict(
+            fields,
+            id=f"{self.id_prefix}-{self.next_seq}",
+            kind=kind,
+            username=username,
+            conversation_id=conversation_id,
+            timestamp=timestamp,
+            snippet=text[:SNIPPET_LENGTH],
+            length=sum(terms.values())
+        )
+        self.next_seq += 1
+        return {"op": "add", "doc": doc, "terms": terms}
+
+    def add_document(self, kind: str, text: str, username: str, timestamp: str,
+                     conversation_id: Optional[str] = None, **fields: Any) -> str:
+        """Index a document and persist it; returns its ID."""
+        with self._lock:
+            entry = self._new_document(kind, text, username, timestamp, conversation_id, fields)
+            self._add(dict(entry["doc"]), entry["terms"])
+            self.entries += 1
+        # Outside the lock: the writer may apply backpressure, and compaction takes the lock
+        self._journal([entry])
+        return entry["doc"]["id"]
+
+    def add_log(self, entry: Dict[str, Any]) -> str:
+        """Index a request log entry (its prompt and response)."""
+        return self.add_document(
+            "log",
+            f"{entry.get('prompt', '')}\n{entry.get('response', '')}",
+            entry.get("username", ""),
+            entry.get("timestamp", ""),
+            model=entry.get("model", "")
+        )
+
+    def add_message(self, username: str, conversation_id: str, message: Dict[str, Any]) -> str:
+        """Index a chat history message."""
+        return self.add_document(
+            "message",
+            message.get("content", ""),
+            username,
+            message.get("timestamp", ""),
+            conversation_id=conversation_id,
+            role=message.get("role", "")
+        )
+
+    def remove_conversation(self, username: str, conversation_id: str) -> int:
+        """Drop a conversation's messages from the index."""
+        with self._lock:
+            # Other workers may have indexed messages of the conversation too
+            self._catch_up()
+            removed = self._delete_conversation(username, conversation_id)
+            if removed:
+                self.entries += 1
+            compact = self._needs_compaction()
+        if removed:
+            self._journal([{"op": "delete", "username": username, "conversation_id": conversation_id}])
+        if compact:
+            if self.writer is not None:
+                # Off the request thread, after the queued appends
+                self.writer.replace(f"{self.index_file}.compact", "", lambda _: self.compact())
+            else:
+                self.compact()
+        return removed
+
+    def _needs_compaction(self) -> bool:
+        dead = self.entries - len(self.docs)
+        return bool(self.index_file) and dead >= COMPACT_MIN_DEAD and dead > len(self.docs)
+
+    def _write_snapshot(self) -> None:
+        """Replace the journal with one entry per live document; the caller holds the exclusive file lock."""
+        lines = []
+        for doc_id, doc in self.docs.items():
+            terms = {term: self.postings[term][doc_id] for term in doc["terms"]}
+            stored = {key: value for key, value in doc.items() if key != "terms"}
+            lines.append(json.dumps({"op": "add", "doc": stored, "terms": terms}) + "\n")
+        atomic_write(self.index_file, "".join(lines))
+
+        # Continue tailing the new journal from its end
+        self.inode, size, _ = file_signature(self.index_file)
+        self.offset = size
+        self.entries = len(self.docs)
+
+    def compact(self) -> int:
+        """Rewrite the journal without deleted documents; returns the number of documents kept."""
+        if not self.index_file:
+            return len(self.docs)
+
+        with self._lock, file_lock(self.index_file):
+            # Appends from other workers wait on the lock, so none are lost
+            self._catch_up()
+            if self.exists():
+                self._write_snapshot()
+            return len(self.docs)
+
+    def rebuild(self, logs: Iterable[Dict[str, Any]],
+                conversations: Iterable[Tuple[str, str, List[Dict[str, Any]]]]) -> int:
+        """Index existing logs and conversations from scratch.
+
+        Only one worker builds a missing index; the others wait for it and
+        load its journal.
+        """
+        def entries():
+            for entry in logs:
+                yield self._new_document(
+                    "log", f"{entry.get('prompt', '')}\n{entry.get('response', '')}",
+                    entry.get("username", ""), entry.get("timestamp", ""), None,
+                    {"model": entry.get("model", "")}
+                )
+            for username, conversation_id, messages in conversations:
+                for message in messages:
+                    yield self._new_document(
+                        "message", message.get("content", ""), username, message.get("timestamp", ""),
+                        conversation_id, {"role": message.get("role", "")}
+                    )
+
+        with self._lock:
+            self._reset()
+            if not self.index_file:
+                for entry in entries():
+                    self._add(entry["doc"], entry["terms"])
+                return len(self.docs)
+
+            with file_lock(self.index_file):
+                if self.exists():
+                    # Another worker built it while this one waited for the lock
+                    self._catch_up()
+                    return len(self.docs)
+
+                for entry in entries():
+                    self._add(entry["doc"], entry["terms"])
+                self._write_snapshot()
+                return len(self.docs)
+
+    def search(self, query: str, kind: Optional[str] = None, username: Optional[str] = None,
+               conversation_id: Optional[str] = None, limit: int = 20,
+               offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        """Find documents containing every query term, best BM25 score first.
+
+        Returns a page of results and the total number of matches.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return [], 0
+
+        with self._lock:
+            self._catch_up()
+            postings = [self.postings.get(term) for term in terms]
+            if any(p is None for p in postings):
+                return [], 0
+
+            # Intersect starting from the rarest term
+            postings.sort(key=len)
+            doc_count = len(self.docs)
+            average_length = self.total_length / doc_count if doc_count else 0.0
+            weights = [math.log(1 + (doc_count - len(p) + 0.5) / (len(p) + 0.5)) for p in postings]
+
+            scored = []
+            for doc_id in postings[0]:
+                if not all(doc_id in p for p in postings[1:]):
+                    continue
+
+                doc = self.docs[doc_id]
+                if kind is not None and doc["kind"] != kind:
+                    continue
+                if username is not None and doc["username"] != username:
+                    continue
+                if conversation_id is not None and doc["conversation_id"] != conversation_id:
+                    continue
+
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * doc["length"] / average_length) if average_length else BM25_K1
+                score = 0.0
+                for weight, p in zip(weights, postings):
+                    frequency = p[doc_id]
+                    score += weight * frequency * (BM25_K1 + 1) / (frequency + norm)
+                scored.append((score, doc["timestamp"], doc_id))
+
+            top = heapq.nlargest(max(offset, 0) + max(limit, 0), scored)[max(offset, 0):]
+            results = []
+            for score, _, doc_id in top:
+                doc = {key: value for key, value in self.docs[doc_id].items() if key not in ("terms", "length")}
+                doc["score"] = round(score, 4)
+                results.append(doc)
+            return results, len(scored)
@@ -0,0 +1,165 @@
+"""
+Shared state module for the Roblox Studio AI Plugin server.
+Lets several worker processes on one node share data files safely: writes
+are merged under an exclusive file lock and readers detect changes made by
+other workers.
+"""
+import os
+import json
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Any, Iterator, Tuple
+from persistence import atomic_write
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks (e.g. Windows); only single-process deployments are safe
+    fcntl = None
+
+# Marks a key deleted in a pending change set
+DELETED = object()
+
+@contextmanager
+def file_lock(path: str, shared: bool = False) -> Iterator[None]:
+    """Hold an advisory lock on `<path>.lock` (shared for readers, exclusive for writers)."""
+    if fcntl is None:
+        yield
+        return
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+def file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """Identify a file's current version by (inode, size, mtime), or None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+class SharedJsonFile:
+    """A JSON object file shared between processes.
+
+    Changes are recorded per key and merged into the latest on-disk contents
+    under an exclusive lock, so workers never overwrite each other's keys.
+    """
+
+    def __init__(self, path: str, section: Optional[str] = None, writer: Optional[Any] = None):
+        self.path = path
+        # Optional top-level key holding the object, e.g. {"files": {...}}
+        self.section = section
+        # Optional WriteBehindWriter; merges then happen off the request thread
+        self.writer = writer
+        self.signature = None
+        self._changes = {}
+        self._replace = None
+        self._lock = threading.Lock()
+
+    def _read(self) -> Optional[Dict[str, Any]]:
+        with open(self.path, "r") as f:
+            data = json.load(f)
+        if self.section is not None:
+            data = data.get(self.section, {})
+        return data if isinstance(data, dict) else None
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Read the object, or None if the file is missing or corrupted."""
+        with file_lock(self.path, shared=True):
+            signature = file_signature(self.path)
+            if signature is None:
+                return None
+            try:
+                data = self._read()
+            except (json.JSONDecodeError, FileNotFoundError, AttributeError):
+                return None
+            self.signature = signature
+            return data
+
+    def changed(self) -> bool:
+        """Check if another process changed the file since it was last loaded or written."""
+        return file_signature(self.path) != self.signature
+
+    def update(self, changes: Dict[str, Any]) -> None:
+        """Set keys (or delete them, with DELETED values)."""
+        with self._lock:
+            for key, value in changes.items():
+                self._changes[key] = dict(value) if isinstance(value, dict) else value
+        self._submit()
+
+    def update_fields(self, key: str, fields: Dict[str, Any]) -> None:
+        """Update some fields of an object-valued key, keeping its other fields as stored."""
+        with self._lock:
+            pending = self._changes.get(key)
+            if pending is None:
+                self._changes[key] = _FieldUpdate(fields)
+            elif pending is not DELETED:
+                # Both dicts and pending field updates take the newer fields
+                (pending.fields if isinstance(pending, _FieldUpdate) else pending).update(fields)
+        self._submit()
+
+    def replace_all(self, data: Dict[str, Any]) -> None:
+        """Replace the whole object."""
+        with self._lock:
+            self._replace = dict(data)
+            self._changes = {}
+        self._submit()
+
+    def merge_pending(self) -> None:
+        """Merge pending changes into the file now (on the writer thread, before reading them back)."""
+        self._merge("")
+
+    def _submit(self) -> None:
+        if self.writer is not None:
+            # The merge reads the pending changes itself; the queued data is unused
+            self.writer.replace(self.path, "", self._merge)
+        else:
+            self._merge("")
+
+    def _merge(self, _: str) -> None:
+        """Apply pending changes to the current file contents under an exclusive lock."""
+        with self._lock:
+            changes, self._changes = self._changes, {}
+            replace, self._replace = self._replace, None
+        if not changes and replace is None:
+            return
+
+        with file_lock(self.path):
+            signature = file_signature(self.path)
+            data = replace
+            if data is None:
+                try:
+                    data = (self._read() if signature is not None else None) or {}
+                except (json.JSONDecodeError, AttributeError):
+                    data = {}
+
+            for key, value in changes.items():
+                if value is DELETED:
+                    data.pop(key, None)
+                elif isinstance(value, _FieldUpdate):
+                    value.apply(data, key)
+                else:
+                    data[key] = value
+
+            contents = {self.section: data} if self.section is not None else data
+            unchanged_by_others = signature == self.signature
+            atomic_write(self.path, json.dumps(contents, indent=2),
+                         fsync=self.writer.fsync if self.writer is not None else True)
+            if unchanged_by_others:
+                # Other processes' changes stay visible to changed() until the next load
+                self.signature = file_signature(self.path)
+
+class _FieldUpdate:
+    """Pending update of some fields of a stored object."""
+
+    def __init__(self, fields: Dict[str, Any]):
+        self.fields = dict(fields)
+
+    def apply(self, data: Dict[str, Any], key: str) -> None:
+        if isinstance(data.get(key), dict):
+            data[key].update(self.fields)
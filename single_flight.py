@@ -0,0 +1,134 @@
+"""
+Single-flight module for the Roblox Studio AI Plugin server.
+Coalesces concurrent identical calls: the first caller runs the call and
+the others wait for its result instead of repeating it.
+"""
+import asyncio
+import threading
+from typing import Dict, Any, Awaitable, Callable, Tuple
+import config
+
+class _Call:
+    """A call in flight and the callers waiting for it."""
+
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    def __init__(self, enabled: bool = True, timeout: float = 130):
+        self.enabled = enabled
+        # Seconds a caller waits for the call in flight before making its own
+        self.timeout = timeout
+        # key -> _Call
+        self.calls = {}
+        # key -> asyncio.Task of coroutine calls (one event loop per process)
+        self.tasks = {}
+        self.task_waiters = 0
+        self.stats = {
+            "calls": 0,
+            "coalesced": 0,
+            "timeouts": 0
+        }
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Run fn, or wait for the identical call already in flight.
+
+        Returns (result, whether it was shared from another caller's call).
+        Exceptions raised by the call are raised in every waiting caller.
+        """
+        if not self.enabled:
+            return fn(), False
+
+        with self._lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.stats["calls"] += 1
+            else:
+                call.waiters += 1
+                self.stats["coalesced"] += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self.calls[key]
+                call.done.set()
+            return call.result, False
+
+        finished = call.done.wait(self.timeout)
+        with self._lock:
+            call.waiters -= 1
+            if not finished:
+                self.stats["timeouts"] += 1
+        if not finished:
+            return fn(), False
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Like do(), for coroutine functions running on one event loop.
+
+        The shared call keeps running if the caller that started it is cancelled.
+        """
+        if not self.enabled:
+            return await fn(), False
+
+        with self._lock:
+            task = self.tasks.get(key)
+            leader = task is None
+            if leader:
+                task = self.tasks[key] = asyncio.ensure_future(fn())
+                task.add_done_callback(lambda _: self._finish(key, task))
+                self.stats["calls"] += 1
+            else:
+                self.task_waiters += 1
+                self.stats["coalesced"] += 1
+
+        if leader:
+            return await asyncio.shield(task), False
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.timeout), True
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.stats["timeouts"] += 1
+        finally:
+            with self._lock:
+                self.task_waiters -= 1
+        return await fn(), False
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        with self._lock:
+            self.tasks.pop(key, None)
+        # Retrieve the error, which nobody may await if the callers were cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get call counters and the calls and waiters currently in flight."""
+        with self._lock:
+            return dict(
+                self.stats,
+                enabled=self.enabled,
+                in_flight=len(self.calls) + len(self.tasks),
+                waiters=sum(call.waiters for call in self.calls.values()) + self.task_waiters
+            )
+
+# Create a singleton instance
+single_flight = SingleFlight(
+    enabled=config.config["SINGLE_FLIGHT_ENABLED"],
+    timeout=config.config["SINGLE_FLIGHT_TIMEOUT"]
+)
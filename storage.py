@@ -0,0 +1,735 @@
+"""
+Storage module for the Roblox Studio AI Plugin server.
+Pluggable backends for users, file metadata, request logs and chat history:
+whole-file JSON for small installs, or a single SQLite database in WAL mode.
+"""
+import os
+import sys
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Iterator, Tuple
+import config
+from persistence import writer
+from shared_state import SharedJsonFile, DELETED
+from history_store import new_summary, update_summary
+
+STORAGE_BACKENDS = ("json", "sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS revisions (
+    name TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    role TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_users_role ON users (role);
+
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    uploaded_by TEXT NOT NULL,
+    uploaded_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_type ON files (type, uploaded_at);
+CREATE INDEX IF NOT EXISTS idx_files_uploaded_by ON files (uploaded_by, uploaded_at);
+
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    username TEXT NOT NULL,
+    model TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs (timestamp);
+CREATE INDEX IF NOT EXISTS idx_logs_username ON logs (username, timestamp);
+
+CREATE TABLE IF NOT EXISTS conversations (
+    username TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    first_timestamp TEXT,
+    last_timestamp TEXT,
+    preview TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (username, conversation_id)
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (username, conversation_id, id);
+CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp);
+"""
+
+# Columns added after a table was first created: (table, column, definition)
+SCHEMA_COLUMNS = [
+    ("users", "revision", "INTEGER NOT NULL DEFAULT 0"),
+    ("conversations", "message_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("conversations", "first_timestamp", "TEXT"),
+    ("conversations", "last_timestamp", "TEXT"),
+    ("conversations", "preview", "TEXT NOT NULL DEFAULT ''"),
+]
+
+SCHEMA_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_users_revision ON users (revision);
+CREATE INDEX IF NOT EXISTS idx_conversations_last ON conversations (username, last_timestamp);
+"""
+
+class SqliteDatabase:
+    """A SQLite database in WAL mode with one connection per thread."""
+
+    def __init__(self, path: str, schema: str = SCHEMA, schema_columns: Optional[List[Tuple[str, str, str]]] = None,
+                 schema_indexes: str = SCHEMA_INDEXES):
+        self.path = path
+        self.schema = schema
+        self.schema_columns = SCHEMA_COLUMNS if schema_columns is None else schema_columns
+        self.schema_indexes = schema_indexes
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.migrate_schema()
+
+    def migrate_schema(self) -> None:
+        """Create missing tables, columns and indexes."""
+        conn = self.connection()
+        conn.executescript(self.schema)
+        for table, column, definition in self.schema_columns:
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+            if column not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        conn.executescript(self.schema_indexes)
+
+    def connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: transactions are opened explicitly in transaction()
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run statements in a single immediate transaction; nested calls join the outer one."""
+        conn = self.connection()
+        if conn.in_transaction:
+            yield conn
+            return
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def execute(self, sql: str, params: Tuple = ()) -> sqlite3.Cursor:
+        """Execute a single statement (auto-committed)."""
+        return self.connection().execute(sql, params)
+
+    def get_revision(self, name: str) -> int:
+        """Get the change counter of a table, bumped by every process that writes it."""
+        row = self.execute("SELECT revision FROM revisions WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def bump_revision(self, conn: sqlite3.Connection, name: str) -> Tuple[int, int]:
+        """Bump a table's change counter inside a transaction; returns (previous, new) revisions."""
+        row = conn.execute("SELECT revision FROM revisions WHERE name = ?", (name,)).fetchone()
+        previous = row[0] if row else 0
+        conn.execute("INSERT OR REPLACE INTO revisions (name, revision) VALUES (?, ?)", (name, previous + 1))
+        return previous, previous + 1
+
+class SqliteTableStore:
+    """Base for stores cached in memory by their callers, with cross-process change detection."""
+
+    table = ""
+
+    def __init__(self, db: SqliteDatabase):
+        self.db = db
+        # Revision of the table as last loaded or written by this process
+        self.revision = None
+
+    def changed(self) -> bool:
+        """Check if another process changed the table since it was last loaded or written."""
+        return self.db.get_revision(self.table) != self.revision
+
+    def _mark_loaded(self) -> None:
+        self.revision = self.db.get_revision(self.table)
+
+    def _mark_written(self, conn: sqlite3.Connection) -> int:
+        """Bump the table revision for a write; returns the revision to stamp changed rows with."""
+        previous, revision = self.db.bump_revision(conn, self.table)
+        if previous == self.revision:
+            # Changes from other processes stay visible to changed() until the next load
+            self.revision = revision
+        return revision
+
+class JsonUserStore:
+    """Users kept in a single JSON file, merged per user (through the write-behind queue) on change."""
+
+    def __init__(self, users_file: str):
+        self.users_file = users_file
+        self.file = SharedJsonFile(users_file, writer=writer)
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Load all users, or None if the file is missing or corrupted."""
+        return self.file.load()
+
+    def changed(self) -> bool:
+        """Check if another process changed the users since they were loaded."""
+        return self.file.changed()
+
+    def load_changes(self, current: Dict[str, Any]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Get the users that differ from `current` (None for deleted users).
+
+        Runs on the write-behind thread (see AuthManager.reload), so it merges
+        our own pending changes itself rather than waiting for the writer.
+        """
+        # Our own pending changes must land first, or they would look like deletions
+        self.file.merge_pending()
+        users = self.file.load()
+        if users is None:
+            return {}
+        changes = {username: user for username, user in users.items() if current.get(username) != user}
+        changes.update({username: None for username in current if username not in users})
+        return changes
+
+    def save_all(self, users: Dict[str, Any]) -> None:
+        """Replace all users."""
+        self.file.replace_all(users)
+
+    def upsert(self, user: Dict[str, Any]) -> None:
+        """Insert or update a single user."""
+        self.upsert_many([user])
+
+    def upsert_many(self, users: List[Dict[str, Any]]) -> None:
+        """Insert or update several users with one rewrite."""
+        self.file.update({user["username"]: user for user in users})
+
+    def update_fields(self, updates: Dict[str, Dict[str, Any]]) -> None:
+        """Update some fields of several users, keeping their other fields as stored."""
+        for username, fields in updates.items():
+            self.file.update_fields(username, fields)
+
+    def delete(self, username: str) -> None:
+        """Delete a single user."""
+        self.file.update({username: DELETED})
+
+    def save_changes(self, changes: Dict[str, Optional[Dict[str, Any]]]) -> None:
+        """Insert, update and delete (None) several users with one rewrite."""
+        self.file.update({username: DELETED if user is None else user for username, user in changes.items()})
+
+class SqliteUserStore(SqliteTableStore):
+    table = "users"
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Load all users, or None if there are none yet."""
+        self._mark_loaded()
+        rows = self.db.execute("SELECT data FROM users").fetchall()
+        if not rows:
+            return None
+        users = [json.loads(row[0]) for row in rows]
+        return {user["username"]: user for user in users}
+
+    def load_changes(self, current: Dict[str, Any]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Get the users written since the last load (None for deleted users), reading only those rows."""
+        since = self.revision or 0
+        self._mark_loaded()
+        rows = self.db.execute("SELECT data FROM users WHERE revision > ?", (since,)).fetchall()
+        changes = {user["username"]: user for user in (json.loads(row[0]) for row in rows)}
+
+        usernames = {row[0] for row in self.db.execute("SELECT username FROM users").fetchall()}
+        changes.update({username: None for username in current if username not in usernames})
+        return changes
+
+    def save_all(self, users: Dict[str, Any]) -> None:
+        """Replace all users."""
+        with self.db.transaction() as conn:
+            revision = self._mark_written(conn)
+            conn.execute("DELETE FROM users")
+            conn.executemany(
+                "INSERT INTO users (username, role, data, revision) VALUES (?, ?, ?, ?)",
+                [(user["username"], user.get("role", "User"), json.dumps(user), revision) for user in users.values()]
+            )
+
+    def upsert(self, user: Dict[str, Any]) -> None:
+        """Insert or update a single user."""
+        self.upsert_many([user])
+
+    def upsert_many(self, users: List[Dict[str, Any]]) -> None:
+        """Insert or update several users in one transaction."""
+        with self.db.transaction() as conn:
+            revision = self._mark_written(conn)
+            conn.executemany(
+                "INSERT OR REPLACE INTO users (username, role, data, revision) VALUES (?, ?, ?, ?)",
+                [(user["username"], user.get("role", "User"), json.dumps(user), revision) for user in users]
+            )
+
+    def update_fields(self, updates: Dict[str, Dict[str, Any]]) -> None:
+        """Update some fields of several users, keeping their other fields as stored."""
+        with self.db.transaction() as conn:
+            revision = self._mark_written(conn)
+            for username, fields in updates.items():
+                row = conn.execute("SELECT data FROM users WHERE username = ?", (username,)).fetchone()
+                if row is None:
+                    continue
+                user = json.loads(row[0])
+                user.update(fields)
+                conn.execute(
+                    "UPDATE users SET data = ?, revision = ? WHERE username = ?",
+                    (json.dumps(user), revision, username)
+                )
+
+    def delete(self, username: str) -> None:
+        """Delete a single user."""
+        self.save_changes({username: None})
+
+    def save_changes(self, changes: Dict[str, Optional[Dict[str, Any]]]) -> None:
+        """Insert, update and delete (None) several users in one transaction."""
+        with self.db.transaction() as conn:
+            revision = self._mark_written(conn)
+            conn.executemany(
+                "DELETE FROM users WHERE username = ?",
+                [(username,) for username, user in changes.items() if user is None]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO users (username, role, data, revision) VALUES (?, ?, ?, ?)",
+                [(username, user.get("role", "User"), json.dumps(user), revision)
+                 for username, user in changes.items() if user is not None]
+            )
+
+class JsonFileStore:
+    """File metadata kept in a single JSON file, merged per file (through the write-behind queue) on change."""
+
+    def __init__(self, metadata_file: str):
+        self.metadata_file = metadata_file
+        self.file = SharedJsonFile(metadata_file, section="files", writer=writer)
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Load all file metadata, or None if the file is missing or corrupted."""
+        return self.file.load()
+
+    def changed(self) -> bool:
+        """Check if another process changed the file metadata since it was loaded."""
+        return self.file.changed()
+
+    def save_all(self, files: Dict[str, Any]) -> None:
+        """Replace all file metadata."""
+        self.file.replace_all(files)
+
+    def upsert(self, file_metadata: Dict[str, Any]) -> None:
+        """Insert or update a single file's metadata."""
+        self.file.update({file_metadata["id"]: file_metadata})
+
+    def delete(self, file_id: str) -> None:
+        """Delete a single file's metadata."""
+        self.file.update({file_id: DELETED})
+
+class SqliteFileStore(SqliteTableStore):
+    table = "files"
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Load all file metadata."""
+        self._mark_loaded()
+        rows = self.db.execute("SELECT data FROM files").fetchall()
+        files = [json.loads(row[0]) for row in rows]
+        return {f["id"]: f for f in files}
+
+    def save_all(self, files: Dict[str, Any]) -> None:
+        """Replace all file metadata."""
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM files")
+            for file_metadata in files.values():
+                self._insert(conn, file_metadata)
+            self._mark_written(conn)
+
+    def _insert(self, conn: sqlite3.Connection, file_metadata: Dict[str, Any]) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO files (id, type, uploaded_by, uploaded_at, data) VALUES (?, ?, ?, ?, ?)",
+            (file_metadata["id"], file_metadata.get("type", "unknown"), file_metadata.get("uploaded_by", ""),
+             file_metadata.get("uploaded_at", ""), json.dumps(file_metadata))
+        )
+
+    def upsert(self, file_metadata: Dict[str, Any]) -> None:
+        """Insert or update a single file's metadata."""
+        with self.db.transaction() as conn:
+            self._insert(conn, file_metadata)
+            self._mark_written(conn)
+
+    def delete(self, file_id: str) -> None:
+        """Delete a single file's metadata."""
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+            self._mark_written(conn)
+
+class SqliteLogStore:
+    """Request logs in SQLite, queried through the timestamp and username indexes."""
+
+    def __init__(self, db: SqliteDatabase, retention_days: int = 0):
+        self.db = db
+        self.retention_days = retention_days
+
+    def load(self) -> List[Dict[str, Any]]:
+        """Nothing is kept in memory; logs are queried from the database."""
+        return []
+
+    def count(self) -> int:
+        """Number of records ever logged (ids are never reused)."""
+        row = self.db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'logs'").fetchone()
+        return row[0] if row else 0
+
+    def records_since(self, position: int) -> Optional[List[Dict[str, Any]]]:
+        """Records logged after the first `position` records."""
+        rows = self.db.execute("SELECT data FROM logs WHERE id > ? ORDER BY id", (position,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """Stream every record, oldest first."""
+        cursor = self.db.connection().execute("SELECT data FROM logs ORDER BY id")
+        for row in cursor:
+            yield json.loads(row[0])
+
+    def iter_range(self, username: Optional[str] = None, after: Optional[str] = None,
+                   start: Optional[str] = None, end: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Stream records matching the filters, oldest first (see ArchivedLogStore.iter_range)."""
+        conditions = []
+        params = []
+        for column_filter, value in (("username = ?", username), ("timestamp > ?", after),
+                                     ("timestamp >= ?", start), ("timestamp <= ?", end)):
+            if value is not None:
+                conditions.append(column_filter)
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        # Rows are fetched lazily, so memory does not grow with the result size
+        cursor = self.db.connection().execute(
+            f"SELECT data FROM logs {where} ORDER BY timestamp, id", tuple(params)
+        )
+        for row in cursor:
+            yield json.loads(row[0])
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Insert a record."""
+        self.db.execute(
+            "INSERT INTO logs (timestamp, username, model, data) VALUES (?, ?, ?, ?)",
+            (record.get("timestamp", ""), record.get("username", ""), record.get("model", ""), json.dumps(record))
+        )
+
+    def run_maintenance(self) -> None:
+        """Delete records older than the retention period."""
+        if self.retention_days <= 0:
+            return
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).isoformat()
+        self.db.execute("DELETE FROM logs WHERE timestamp < ?", (cutoff,))
+
+    def query(self, username: Optional[str] = None, limit: int = 100, offset: int = 0,
+              before: Optional[str] = None, after: Optional[str] = None,
+              start: Optional[str] = None, end: Optional[str] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """Get a page of records (newest first) and the number of matching records (see LogIndex.query)."""
+        conditions = []
+        params = []
+        for column_filter, value in (("username = ?", username), ("timestamp < ?", before),
+                                     ("timestamp > ?", after), ("timestamp >= ?", start),
+                                     ("timestamp <= ?", end)):
+            if value is not None:
+                conditions.append(column_filter)
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        total = self.db.execute(f"SELECT COUNT(*) FROM logs {where}", tuple(params)).fetchone()[0]
+
+        forward = bool(after and not before)
+        order = "ASC" if forward else "DESC"
+        rows = self.db.execute(
+            f"SELECT data FROM logs {where} ORDER BY timestamp {order}, id {order} LIMIT ? OFFSET ?",
+            tuple(params) + (max(limit, 0), max(offset, 0))
+        ).fetchall()
+        page = [json.loads(row[0]) for row in rows]
+        return (page[::-1] if forward else page), total
+
+class SqliteHistoryStore:
+    """Chat history in SQLite, one row per message."""
+
+    def __init__(self, db: SqliteDatabase, retention_days: int = 0):
+        self.db = db
+        self.retention_days = retention_days
+
+    def exists(self, username: str, conversation_id: str) -> bool:
+        """Check if a conversation exists."""
+        row = self.db.execute(
+            "SELECT 1 FROM conversations WHERE username = ? AND conversation_id = ?",
+            (username, conversation_id)
+        ).fetchone()
+        return row is not None
+
+    def append(self, username: str, conversation_id: str, message: Dict[str, Any]) -> None:
+        """Append a message to a conversation."""
+        self.append_many(username, conversation_id, [message])
+
+    def append_many(self, username: str, conversation_id: str, messages: List[Dict[str, Any]]) -> None:
+        """Append messages to a conversation in one transaction."""
+        if not messages:
+            return
+
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT message_count, first_timestamp, last_timestamp, preview FROM conversations "
+                "WHERE username = ? AND conversation_id = ?",
+                (username, conversation_id)
+            ).fetchone()
+            summary = new_summary()
+            if row is not None:
+                summary.update(zip(("message_count", "first_timestamp", "last_timestamp", "preview"), row))
+            update_summary(summary, messages)
+
+            conn.execute(
+                "INSERT OR REPLACE INTO conversations "
+                "(username, conversation_id, message_count, first_timestamp, last_timestamp, preview) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (username, conversation_id, summary["message_count"], summary["first_timestamp"],
+                 summary["last_timestamp"], summary["preview"])
+            )
+            conn.executemany(
+                "INSERT INTO messages (username, conversation_id, timestamp, data) VALUES (?, ?, ?, ?)",
+                [(username, conversation_id, message.get("timestamp", ""), json.dumps(message))
+                 for message in messages]
+            )
+
+    def get(self, username: str, conversation_id: str) -> List[Dict[str, Any]]:
+        """Get the messages of a single conversation."""
+        rows = self.db.execute(
+            "SELECT data FROM messages WHERE username = ? AND conversation_id = ? ORDER BY id",
+            (username, conversation_id)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def clear(self, username: str, conversation_id: str) -> bool:
+        """Delete the messages of a conversation, keeping the conversation itself."""
+        with self.db.transaction() as conn:
+            if not self.exists(username, conversation_id):
+                return False
+            conn.execute(
+                "DELETE FROM messages WHERE username = ? AND conversation_id = ?",
+                (username, conversation_id)
+            )
+            conn.execute(
+                "UPDATE conversations SET message_count = 0, first_timestamp = NULL, last_timestamp = NULL, "
+                "preview = '' WHERE username = ? AND conversation_id = ?",
+                (username, conversation_id)
+            )
+            return True
+
+    def list_summaries(self, username: str, limit: Optional[int] = None,
+                       before: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Get a page of a user's conversation summaries (newest first) and the next cursor."""
+        sql = ("SELECT conversation_id, message_count, first_timestamp, last_timestamp, preview "
+               "FROM conversations WHERE username = ? AND message_count > 0")
+        params = [username]
+        if before:
+            sql += " AND last_timestamp < ?"
+            params.append(before)
+        sql += " ORDER BY last_timestamp DESC"
+        if limit is not None:
+            # Fetch one extra row to know whether there is a next page
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+
+        rows = self.db.execute(sql, tuple(params)).fetchall()
+        summaries = [
+            dict(zip(("conversation_id", "message_count", "first_timestamp", "last_timestamp", "preview"), row))
+            for row in rows
+        ]
+        if limit is not None and len(summaries) > limit:
+            summaries = summaries[:limit]
+            return summaries, summaries[-1]["last_timestamp"] if summaries else None
+        return summaries, None
+
+    def list_conversation_ids(self, username: str) -> List[str]:
+        """List the conversation IDs of a user."""
+        rows = self.db.execute(
+            "SELECT conversation_id FROM conversations WHERE username = ?", (username,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def list_conversations(self, username: str) -> Dict[str, List[Dict[str, Any]]]:
+        """Get all conversations of a user."""
+        conversations = {conversation_id: [] for conversation_id in self.list_conversation_ids(username)}
+        rows = self.db.execute(
+            "SELECT conversation_id, data FROM messages WHERE username = ? ORDER BY id", (username,)
+        ).fetchall()
+        for conversation_id, data in rows:
+            conversations.setdefault(conversation_id, []).append(json.loads(data))
+        return conversations
+
+    def list_usernames(self) -> List[str]:
+        """List all users with stored history."""
+        return [row[0] for row in self.db.execute("SELECT DISTINCT username FROM conversations").fetchall()]
+
+    def iter_conversations(self) -> Iterator[Tuple[str, str, List[Dict[str, Any]]]]:
+        """Iterate over every stored conversation."""
+        rows = self.db.execute("SELECT username, conversation_id FROM conversations").fetchall()
+        for username, conversation_id in rows:
+            yield username, conversation_id, self.get(username, conversation_id)
+
+    def archive_idle(self, max_age_days: int) -> int:
+        """Idle conversations stay in the database; there is nothing to archive."""
+        return 0
+
+    def apply_retention(self, retention_days: int) -> int:
+        """Delete conversations whose last message is older than the retention period."""
+        if retention_days <= 0:
+            return 0
+        cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+        with self.db.transaction() as conn:
+            conn.execute(
+                "DELETE FROM messages WHERE (username, conversation_id) IN "
+                "(SELECT username, conversation_id FROM conversations WHERE last_timestamp < ?)",
+                (cutoff,)
+            )
+            return conn.execute("DELETE FROM conversations WHERE last_timestamp < ?", (cutoff,)).rowcount
+
+_database = None
+_database_lock = threading.Lock()
+
+def get_backend() -> str:
+    """Get the configured storage backend."""
+    backend = config.config["STORAGE_BACKEND"]
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Invalid storage backend: {backend}")
+    return backend
+
+def get_database() -> SqliteDatabase:
+    """Get the shared SQLite database."""
+    global _database
+    with _database_lock:
+        if _database is None:
+            _database = SqliteDatabase(config.config["SQLITE_FILE"])
+        return _database
+
+def create_user_store():
+    """Create the user store for the configured backend."""
+    if get_backend() == "sqlite":
+        return SqliteUserStore(get_database())
+    return JsonUserStore(config.config["USERS_FILE"])
+
+def create_file_store(metadata_file: str):
+    """Create the file metadata store for the configured backend."""
+    if get_backend() == "sqlite":
+        return SqliteFileStore(get_database())
+    return JsonFileStore(metadata_file)
+
+def create_log_store():
+    """Create the request log store for the configured backend."""
+    if get_backend() == "sqlite":
+        return SqliteLogStore(get_database(), retention_days=config.config["LOGS_RETENTION_DAYS"])
+
+    from archive import ArchivedLogStore
+    return ArchivedLogStore(
+        config.config["LOGS_FILE"],
+        config.config["ARCHIVE_DIR"],
+        legacy_logs_file=config.config["LEGACY_LOGS_FILE"],
+        fsync_policy=config.config["LOGS_FSYNC"],
+        fsync_interval=config.config["LOGS_FSYNC_INTERVAL"],
+        writer=writer,
+        rotate_max_bytes=config.config["LOGS_ROTATE_MAX_BYTES"],
+        rotate_max_age_days=config.config["LOGS_ROTATE_MAX_AGE_DAYS"],
+        retention_days=config.config["LOGS_RETENTION_DAYS"]
+    )
+
+def create_history_store():
+    """Create the chat history store for the configured backend."""
+    if get_backend() == "sqlite":
+        return SqliteHistoryStore(get_database())
+
+    from history_store import HistoryStore, migrate_json_history
+    history_dir = config.config["HISTORY_DIR"]
+    legacy_history_file = config.config["LEGACY_HISTORY_FILE"]
+    needs_migration = not os.path.isdir(history_dir) and os.path.exists(legacy_history_file)
+
+    store = HistoryStore(
+        history_dir,
+        cache_size=config.config["HISTORY_CACHE_SIZE"],
+        archive_dir=os.path.join(config.config["ARCHIVE_DIR"], "history"),
+        writer=writer
+    )
+    if needs_migration:
+        migrate_json_history(legacy_history_file, history_dir)
+    return store
+
+def migrate_json_to_sqlite(db_path: str) -> Tuple[bool, str]:
+    """Copy users, file metadata, logs and history from the JSON backend into a SQLite database."""
+    from archive import ArchivedLogStore
+    from history_store import HistoryStore
+
+    db = SqliteDatabase(db_path)
+    counts = {"users": 0, "files": 0, "logs": 0, "conversations": 0}
+
+    with db.transaction():
+        users = JsonUserStore(config.config["USERS_FILE"]).load() or {}
+        user_store = SqliteUserStore(db)
+        for username, user in users.items():
+            if isinstance(user, dict) and "username" in user:
+                user_store.upsert(user)
+                counts["users"] += 1
+
+        metadata_file = os.path.join(config.config["UPLOADS_DIR"], "metadata.json")
+        files = JsonFileStore(metadata_file).load() or {}
+        file_store = SqliteFileStore(db)
+        for file_metadata in files.values():
+            file_store.upsert(file_metadata)
+            counts["files"] += 1
+
+        json_logs = ArchivedLogStore(
+            config.config["LOGS_FILE"],
+            config.config["ARCHIVE_DIR"],
+            legacy_logs_file=config.config["LEGACY_LOGS_FILE"]
+        )
+        json_logs.load()
+        log_store = SqliteLogStore(db)
+        for record in json_logs.iter_records():
+            log_store.append(record)
+            counts["logs"] += 1
+
+        json_history = HistoryStore(
+            config.config["HISTORY_DIR"],
+            cache_size=0,
+            archive_dir=os.path.join(config.config["ARCHIVE_DIR"], "history")
+        )
+        history_store = SqliteHistoryStore(db)
+        for username, conversation_id, messages in json_history.iter_conversations():
+            if history_store.exists(username, conversation_id):
+                continue
+            db.execute(
+                "INSERT OR IGNORE INTO conversations (username, conversation_id) VALUES (?, ?)",
+                (username, conversation_id)
+            )
+            history_store.append_many(username, conversation_id, messages)
+            counts["conversations"] += 1
+
+    return True, (f"Migrated {counts['users']} users, {counts['files']} files, "
+                  f"{counts['logs']} log entries and {counts['conversations']} conversations to '{db_path}'")
+
+if __name__ == "__main__":
+    # Usage: python storage.py migrate [sqlite_path]
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("Usage: python storage.py migrate [sqlite_path]")
+        sys.exit(1)
+
+    target = sys.argv[2] if len(sys.argv) > 2 else config.config["SQLITE_FILE"]
+    success, message = migrate_json_to_sqlite(target)
+    print(message)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,19 @@
+"""
+Shared test setup: makes the server modules importable from the tests, with
+their data files in a temporary directory.
+"""
+import os
+import sys
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp(prefix="plugin-tests-")
+for key, name in [("USERS_FILE", "users.json"), ("ROLES_FILE", "roles.json"), ("LOGS_FILE", "logs.jsonl"),
+                  ("LEGACY_LOGS_FILE", "logs.json"), ("HISTORY_DIR", "history"),
+                  ("LEGACY_HISTORY_FILE", "history.json"), ("UPLOADS_DIR", "uploads"),
+                  ("ARCHIVE_DIR", "archive"), ("SEARCH_INDEX_FILE", "search_index.jsonl"),
+                  ("USAGE_STATS_FILE", "usage_stats.json"), ("SQLITE_FILE", "plugin.db"),
+                  ("SHARED_STATE_FILE", "shared_state.db")]:
+    os.environ.setdefault(key, os.path.join(DATA_DIR, name))
+os.environ.setdefault("PERSISTENCE_MODE", "sync")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,80 @@
+"""
+Tests for the /generate request handling in app.py.
+"""
+import pytest
+import app as server
+
+def test_generation_of_removed_user_gets_default_role(monkeypatch):
+    monkeypatch.setattr(server.auth_manager, "get_user", lambda username: None)
+    generation = server.build_generation({"prompt": "make a part"}, "ghost", None, True)
+    assert generation["role"] == "User"
+
+@pytest.fixture
+def client(monkeypatch):
+    server.auth_manager.add_user("batcher", "User")
+    server.auth_manager.rate_limiter.reset_user("batcher")
+    yield server.app.test_client()
+    server.auth_manager.remove_user("batcher")
+
+def fake_generate(provider, model, messages, use_cache=True, role=None):
+    prompt = messages[-1]["content"]
+    if prompt == "explode":
+        raise RuntimeError("boom")
+    return True, f"-- {prompt}", {}
+
+def test_batch_over_rate_limit_is_rejected_up_front(client):
+    response = client.post("/generate_batch", json={"username": "batcher", "prompts": ["x"] * 40})
+    assert response.status_code == 413
+    assert response.json["max_items"] == 20
+    # Nothing was charged
+    assert server.auth_manager.rate_limiter.get_usage("batcher") is None
+
+def test_batch_item_failure_is_reported_per_item(client, monkeypatch):
+    monkeypatch.setattr(server.ai_provider, "generate_response", fake_generate)
+    response = client.post("/generate_batch", json={
+        "username": "batcher", "prompts": ["one", "explode", "three"], "parallelism": 2
+    })
+    assert response.status_code == 200
+    assert response.json["failed"] == 1
+    results = response.json["results"]
+    assert [result["status"] for result in results] == [200, 500, 200]
+    assert results[1]["error"] == "generation_error"
+
+def test_stream_with_every_provider_down_is_unavailable(client, monkeypatch):
+    monkeypatch.setattr(server.ai_provider, "stream_response",
+                        lambda *args, **kwargs: (False, "Provider 'openrouter' is temporarily unavailable",
+                                                 iter(()), {"retry_after": 12}))
+    response = client.post("/generate", json={"username": "batcher", "prompt": "make a part", "stream": True})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "12"
+    assert response.json["error"] == "provider_unavailable"
+
+@pytest.mark.parametrize("stream", [["sse"], {"format": "sse"}, 1, "xml"])
+def test_invalid_stream_option_is_rejected(client, stream):
+    response = client.post("/generate", json={"username": "batcher", "prompt": "make a part", "stream": stream})
+    assert response.status_code == 400
+    assert response.json["error"] == "invalid_stream"
+
+def overflow_on(prompt):
+    build = server.context_builder.build
+
+    def fake_build(model, system_prompt, item_prompt, conversation, workspace_context=""):
+        if item_prompt == prompt:
+            raise server.ContextOverflow("no room for the prompt")
+        return build(model, system_prompt, item_prompt, conversation, workspace_context)
+    return fake_build
+
+def test_batch_with_overflowing_item_is_not_charged(client, monkeypatch):
+    monkeypatch.setattr(server.context_builder, "build", overflow_on("too long"))
+    response = client.post("/generate_batch", json={"username": "batcher", "prompts": ["one", "too long"]})
+    assert response.status_code == 400
+    assert response.json["error"] == "context_overflow"
+    assert response.json["index"] == 1
+    assert server.auth_manager.rate_limiter.get_usage("batcher") is None
+
+def test_overflowing_prompt_is_not_charged(client, monkeypatch):
+    monkeypatch.setattr(server.context_builder, "build", overflow_on("too long"))
+    response = client.post("/generate", json={"username": "batcher", "prompt": "too long"})
+    assert response.status_code == 400
+    assert response.json["error"] == "context_overflow"
+    assert server.auth_manager.rate_limiter.get_usage("batcher") is None
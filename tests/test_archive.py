@@ -0,0 +1,80 @@
+"""
+Tests for log rotation, archive segments and compaction.
+"""
+import pytest
+from archive import LogArchive, ArchivedLogStore
+
+def records(count, start=0, username="alice"):
+    return [{"timestamp": f"2024-01-01T00:00:{i:02d}", "username": username, "prompt": f"p{i}"}
+            for i in range(start, start + count)]
+
+def archived_prompts(archive_dir):
+    """Prompts of every archived record, as a restarted worker would read them."""
+    return sorted(record["prompt"] for record in LogArchive(str(archive_dir)).iter_records())
+
+def test_compaction_merges_segments(tmp_path):
+    archive = LogArchive(str(tmp_path))
+    archive.write_segment(records(3))
+    archive.write_segment(records(3, start=3))
+
+    assert archive.compact(10 * 1024 * 1024) == 2
+    assert len(archive.segments) == 1
+    assert archived_prompts(tmp_path) == sorted(f"p{i}" for i in range(6))
+
+def test_compaction_crash_before_manifest_keeps_sources(tmp_path, monkeypatch):
+    archive = LogArchive(str(tmp_path))
+    archive.write_segment(records(3))
+    archive.write_segment(records(3, start=3))
+
+    def crash():
+        raise OSError("crashed")
+    monkeypatch.setattr(archive, "save_manifest", crash)
+    with pytest.raises(OSError):
+        archive.compact(10 * 1024 * 1024)
+
+    assert archived_prompts(tmp_path) == sorted(f"p{i}" for i in range(6))
+
+def test_compaction_crash_before_deleting_sources_keeps_records_once(tmp_path, monkeypatch):
+    archive = LogArchive(str(tmp_path))
+    archive.write_segment(records(3))
+    archive.write_segment(records(3, start=3))
+
+    def crash(segment):
+        raise OSError("crashed")
+    monkeypatch.setattr(archive, "_delete_segment_file", crash)
+    with pytest.raises(OSError):
+        archive.compact(10 * 1024 * 1024)
+
+    assert archived_prompts(tmp_path) == sorted(f"p{i}" for i in range(6))
+
+def test_rotation_runs_in_background(tmp_path):
+    store = ArchivedLogStore(str(tmp_path / "logs.jsonl"), str(tmp_path / "archive"), rotate_max_bytes=200)
+    store.load()
+    for record in records(5):
+        store.append(record)
+    store._rotation.wait()
+
+    assert store.archive.segments
+    logs, total = store.query(limit=100)
+    assert total == 5
+    assert sorted(log["prompt"] for log in logs) == [f"p{i}" for i in range(5)]
+
+def test_rotation_by_another_worker(tmp_path):
+    paths = (str(tmp_path / "logs.jsonl"), str(tmp_path / "archive"))
+    first, second = ArchivedLogStore(*paths), ArchivedLogStore(*paths)
+    first.load()
+    second.load()
+    for record in records(3):
+        first.append(record)
+    for record in records(2, start=3, username="bob"):
+        second.append(record)
+
+    first.rotate()
+    second.append(records(1, start=5)[0])
+
+    logs, total = second.query(limit=100)
+    assert total == 6
+    assert sorted(log["prompt"] for log in logs) == [f"p{i}" for i in range(6)]
+    assert second.count() == 6
+    assert second.records_since(5) == records(1, start=5)
+    assert len(list(second.iter_records())) == 6
@@ -0,0 +1,110 @@
+"""
+Tests for the aiohttp server and async provider clients.
+"""
+import asyncio
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+import async_server
+from app import auth_manager
+from async_provider import AsyncProviderClient
+from ai_provider import OpenAIClient
+from resilience import ProviderError
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_flask_streams_are_relayed():
+    auth_manager.add_user("exporter", "Admin")
+
+    async def export():
+        async with TestClient(TestServer(async_server.create_app())) as client:
+            response = await client.get("/export", params={"admin_username": "exporter"})
+            return response.status, response.headers.get("Transfer-Encoding"), await response.text()
+
+    try:
+        status, encoding, _ = run(export())
+    finally:
+        auth_manager.remove_user("exporter")
+    assert status == 200
+    # Not buffered into one body with a Content-Length
+    assert encoding == "chunked"
+
+def test_flask_errors_are_passed_through():
+    async def missing():
+        async with TestClient(TestServer(async_server.create_app())) as client:
+            response = await client.get("/export")
+            return response.status, await response.json()
+
+    status, body = run(missing())
+    assert status == 400
+    assert body["error"] == "missing_admin"
+
+def provider_client(api_base):
+    return AsyncProviderClient(OpenAIClient("openrouter", {"api_base": api_base}))
+
+def test_overlong_stream_line_is_a_provider_error():
+    async def long_line(request):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(b"data: " + b"x" * 1024 * 1024 + b"\n\n")
+        return response
+
+    async def stream():
+        app = web.Application()
+        app.router.add_post("/chat/completions", long_line)
+        async with TestServer(app) as server:
+            client = provider_client(str(server.make_url("")))
+            try:
+                chunks = await client.stream("model", [{"role": "user", "content": "hi"}], (5, 5))
+                async for _ in chunks:
+                    pass
+            finally:
+                await client.close()
+
+    with pytest.raises(ProviderError) as error:
+        run(stream())
+    assert "Invalid response" in error.value.message
+
+def stream_events(body):
+    async def handler(request):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(body)
+        return response
+
+    async def stream():
+        app = web.Application()
+        app.router.add_post("/chat/completions", handler)
+        async with TestServer(app) as server:
+            client = provider_client(str(server.make_url("")))
+            parts = []
+            try:
+                chunks = await client.stream("model", [{"role": "user", "content": "hi"}], (5, 5))
+                async for chunk in chunks:
+                    parts.append(chunk)
+            finally:
+                await client.close()
+            return parts
+
+    return run(stream())
+
+def test_stream_ending_without_done_is_a_retryable_error():
+    event = b'data: {"choices": [{"delta": {"content": "Hel"}}]}\n\n'
+    assert stream_events(event + b"data: [DONE]\n\n") == ["Hel"]
+
+    with pytest.raises(ProviderError) as error:
+        stream_events(event)
+    assert error.value.retryable
+
+def test_session_of_a_finished_loop_is_closed():
+    client = provider_client("http://localhost")
+
+    async def session():
+        return client._session()
+
+    first = run(session())
+    second = run(session())
+    assert first is not second
+    assert first.closed
+    run(client.close())
@@ -0,0 +1,35 @@
+"""
+Tests for user usage tracking and reloads in auth.py.
+"""
+import threading
+import auth
+from auth import auth_manager
+from persistence import WriteBehindWriter
+
+def test_request_publishes_new_user_records():
+    auth_manager.add_user("counter", "User")
+    try:
+        users = auth_manager.users
+        user = users["counter"]
+        success, _, _ = auth_manager.record_request("counter")
+        assert success
+        # Readers holding the old snapshot see it unchanged
+        assert auth_manager.users is not users
+        assert user["request_count"] == 0
+        assert auth_manager.users["counter"]["request_count"] == 1
+    finally:
+        auth_manager.remove_user("counter")
+
+def test_reload_runs_on_the_writer_thread(monkeypatch):
+    writer = WriteBehindWriter("group", flush_interval=0.01)
+    monkeypatch.setattr(auth, "writer", writer)
+    monkeypatch.setitem(auth.config.config, "USERS_RELOAD_INTERVAL", 1)
+    monkeypatch.setattr(auth_manager, "_next_reload", 0.0)
+    threads = []
+    monkeypatch.setattr(auth_manager, "reload", lambda: threads.append(threading.current_thread().name))
+    try:
+        auth_manager.is_authorized("nobody")
+        assert writer.flush(timeout=5)
+        assert threads == ["write-behind"]
+    finally:
+        writer.close()
@@ -0,0 +1,27 @@
+"""
+Tests for token-budgeted message assembly.
+"""
+import pytest
+from context_builder import ContextBuilder, ContextOverflow
+
+def builder(budget):
+    return ContextBuilder({"default": {"chars_per_token": 4, "budget": budget}})
+
+def test_truncate_keeps_a_prefix_when_the_marker_does_not_fit():
+    assert builder(100).truncate("hello world again", 2, "default") == "hello"
+
+def test_long_system_prompt_is_cut_to_fit_the_budget():
+    messages, tokens = builder(40).build("model", "system " * 100, "make a red part " * 20, [])
+    assert tokens["system_truncated"] and tokens["prompt_truncated"]
+    assert tokens["total"] <= tokens["budget"]
+    assert messages[-1]["content"].startswith("make a red part")
+
+def test_short_prompt_keeps_room_next_to_a_long_system_prompt():
+    messages, tokens = builder(40).build("model", "system " * 100, "make a part", [])
+    assert messages[-1]["content"] == "make a part"
+    assert not tokens["prompt_truncated"]
+    assert tokens["total"] <= tokens["budget"]
+
+def test_budget_without_room_for_the_prompt_is_rejected():
+    with pytest.raises(ContextOverflow):
+        builder(8).build("model", "system prompt", "make a part", [])
@@ -0,0 +1,62 @@
+"""
+Tests for hedged provider requests.
+"""
+import time
+import threading
+from hedging import Hedger
+
+def slow(result, seconds):
+    def call():
+        time.sleep(seconds)
+        return result
+    return call
+
+def test_fast_primary_is_not_hedged():
+    hedger = Hedger(enabled=True, default_budget=1.0)
+    assert hedger.race("tester", 0.5, slow("primary", 0), slow("hedge", 0)) == ("primary", False)
+    assert hedger.stats["hedged"] == 0
+
+def test_hedge_wins_against_slow_primary():
+    hedger = Hedger(enabled=True, default_budget=1.0)
+    started = time.monotonic()
+    assert hedger.race("tester", 0.05, slow("primary", 1.0), slow("hedge", 0)) == ("hedge", True)
+    assert time.monotonic() - started < 0.5
+    assert hedger.stats["hedge_wins"] == 1
+
+def test_hedge_denied_by_budget_waits_for_primary():
+    hedger = Hedger(enabled=True, default_budget=0.0)
+    assert hedger.race("tester", 0.01, slow("primary", 0.1), slow("hedge", 0)) == ("primary", False)
+    assert hedger.stats["budget_denied"] == 1
+
+def test_hedges_do_not_wait_behind_primaries():
+    hedger = Hedger(enabled=True, default_budget=1.0, max_workers=1, max_primaries=4)
+    release = threading.Event()
+    blockers = [threading.Thread(target=hedger.race, args=("tester", 10, release.wait, slow("hedge", 0)))
+                for _ in range(3)]
+    for blocker in blockers:
+        blocker.start()
+
+    try:
+        started = time.monotonic()
+        assert hedger.race("tester", 0.05, slow("primary", 1.0), slow("hedge", 0)) == ("hedge", True)
+        assert time.monotonic() - started < 0.5
+    finally:
+        release.set()
+        for blocker in blockers:
+            blocker.join()
+
+def test_full_primary_pool_runs_unhedged_on_calling_thread():
+    hedger = Hedger(enabled=True, default_budget=1.0, max_primaries=1)
+    release = threading.Event()
+    blocker = threading.Thread(target=hedger.race, args=("tester", 10, release.wait, slow("hedge", 0)))
+    blocker.start()
+    time.sleep(0.05)
+
+    try:
+        caller = threading.current_thread()
+        assert hedger.race("tester", 0.01, lambda: threading.current_thread() is caller,
+                           slow(False, 0)) == (True, False)
+        assert hedger.stats["primary_pool_full"] == 1
+    finally:
+        release.set()
+        blocker.join()
@@ -0,0 +1,71 @@
+"""
+Tests for the per-user conversation index of the JSONL history store.
+"""
+import json
+import os
+import history_store
+from history_store import HistoryStore
+
+def message(role, content, timestamp):
+    return {"role": role, "content": content, "timestamp": timestamp}
+
+def add_turns(store, count, conversation_id="c1"):
+    for turn in range(count):
+        store.append_many("alice", conversation_id, [
+            message("user", f"prompt {turn}", f"2026-01-01T00:{turn:02d}:00"),
+            message("assistant", f"answer {turn}", f"2026-01-01T00:{turn:02d}:30")
+        ])
+
+def test_appends_are_journaled_not_rewritten(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    add_turns(store, 3)
+
+    assert not os.path.exists(store.summary_path("alice"))
+    summaries, _ = HistoryStore(str(tmp_path)).list_summaries("alice")
+    assert len(summaries) == 1
+    assert summaries[0]["message_count"] == 6
+    assert summaries[0]["preview"] == "prompt 0"
+    assert summaries[0]["last_timestamp"] == "2026-01-01T00:02:30"
+
+def test_journal_is_folded_into_the_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(history_store, "SUMMARY_JOURNAL_MIN_BYTES", 512)
+    store = HistoryStore(str(tmp_path))
+    add_turns(store, 20)
+
+    with open(store.summary_path("alice")) as f:
+        snapshot = json.load(f)
+    assert snapshot["generation"] >= 1
+    assert os.path.getsize(store.journal_path("alice")) < 1024
+    summaries, _ = HistoryStore(str(tmp_path)).list_summaries("alice")
+    assert summaries[0]["message_count"] == 40
+
+def test_journal_already_in_the_snapshot_is_skipped(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    add_turns(store, 2)
+    # Compaction stopped after writing the snapshot, before resetting the journal
+    summaries, generation = store._read_index("alice")
+    with open(store.summary_path("alice"), "w") as f:
+        json.dump({"generation": generation + 1, "summaries": summaries}, f)
+
+    summaries, _ = HistoryStore(str(tmp_path)).list_summaries("alice")
+    assert summaries[0]["message_count"] == 4
+
+def test_index_without_generation_is_still_read(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    add_turns(store, 1)
+    os.remove(store.journal_path("alice"))
+    with open(store.summary_path("alice"), "w") as f:
+        json.dump({"c1": dict(history_store.new_summary(), message_count=7)}, f)
+
+    summaries, _ = HistoryStore(str(tmp_path)).list_summaries("alice")
+    assert summaries[0]["message_count"] == 7
+
+def test_returned_messages_are_not_changed_by_later_appends(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    add_turns(store, 1)
+    first = store.get("alice", "c1")
+    cached = store.get("alice", "c1")
+
+    add_turns(store, 1)
+    assert len(first) == len(cached) == 2
+    assert len(store.get("alice", "c1")) == 4
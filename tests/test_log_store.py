@@ -0,0 +1,22 @@
+"""
+Tests for the append-only JSONL log store.
+"""
+import json
+from log_store import JsonlLogStore, migrate_json_logs
+
+def test_appends_are_read_back_in_order(tmp_path):
+    store = JsonlLogStore(str(tmp_path / "logs.jsonl"), fsync_policy="never")
+    store.append({"timestamp": "1", "prompt": "one"})
+    store.append_many([{"timestamp": "2", "prompt": "two"}, {"timestamp": "3", "prompt": "three"}])
+    assert [record["prompt"] for record in JsonlLogStore(store.path).load()] == ["one", "two", "three"]
+
+def test_legacy_logs_are_migrated_oldest_first(tmp_path):
+    legacy = tmp_path / "logs.json"
+    legacy.write_text(json.dumps({"logs": [{"timestamp": "2", "prompt": "b"}, {"timestamp": "1", "prompt": "a"}]}))
+    target = str(tmp_path / "logs.jsonl")
+
+    success, _ = migrate_json_logs(str(legacy), target)
+    assert success
+    assert [record["prompt"] for record in JsonlLogStore(target).load()] == ["a", "b"]
+    # Never overwrites an existing log
+    assert not migrate_json_logs(str(legacy), target)[0]
@@ -0,0 +1,31 @@
+"""
+Tests for the per-user rate limiter backends.
+"""
+import pytest
+from rate_limiter import RateLimiter, SharedRateLimiter
+
+@pytest.fixture(params=["memory", "shared"])
+def limiter(request, tmp_path):
+    if request.param == "shared":
+        return SharedRateLimiter(str(tmp_path / "shared_state.db"), default_rate=20)
+    return RateLimiter(default_rate=20)
+
+def test_batch_is_charged_all_or_none(limiter):
+    assert limiter.acquire("alice", "User", 1000, {}, count=15)[0]
+    allowed, _, retry_after = limiter.acquire("alice", "User", 1000, {}, count=10)
+    assert not allowed
+    assert retry_after > 0
+    assert limiter.get_usage("alice")["daily_used"] == 15
+
+def test_over_capacity_request_is_denied_without_retry(limiter):
+    allowed, message, retry_after = limiter.acquire("alice", "User", 1000, {}, count=40)
+    assert not allowed
+    assert retry_after == 0
+    assert "20" in message
+
+def test_capacity_is_the_smallest_limit(limiter):
+    assert limiter.capacity("alice", "User", 1000) == 20
+    assert limiter.capacity("alice", "User", 5) == 5
+
+def test_disabled_limiter_has_no_capacity():
+    assert RateLimiter(enabled=False).capacity("alice", "User", 1000) is None
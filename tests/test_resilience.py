@@ -0,0 +1,92 @@
+"""
+Tests for provider deadlines and circuit breakers.
+"""
+import time
+import pytest
+from resilience import CircuitBreaker, CallTimeout, Resilience, ProviderError, check_deadline
+
+def open_breaker():
+    breaker = CircuitBreaker(window=4, min_calls=2, error_rate=0.5, cooldown=0)
+    breaker.record(True, 0.1)
+    breaker.record(True, 0.1)
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+def test_breaker_opens_after_failures_and_rejects():
+    breaker = CircuitBreaker(window=4, min_calls=2, error_rate=0.5, cooldown=60)
+    breaker.record(True, 0.1)
+    assert breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+def test_half_open_trial_closes_on_success_and_reopens_on_failure():
+    breaker = open_breaker()
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # One trial call at a time
+    assert not breaker.allow()
+    breaker.record(False, 0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker = open_breaker()
+    assert breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.state == CircuitBreaker.OPEN
+
+def test_half_open_trial_is_not_closed_by_a_bad_request():
+    breaker = open_breaker()
+    assert breaker.allow()
+    breaker.record_error(ProviderError("bad request", "test", status=400), 0.1)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # The trial slot is free again
+    assert breaker.allow()
+
+def fail_midway():
+    yield "first"
+    raise ProviderError("connection reset", "test", retryable=True)
+
+def test_stream_outcome_is_recorded_when_it_ends():
+    resilience = Resilience(max_attempts=1)
+    breaker = resilience.breaker("test")
+    breaker.state, breaker.opened_at, breaker.cooldown = CircuitBreaker.OPEN, 0.0, 0
+
+    chunks = resilience.call("test", lambda timeout: fail_midway(), (1, 1), stream=True)
+    # Opening the stream says nothing yet
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert next(chunks) == "first"
+    with pytest.raises(ProviderError):
+        next(chunks)
+    assert breaker.state == CircuitBreaker.OPEN
+
+def test_abandoned_stream_releases_the_trial():
+    resilience = Resilience(max_attempts=1)
+    breaker = resilience.breaker("test")
+    breaker.state, breaker.opened_at, breaker.cooldown = CircuitBreaker.OPEN, 0.0, 0
+
+    chunks = resilience.call("test", lambda timeout: iter(["one", "two"]), (1, 1), stream=True)
+    assert next(chunks) == "one"
+    chunks.close()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+def test_deadline_is_checked_while_reading():
+    check_deadline(CallTimeout(1, 1, time.monotonic() + 60), "test")
+    check_deadline((1, 1), "test")
+    with pytest.raises(ProviderError) as error:
+        check_deadline(CallTimeout(1, 1, time.monotonic() - 1), "test")
+    assert error.value.retryable
+
+def test_long_retry_after_is_not_slept_through():
+    resilience = Resilience(max_attempts=3, base_delay=0, max_delay=1)
+    calls = []
+
+    def rate_limited(timeout):
+        calls.append(timeout)
+        raise ProviderError("rate limited", "test", retryable=True, retry_after=120)
+
+    start = time.monotonic()
+    with pytest.raises(ProviderError):
+        resilience.call("test", rate_limited, (1, 1))
+    assert len(calls) == 1
+    assert time.monotonic() - start < 1
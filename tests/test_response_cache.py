@@ -0,0 +1,23 @@
+"""
+Tests for the near-duplicate tier of the response cache.
+"""
+from response_cache import ResponseCache, NearDuplicateIndex
+
+def test_similar_prompt_is_answered_from_the_cache():
+    cache = ResponseCache(near=NearDuplicateIndex(threshold=0.5))
+    cache.set("key", "ollama", "mistral", "local part = Instance.new('Part')", "scope",
+              "Create a red part in the workspace")
+    content, similarity = cache.get_near("scope", "create a red part in the workspace!")
+    assert content == "local part = Instance.new('Part')"
+    assert similarity == 1.0
+    assert cache.get_near("other scope", "Create a red part in the workspace") is None
+
+def test_storing_a_prompt_again_replaces_its_entry():
+    near = NearDuplicateIndex()
+    cache = ResponseCache(near=near)
+    for content in ("first", "second", "third"):
+        cache.set("key", "ollama", "mistral", content, "scope", "Create a red part in the workspace")
+
+    assert len(near.entries) == 1
+    assert all(len(bucket) == 1 for bucket in near.buckets.values())
+    assert cache.get_near("scope", "Create a red part in the workspace")[0] == "third"
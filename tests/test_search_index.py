@@ -0,0 +1,90 @@
+"""
+Tests for the search index journal shared between workers.
+"""
+import json
+import search_index
+from search_index import SearchIndex
+
+def message(content, timestamp="2024-01-01T00:00:00"):
+    return {"role": "user", "content": content, "timestamp": timestamp}
+
+def test_workers_assign_distinct_ids(tmp_path):
+    path = str(tmp_path / "index.jsonl")
+    first, second = SearchIndex(path), SearchIndex(path)
+
+    first_id = first.add_message("alice", "c1", message("spawn a Part"))
+    second_id = second.add_message("bob", "c2", message("spawn a Model"))
+    assert first_id != second_id
+
+    reloaded = SearchIndex(path)
+    assert reloaded.load() == 2
+    assert reloaded.total_length == first.docs[first_id]["length"] + second.docs[second_id]["length"]
+
+def test_search_sees_other_workers_documents(tmp_path):
+    path = str(tmp_path / "index.jsonl")
+    first, second = SearchIndex(path), SearchIndex(path)
+    first.add_message("alice", "c1", message("workspace.SpawnLocation"))
+
+    results, total = second.search("spawnlocation")
+    assert total == 1
+    assert results[0]["username"] == "alice"
+
+    # Reading back its own entries does not count them twice
+    first.search("spawnlocation")
+    assert len(first.docs) == 1
+
+def test_removal_applies_to_other_workers(tmp_path):
+    path = str(tmp_path / "index.jsonl")
+    first, second = SearchIndex(path), SearchIndex(path)
+    first.add_message("alice", "c1", message("tween the door"))
+    second.add_message("alice", "c1", message("tween the window"))
+
+    assert first.remove_conversation("alice", "c1") == 2
+    assert second.search("tween") == ([], 0)
+
+def test_partial_line_is_read_once_complete(tmp_path):
+    path = tmp_path / "index.jsonl"
+    index = SearchIndex(str(path))
+    index.add_message("alice", "c1", message("raycast params"))
+
+    line = (json.dumps({"op": "add", "doc": {"id": "other-1", "kind": "message", "username": "bob",
+                                             "conversation_id": "c2", "timestamp": "", "snippet": "raycast",
+                                             "length": 1}, "terms": {"raycast": 1}}) + "\n")
+    with open(path, "a") as f:
+        f.write(line[:20])
+    assert index.search("raycast")[1] == 1
+
+    with open(path, "a") as f:
+        f.write(line[20:])
+    assert index.search("raycast")[1] == 2
+
+def test_compaction_drops_deleted_documents(tmp_path, monkeypatch):
+    monkeypatch.setattr(search_index, "COMPACT_MIN_DEAD", 2)
+    path = str(tmp_path / "index.jsonl")
+    first, second = SearchIndex(path), SearchIndex(path)
+    first.add_message("alice", "keep", message("humanoid walkspeed"))
+    for i in range(3):
+        first.add_message("alice", "drop", message(f"humanoid jump {i}"))
+    first.remove_conversation("alice", "drop")
+
+    with open(path) as f:
+        assert len(f.readlines()) == 1
+
+    # The other worker notices the replaced journal and reloads it
+    assert second.search("humanoid")[1] == 1
+    second.add_message("bob", "c2", message("humanoid health"))
+    assert first.search("humanoid")[1] == 2
+
+def test_rebuild_is_done_once(tmp_path):
+    path = str(tmp_path / "index.jsonl")
+    logs = [{"username": "alice", "prompt": "make a gui", "response": "ScreenGui", "timestamp": "t1"}]
+    first = SearchIndex(path)
+    assert first.rebuild(logs, []) == 1
+
+    def fail():
+        raise AssertionError("the index was rebuilt twice")
+        yield
+
+    second = SearchIndex(path)
+    assert second.rebuild(fail(), []) == 1
+    assert second.search("screengui")[1] == 1
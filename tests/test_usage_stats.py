@@ -0,0 +1,100 @@
+"""
+Tests for the usage statistics rollups.
+"""
+import json
+import threading
+from usage_stats import UsageRollup
+
+def entry(username="alice", model="mistral"):
+    return {"timestamp": "2024-01-01T10:00:00", "username": username, "model": model}
+
+def test_concurrent_saves_keep_a_valid_file(tmp_path):
+    path = tmp_path / "usage_stats.json"
+    rollup = UsageRollup(str(path), save_interval=0)
+    errors = []
+
+    def work():
+        try:
+            for _ in range(50):
+                rollup.record(entry())
+                rollup.maybe_save()
+                rollup.save()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    rollup.save()
+    assert json.loads(path.read_text())["total_requests"] == 400
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["usage_stats.json", "usage_stats.json.lock"]
+
+def test_failed_save_does_not_raise_and_retries(tmp_path):
+    blocker = tmp_path / "not_a_directory"
+    blocker.write_text("")
+    rollup = UsageRollup(str(blocker / "usage_stats.json"), save_interval=0)
+    rollup.record(entry())
+
+    assert rollup.save() is False
+    rollup.maybe_save()
+    assert rollup._dirty
+
+def test_load_restores_counters(tmp_path):
+    path = str(tmp_path / "usage_stats.json")
+    rollup = UsageRollup(path)
+    rollup.record(entry())
+    rollup.record(entry(username="bob"))
+    rollup.save()
+
+    loaded = UsageRollup(path)
+    assert loaded.load()
+    assert loaded.get_stats()["user_counts"] == {"alice": 1, "bob": 1}
+
+class FakeLogStore:
+    """Log store whose oldest records were deleted by retention."""
+
+    def __init__(self, expired, records):
+        self.expired = expired
+        self.records = records
+
+    def count(self):
+        return self.expired + len(self.records)
+
+    def records_since(self, position):
+        if position < self.expired:
+            return None
+        return self.records[position - self.expired:]
+
+    def iter_records(self):
+        return iter(self.records)
+
+def test_restart_after_rebuild_does_not_count_kept_records_twice(tmp_path):
+    path = str(tmp_path / "usage_stats.json")
+    store = FakeLogStore(expired=5, records=[entry(), entry(username="bob")])
+    UsageRollup(path).catch_up(store)
+
+    store.records.append(entry(username="carol"))
+    restarted = UsageRollup(path)
+    restarted.catch_up(store)
+    assert restarted.get_stats()["user_counts"] == {"alice": 1, "bob": 1, "carol": 1}
+    assert restarted.position == 8
+
+def test_workers_add_their_counts_to_the_shared_file(tmp_path):
+    path = str(tmp_path / "usage_stats.json")
+    store = FakeLogStore(expired=0, records=[entry()])
+    first, second = UsageRollup(path), UsageRollup(path)
+    first.catch_up(store)
+    second.catch_up(store)
+
+    first.record(entry(username="bob"))
+    second.record(entry(username="carol"))
+    assert first.save() and second.save()
+
+    saved = json.loads((tmp_path / "usage_stats.json").read_text())
+    assert saved["user_counts"] == {"alice": 1, "bob": 1, "carol": 1}
+    assert saved["position"] == 3
+    assert second.get_stats()["total_requests"] == 3
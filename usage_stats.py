@@ -0,0 +1,206 @@
+"""
+Usage statistics module for the Roblox Studio AI Plugin server.
+Maintains request counters incrementally so stats never rescan the logs.
+"""
+import sys
+import json
+import time
+import threading
+from contextlib import nullcontext
+from typing import Dict, Optional, Any, Iterable
+from persistence import atomic_write
+from shared_state import file_lock
+
+COUNT_FIELDS = ("model_counts", "user_counts", "day_counts", "hour_counts")
+
+def empty_counters() -> Dict[str, Any]:
+    """Counters with nothing counted yet."""
+    # position: records of the log store counted so far (see count() of the log stores);
+    # unlike total_requests, it includes records that retention deleted before a rebuild
+    counters = {"total_requests": 0, "position": 0}
+    counters.update({field: {} for field in COUNT_FIELDS})
+    return counters
+
+def add_counters(counters: Dict[str, Any], delta: Dict[str, Any]) -> None:
+    """Add the counts of `delta` to `counters` in place."""
+    counters["total_requests"] += delta["total_requests"]
+    counters["position"] += delta["position"]
+    for field in COUNT_FIELDS:
+        counts = counters[field]
+        for key, count in delta[field].items():
+            counts[key] = counts.get(key, 0) + count
+
+class UsageRollup:
+    """Request counters shared by the workers of a node.
+
+    Each worker keeps the requests it counted since its last save as pending
+    deltas and adds them to the stats file under an exclusive file lock, so
+    workers never overwrite each other's counts.
+    """
+
+    def __init__(self, stats_file: str, save_interval: float = 5.0, writer: Optional[Any] = None):
+        self.stats_file = stats_file
+        self.save_interval = save_interval
+        # Optional WriteBehindWriter; periodic saves then happen off the request thread
+        self.writer = writer
+        self._lock = threading.Lock()
+        # Serializes this process's saves, so pending deltas are added in order
+        self._save_lock = threading.Lock()
+        self._last_save = 0.0
+        self._pending = empty_counters()
+        # Set by a rebuild: the next save replaces the file instead of adding to it
+        self._replace = False
+        self.reset()
+
+    @property
+    def total_requests(self) -> int:
+        return self._counters["total_requests"]
+
+    @property
+    def position(self) -> int:
+        return self._counters["position"]
+
+    @property
+    def _dirty(self) -> bool:
+        return self._replace or self._pending["position"] > 0
+
+    def reset(self) -> None:
+        """Reset all counters."""
+        self._counters = empty_counters()
+
+    def _read(self) -> Optional[Dict[str, Any]]:
+        """Read the stats file (None if missing, or saved without a log position)."""
+        try:
+            with open(self.stats_file, "r") as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError):
+            return None
+        if "position" not in data:
+            return None
+
+        counters = empty_counters()
+        counters.update({key: data[key] for key in counters if key in data})
+        return counters
+
+    def _load(self) -> bool:
+        counters = self._read()
+        if counters is None:
+            return False
+        with self._lock:
+            add_counters(counters, self._pending)
+            self._counters = counters
+        return True
+
+    def load(self) -> bool:
+        """Load counters from the stats file (False if missing, or saved without a log position)."""
+        with file_lock(self.stats_file, shared=True):
+            return self._load()
+
+    def _save(self, locked: bool) -> bool:
+        with self._lock:
+            pending, self._pending = self._pending, empty_counters()
+            replace, self._replace = self._replace, False
+            self._last_save = time.monotonic()
+        if not replace and pending["position"] == 0:
+            return True
+
+        try:
+            with nullcontext() if locked else file_lock(self.stats_file):
+                counters = empty_counters() if replace else self._read() or empty_counters()
+                add_counters(counters, pending)
+                atomic_write(self.stats_file, json.dumps(counters),
+                             fsync=self.writer.fsync if self.writer is not None else True)
+        except OSError as e:
+            with self._lock:
+                # Keep the deltas, including any counted meanwhile, for the next save
+                add_counters(pending, self._pending)
+                self._pending = pending
+                self._replace = self._replace or replace
+            print(f"Error saving usage stats: {str(e)}", file=sys.stderr)
+            return False
+
+        with self._lock:
+            # Now includes other workers' counts; requests counted during the save are still pending
+            add_counters(counters, self._pending)
+            self._counters = counters
+        return True
+
+    def save(self) -> bool:
+        """Add the pending counts to the stats file; returns whether they were written.
+
+        Errors are reported, not raised: the counts stay pending and are saved
+        again later.
+        """
+        with self._save_lock:
+            return self._save(locked=False)
+
+    def maybe_save(self) -> None:
+        """Save counters if the save interval has elapsed."""
+        with self._lock:
+            due = self._dirty and time.monotonic() - self._last_save >= self.save_interval
+            if due:
+                # Claims this save, so concurrent requests do not save too
+                self._last_save = time.monotonic()
+        if not due:
+            return
+        if self.writer is not None:
+            # The save reads the pending counts itself; the queued data is unused
+            self.writer.replace(self.stats_file, "", lambda _: self.save())
+        else:
+            self.save()
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        """Count a single log entry."""
+        # Timestamps are ISO 8601, so the day and hour are fixed-width prefixes
+        timestamp = entry.get("timestamp", "")
+        delta = {
+            "total_requests": 1,
+            "position": 1,
+            "model_counts": {entry.get("model", ""): 1},
+            "user_counts": {entry.get("username", ""): 1},
+            "day_counts": {timestamp[:10]: 1},
+            "hour_counts": {timestamp[:13].replace("T", " ") + ":00": 1}
+        }
+        with self._lock:
+            add_counters(self._counters, delta)
+            add_counters(self._pending, delta)
+
+    def rebuild(self, entries: Iterable[Dict[str, Any]], position: int) -> None:
+        """Recompute all counters from the given log entries, which end at a log position.
+
+        The next save replaces the stats file with them.
+        """
+        with self._lock:
+            self.reset()
+            self._pending = empty_counters()
+            self._replace = True
+        for entry in entries:
+            self.record(entry)
+        with self._lock:
+            self._counters["position"] = self._pending["position"] = position
+
+    def catch_up(self, log_store) -> None:
+        """Load the counters and count the records logged since, or rebuild them from the log store."""
+        # One worker at a time, so records logged since the last save are counted once
+        with self._save_lock, file_lock(self.stats_file):
+            # The position counts expired records too, so records kept by retention are not counted twice
+            position = log_store.count()
+            if not self._load() or self.position > position:
+                self.rebuild(log_store.iter_records(), position)
+            else:
+                # Count entries logged after the rollups were last saved
+                pending = log_store.records_since(self.position)
+                if pending is None:
+                    self.rebuild(log_store.iter_records(), position)
+                else:
+                    for entry in pending:
+                        self.record(entry)
+            self._save(locked=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get a copy of the current counters."""
+        with self._lock:
+            stats = {key: dict(value) if isinstance(value, dict) else value
+                     for key, value in self._counters.items()}
+        del stats["position"]
+        return stats